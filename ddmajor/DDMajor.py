@@ -1,20 +1,52 @@
 import asyncio
+import contextlib
+import functools
 import logging
 import threading
+import time
+
+from pathlib import Path
+from typing import AsyncIterator
 
 import bilibili_api as biliapi
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from ddmajor.logging import logger
-from .component.live_asr import ComponentASR
-from .component.keynote import ComponentKeynote
+from ddmajor.logging import bind, logger
+from .component import COMPONENTS, load_components
+from .component.DDMajorInterface import DDMajorInterface
+
+
+_startup_slots: threading.BoundedSemaphore | None = None
+_startup_slots_lock = threading.Lock()
+
+
+def startup_slots(limit: int) -> threading.BoundedSemaphore:
+    # shared by every task thread, the first task decides the limit
+    global _startup_slots
+
+    with _startup_slots_lock:
+        if _startup_slots is None:
+            _startup_slots = threading.BoundedSemaphore(max(1, limit))
+        return _startup_slots
+
+
+class DDMajor(DDMajorInterface):
+
+    # DDMajor(config, cred) returns an instance of a subclass mixing in only the
+    # components configured for the task, e.g. DDMajor[live_asr,keynote]
+
+    def __new__(cls, config: dict, *args, **kwargs):
+        if cls is DDMajor:
+            kinds = {c.get("type", "") for c in config.get("task", {}).get("components", [])}
 
+            for kind in sorted(kinds - set(COMPONENTS)):
+                logger.warning(f"unknown component type: {kind}")
+
+            cls = _task_class(frozenset(kinds & set(COMPONENTS)))
+
+        return super().__new__(cls)
 
-class DDMajor(
-    ComponentASR,
-    ComponentKeynote,
-):
 
     def __init__(self, config: dict, bili_cred: biliapi.Credential, **kwargs) -> None:
         self._thread = None # type: ignore
@@ -25,13 +57,32 @@ class DDMajor(
         self.config: dict = config
         self.dd_name: str = config.get("task", {}).get("name", "unknown")
         self.logger = logger.getChild(f"({self.dd_name})")
+        bind(self.logger, task=self.dd_name, room=config.get("task", {}).get("room_id"))
 
         self.scheduler = None # type: ignore
         self.bili_cred = bili_cred
 
+        self.data_dir = Path(config.get("data_dir", ".ddmajor")).expanduser()
+        self.data_dir.mkdir(parents=True, exist_ok=True)
 
-    def update_cred(self, bili_cred: biliapi.Credential) -> None:
-        self.bili_cred = bili_cred
+        self.startup_timing: dict[str, float] = {}
+        self.ready = threading.Event()
+
+
+    @contextlib.asynccontextmanager
+    async def startup_phase(self, name: str) -> AsyncIterator[None]:
+        # initial checks of all tasks share a few slots instead of hitting the api at once
+        slots = startup_slots(int(self.config.get("startup_concurrency", 4)))
+
+        while not slots.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            slots.release()
+            self.startup_timing[name] = time.perf_counter() - begin
 
 
     async def _init_async(self, **kwargs) -> None:
@@ -51,7 +102,12 @@ class DDMajor(
 
     async def run_async(self) -> None:
 
-        await self._init_async(**self._kwargs)
+        begin = time.perf_counter()
+        try:
+            await self._init_async(**self._kwargs)
+        finally:
+            self.startup_timing["init"] = time.perf_counter() - begin
+            self.ready.set()
 
         while True:
             await asyncio.sleep(60) # keep running
@@ -70,6 +126,8 @@ class DDMajor(
 
             try:
                 self._event_loop.run_until_complete(main_task)
+            except asyncio.CancelledError:
+                pass # stopped
             except Exception as e:
                 self.logger.warn(f"main task: {e}")
                 pass
@@ -92,35 +150,100 @@ class DDMajor(
                     pass
 
 
-    def stop(self) -> None:
+    async def _reconfigure_async(self, config: dict) -> None:
+        self.config = config
+        await super()._reconfigure_async(config)
 
-        if self._thread:
 
-            self.logger.debug("interupt signal received")
+    def reconfigure(self, config: dict, timeout: float = 30) -> None:
+        # from another thread, components pick up what changed without restarting the stream
+        asyncio.run_coroutine_threadsafe(self._reconfigure_async(config), self._event_loop).result(timeout)
 
-            if not self._thread.is_alive(): return
 
-            try:
-                pending = self._background_tasks
+    def resources(self) -> dict:
+        # from another thread, counters are read as they are without stopping the task
+        report = {
+            "alive": bool(self._thread and self._thread.is_alive()),
+            "background_tasks": len(self._background_tasks),
+        }
+        self._collect_resources(report)
 
-                self.logger.debug("send cancel signal to pending tasks")
-                for task in pending:
-                    task.cancel()
+        return report
 
-                if pending:
-                    self.logger.debug("wait pending tasks to stop")
-                    async def _wait_cancel() -> None:
-                        await asyncio.gather(*pending, return_exceptions=False)
 
-                    self._event_loop.run_until_complete(_wait_cancel())
+    async def _shutdown(self, timeout: float) -> dict:
+        # on the task loop: components drain first, then whatever is left gets cancelled
+        report: dict = {}
 
-                self.logger.debug("shutdown event loop", self._event_loop.shutdown_asyncgens())
+        if self.scheduler: self.scheduler.shutdown(wait=False)
 
-            except Exception as e:
-                self.logger.error(f"Error during shutdown: {e}")
+        try:
+            await asyncio.wait_for(self._stop_async(report), timeout)
+        except asyncio.TimeoutError:
+            report["timeout"] = True
+            self.logger.error(f"components did not drain within {timeout:.1f}s")
+        except Exception:
+            self.logger.exception("failed to stop components")
 
+        main, *pending = self._background_tasks
+        for task in pending:
+            task.cancel()
 
-            try:
-                self._thread.join(timeout=1)
-            except Exception:
-                pass
+        if pending:
+            await asyncio.wait(pending, timeout=1)
+        report["cancelled"] = len(pending)
+
+        main.cancel() # run() returns once the main task is done
+        return report
+
+
+    def stop(self, timeout: float = 10) -> dict:
+        # from another thread, bounded by timeout: stop components, cancel the rest, join
+
+        if not self._thread or not self._thread.is_alive(): return {}
+
+        self.logger.debug("interupt signal received")
+
+        begin = time.monotonic()
+        report = {}
+
+        try:
+            # leave a share of the deadline for cancelling and joining
+            future = asyncio.run_coroutine_threadsafe(self._shutdown(timeout * 0.8), self._event_loop)
+            report = future.result(timeout)
+        except Exception as e:
+            self.logger.error(f"shutdown did not finish: {e!r}")
+
+        self._thread.join(max(0, timeout - (time.monotonic() - begin)))
+
+        if self._thread.is_alive():
+            self.logger.error(f"task did not stop within {timeout}s")
+        else:
+            drained = ", ".join(f"{k} {v}" for k, v in report.items())
+            self.logger.info(f"stopped in {time.monotonic() - begin:.2f}s" + (f": {drained}" if drained else ""))
+
+        return report
+
+
+@functools.cache
+def _task_class(kinds: frozenset[str]) -> type[DDMajor]:
+    mixins = load_components(set(kinds))
+    name = "DDMajor[" + ",".join(k for k in COMPONENTS if k in kinds) + "]"
+    return type(name, (DDMajor, *mixins), {})
+
+
+def format_startup_report(dd_list: list[DDMajor], elapsed: float) -> str:
+    from .component import import_times
+
+    phases = ["init", "check_online", "danmaku", "check_replay"]
+    lines = [f"{'task':<16}" + "".join(f"{p:>14}" for p in phases)]
+
+    for dd in dd_list:
+        cells = [f"{dd.startup_timing[p]:>13.2f}s" if p in dd.startup_timing else f"{'-':>14}" for p in phases]
+        lines.append(f"{dd.dd_name:<16}" + "".join(cells))
+
+    if import_times:
+        lines.append("imports " + ", ".join(f"{k} {v:.2f}s" for k, v in import_times.items()))
+
+    lines.append(f"{len(dd_list)} tasks ready in {elapsed:.2f}s")
+    return "\n".join(lines)
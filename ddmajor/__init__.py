@@ -1,3 +1,4 @@
 from . import logging
 from . import credential
+from . import http
 from .DDMajor import DDMajor
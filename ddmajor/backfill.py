@@ -0,0 +1,158 @@
+import asyncio
+import json
+import time
+
+from datetime import datetime
+from pathlib import Path
+
+import bilibili_api as biliapi
+
+from ddmajor.cache import atomic_write_json
+from ddmajor.component.keynote import parse_live_date
+from ddmajor.DDMajor import DDMajor
+from ddmajor.logging import logger
+
+
+REPLAY_SERIES = "直播回放"
+
+
+async def list_replays(user: biliapi.user.User, since: datetime | None, until: datetime | None) -> list[dict]:
+    # archives of the replay series, newest first, whose live date is in [since, until)
+    channels = await user.get_channel_list()
+    series_list = channels.get("items_lists", {}).get("series_list", [])
+
+    series_id = None
+    for series in series_list:
+        meta = series.get("meta", {})
+        if meta.get("name", "") == REPLAY_SERIES:
+            series_id = meta.get("series_id")
+            break
+
+    if series_id is None:
+        raise RuntimeError(f"no '{REPLAY_SERIES}' series found for uid {user.get_uid()}")
+
+    replays = []
+    pn = 1
+
+    while True:
+        page = await user.get_channel_videos_series(sid=int(series_id), pn=pn, ps=100)
+        archives = page.get("archives", [])
+        if not archives: break
+
+        older = False
+
+        for archive in archives:
+            live_date = parse_live_date(archive.get("title", ""))
+            if not live_date: continue
+
+            if since and live_date < since:
+                older = True
+                continue
+            if until and live_date >= until:
+                continue
+
+            replays.append({"aid": archive["aid"], "title": archive.get("title", ""), "live_date": live_date})
+
+        if older: break # archives are sorted by date, nothing newer afterwards
+        pn += 1
+
+    return replays
+
+
+class BackfillState:
+
+    # aid -> "done" / error message, so an interrupted backfill resumes where it stopped
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.items: dict[str, str] = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.items = json.load(f)
+
+
+    def is_done(self, aid: int) -> bool:
+        return self.items.get(str(aid)) == "done"
+
+
+    def set(self, aid: int, status: str) -> None:
+        self.items[str(aid)] = status
+        atomic_write_json(self.path, self.items)
+
+
+def format_report(stats: dict, elapsed: float) -> str:
+    lines = [f"{'stage':<12}{'count':>8}{'total(s)':>12}{'avg(s)':>10}{'per min':>10}"]
+
+    for name in ["match", "subtitle", "highlight", "summarize", "comment", "replay"]:
+        if name not in stats: continue
+        count, seconds = stats[name]
+        lines.append(
+            f"{name:<12}{count:>8}{seconds:>12.1f}{seconds / max(count, 1):>10.2f}"
+            f"{count / max(elapsed, 1e-9) * 60:>10.2f}"
+        )
+
+    lines.append(f"wall time {elapsed:.1f}s")
+    return "\n".join(lines)
+
+
+async def backfill(
+    dd: DDMajor, since: datetime | None = None, until: datetime | None = None,
+    parallel: int = 1, dry_run: bool = False, retry_failed: bool = False,
+) -> dict:
+
+    task: dict = dd.config.get("task", {})
+    component = next((c for c in task.get("components", []) if c.get("type", "") == "keynote"), None)
+
+    if component is None:
+        raise ValueError(f"keynote component is not configured for task {dd.dd_name}")
+
+    biliapi.select_client("aiohttp")
+
+    dd._event_loop = asyncio.get_running_loop()
+    dd.setup_keynote(task, component)
+
+    replays = await list_replays(dd._keynote_user, since, until)
+    state = BackfillState(dd.data_dir.joinpath("backfill", f"{task.get('room_id')}.json"))
+
+    todo = []
+    for replay in reversed(replays): # oldest first
+        if state.is_done(replay["aid"]): continue
+        if not retry_failed and state.items.get(str(replay["aid"]), "").startswith("error"): continue
+        todo.append(replay)
+
+    dd.logger.info(f"找到{len(replays)}个回放，其中{len(todo)}个待处理")
+
+    stats: dict = {}
+
+    if dry_run:
+        for replay in todo:
+            print(f"{replay['aid']}\t{replay['live_date']:%Y-%m-%d %H:%M}\t{replay['title']}")
+        return stats
+
+    semaphore = asyncio.Semaphore(max(1, parallel))
+    begin = time.perf_counter()
+
+    async def _process(replay: dict) -> None:
+        async with semaphore:
+            video = biliapi.video.Video(aid=replay["aid"], credential=dd.bili_cred)
+            start = time.perf_counter()
+
+            try:
+                detail = await dd.get_view(video)
+                handled = await dd.process_replay(video, detail, stats, wait_vod=True)
+                state.set(replay["aid"], "done" if handled else "incomplete")
+            except Exception as e:
+                dd.logger.exception(f"failed to process {replay['aid']}")
+                state.set(replay["aid"], f"error: {e}")
+            finally:
+                item = stats.setdefault("replay", [0, 0.0])
+                item[0] += 1
+                item[1] += time.perf_counter() - start
+
+    await asyncio.gather(*[_process(replay) for replay in todo])
+
+    logger.info("backfill finished:\n" + format_report(stats, time.perf_counter() - begin))
+
+    return stats
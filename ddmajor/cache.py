@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Hashable
+from urllib.parse import urlsplit
+
+import ddmajor.http
+
+from ddmajor.logging import logger
+
+
+def atomic_write_json(path: Path, obj: object, **kwargs) -> None:
+    # threads of one process may write the same file, each gets a temp file of its own
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, **kwargs)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp, path)
+
+
+class SubtitleCache:
+
+    # bilibili ai subtitle urls carry a short-lived auth_key in the query string, so
+    # entries are keyed by cid and the url path only
+
+    def __init__(self, root: str | Path, ttl: float = 7 * 86400, expire: float = 30 * 86400) -> None:
+        self.root   = Path(root)
+        self.ttl    = ttl    # served without touching the network
+        self.expire = expire # removed by prune()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+
+
+    def _path(self, cid: int | str, url: str) -> Path:
+        parts = urlsplit(url)
+        digest = hashlib.sha1(f"{parts.netloc}{parts.path}".encode()).hexdigest()[:16]
+        return self.root.joinpath(str(cid), f"{digest}.json")
+
+
+    def _load(self, path: Path) -> dict | None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"drop broken cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+
+
+    def _save(self, path: Path, entry: dict) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(path, entry)
+
+
+    def lookup(self, cid: int | str) -> list[dict] | None:
+        # fresh body of any subtitle url known for this cid, avoids even asking for the url
+        folder = self.root.joinpath(str(cid))
+        if not folder.is_dir(): return None
+
+        now = time.time()
+
+        for path in folder.glob("*.json"):
+            entry = self._load(path)
+            if entry and now - entry.get("fetched_at", 0) < self.ttl:
+                return entry.get("body", [])
+
+        return None
+
+
+    async def fetch(self, cid: int | str, url: str) -> list[dict]:
+        path  = self._path(cid, url)
+        entry = self._load(path)
+        now   = time.time()
+
+        if entry and now - entry.get("fetched_at", 0) < self.ttl:
+            return entry.get("body", [])
+
+        headers = {}
+        if entry:
+            if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            resp = await ddmajor.http.get(url, headers=headers)
+        except Exception:
+            if entry: # serve stale rather than fail the whole pipeline
+                logger.warning(f"failed to revalidate subtitle of cid {cid}, use cached one")
+                return entry.get("body", [])
+            raise
+
+        if resp.status == 304 and entry:
+            entry["fetched_at"] = now
+            self._save(path, entry)
+            return entry.get("body", [])
+
+        if resp.status != 200:
+            raise RuntimeError(f"[{resp.status}] failed to get subtitle of cid {cid}")
+
+        body = resp.json().get("body", [])
+
+        if body: # subtitle may be generated later, do not cache an empty one
+            self._save(path, {
+                "cid": cid,
+                "url": url,
+                "fetched_at": now,
+                "etag": resp.headers.get("ETag", ""),
+                "last_modified": resp.headers.get("Last-Modified", ""),
+                "body": body,
+            })
+
+        return body
+
+
+    def prune(self) -> int:
+        count = 0
+        now = time.time()
+
+        for path in self.root.glob("*/*.json"):
+            try:
+                if now - path.stat().st_mtime > self.expire:
+                    path.unlink()
+                    count += 1
+            except FileNotFoundError:
+                pass
+
+        return count
+
+
+class TTLCache:
+
+    # shared by all tasks of the process (one thread and loop per task), in-flight
+    # lookups are coalesced per loop since futures cannot be awaited across loops
+
+    def __init__(self, name: str, ttl: float) -> None:
+        self.name = name
+        self.ttl  = ttl
+
+        self._lock = threading.Lock()
+        self._data: dict[Hashable, tuple[float, Any]] = {}
+        self._inflight: dict[tuple[int, Hashable], asyncio.Future] = {}
+        self._stats: dict[str, list[int]] = {} # owner -> [hits, misses, coalesced]
+
+
+    def _count(self, owner: str, field: int) -> None:
+        with self._lock:
+            self._stats.setdefault(owner, [0, 0, 0])[field] += 1
+
+
+    async def get(self, key: Hashable, factory: Callable[[], Awaitable[Any]], owner: str = "") -> Any:
+        now = time.monotonic()
+
+        with self._lock:
+            item = self._data.get(key)
+
+        if item and item[0] > now:
+            self._count(owner, 0)
+            return item[1]
+
+        loop = asyncio.get_running_loop()
+        inflight_key = (id(loop), key)
+
+        if (inflight := self._inflight.get(inflight_key)):
+            self._count(owner, 2)
+            return await asyncio.shield(inflight)
+
+        self._count(owner, 1)
+
+        future = loop.create_future()
+        self._inflight[inflight_key] = future
+
+        try:
+            value = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # retrieved, waiters (if any) still get it
+            raise
+        else:
+            future.set_result(value)
+
+            with self._lock:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+                if len(self._data) > 4096: self._evict()
+
+            return value
+        finally:
+            self._inflight.pop(inflight_key, None)
+
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        self._data = {k: v for k, v in self._data.items() if v[0] > now}
+
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+    def pop_stats(self, owner: str = "") -> tuple[int, int, int]:
+        with self._lock:
+            hits, misses, coalesced = self._stats.pop(owner, [0, 0, 0])
+        return hits, misses, coalesced
+
+
+_api_caches: dict[str, TTLCache] = {}
+_api_caches_lock = threading.Lock()
+
+
+def api_cache(name: str, ttl: float | None = None) -> TTLCache:
+    with _api_caches_lock:
+        cache = _api_caches.get(name)
+
+        if cache is None:
+            cache = _api_caches[name] = TTLCache(name, ttl if ttl is not None else 60)
+        elif ttl is not None:
+            cache.ttl = ttl
+
+    return cache
@@ -1,54 +1,253 @@
 import argparse
+import asyncio
 import json
+import signal
+import sys
 import time
 
-import ddmajor
-
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
 
-def main():
-    parser = argparse.ArgumentParser()
-    # parser.add_argument("--room", "-r", type=int, help="live room id", required=True)
-    parser.add_argument("--config", "-c", type=str, help="config json file", required=True)
-    parser.add_argument("--level", "-l", type=str.lower, choices=ddmajor.logging.choices, default="info", help="log level")
+import ddmajor
 
-    args: argparse.Namespace = parser.parse_args()
 
-    ddmajor.logging.set_level(args.level)
+def load_config(fn: str) -> dict:
     logger = ddmajor.logging.logger
 
     try:
-        with open(args.config, "r", encoding="utf-8") as f:
-            config: dict = json.load(f)
+        with open(fn, "r", encoding="utf-8") as f:
+            return json.load(f)
     except json.JSONDecodeError as e:
-        logger.critical(f'❌ 配置文件"{args.config}"解析失败：{e}')
+        logger.critical(f'❌ 配置文件"{fn}"解析失败：{e}')
         exit(1)
     except Exception as e:
         logger.critical(f"❌ 解析配置文件时出错: {e}")
         exit(1)
 
-    single_config = config.copy()
-    dd_list = []
 
-    try:
-        ddmajor.credential.init_credential(config["bili_credential"])
-        ddmajor.credential.check_and_rotate_credential(config, args.config)
+def parse_date(s: str) -> datetime:
+    return datetime.fromisoformat(s).replace(tzinfo=ZoneInfo("Asia/Shanghai"))
+
+
+def run(args: argparse.Namespace, config: dict) -> None:
+    from ddmajor import live_api
+    from ddmajor.DDMajor import format_startup_report
+    from ddmajor.resources import Monitor
+    from ddmajor.supervisor import Supervisor
+
+    logger = ddmajor.logging.logger
+
+    # cookies are refreshed in place on their own thread, tasks start once the first check is done
+    credentials = ddmajor.credential.init_credential(config["bili_credential"], args.config)
+    credentials.start()
+    credentials.checked.wait(timeout=30)
+
+    begin = time.perf_counter()
+
+    # every task starts its own thread right away, initial checks share startup_concurrency slots
+    supervisor = Supervisor(args.config, config, ddmajor.credential.get_credential)
+    dd_list = supervisor.start_all()
+
+    deadline = time.monotonic() + 120
+    for dd in dd_list:
+        dd.ready.wait(timeout=max(0, deadline - time.monotonic()))
 
-        tasks = single_config.pop("tasks")
+    logger.info("startup:\n" + format_startup_report(dd_list, time.perf_counter() - begin))
 
-        for k in range(len(tasks)):
-            single_config.update({"task": tasks[k]})
-            dd = ddmajor.DDMajor(single_config, ddmajor.credential.get_credential())
-            dd.run()
-            dd_list.append(dd)
+    live_api.start(config.get("live_api", {}))
 
+    # data_dir/resources.json is rewritten every resource_interval and on SIGUSR1 (`ddmajor dump`)
+    monitor = Monitor(Path(config.get("data_dir", ".ddmajor")).expanduser(), lambda: supervisor.tasks.values())
+    monitor.start()
+
+    reload_interval = float(config.get("reload_interval", 5))
+    last_dump = time.monotonic()
+
+    try:
         while True:
-            time.sleep(1800)
-            ddmajor.credential.check_and_rotate_credential(config, args.config, dd_list)
+            time.sleep(reload_interval if reload_interval > 0 else 60)
+
+            if reload_interval > 0:
+                supervisor.check()
+
+            resource_interval = float(supervisor.config.get("resource_interval", 300))
+            if resource_interval > 0 and time.monotonic() - last_dump >= resource_interval:
+                last_dump = time.monotonic()
+                monitor.dump()
+    finally:
+        supervisor.stop_all(float(supervisor.config.get("shutdown_timeout", 10)))
+        live_api.stop()
+        monitor.close()
+
+
+def backfill(args: argparse.Namespace, config: dict) -> None:
+    from ddmajor.backfill import backfill as _backfill
+    from ddmajor.supervisor import task_config
+
+    logger = ddmajor.logging.logger
+
+    tasks = [
+        task for task in config.get("tasks", [])
+        if (args.task and task.get("name") == args.task) or (args.room and str(task.get("room_id")) == str(args.room))
+    ]
+
+    if not tasks:
+        logger.critical("❌ 没有找到对应的任务，请使用--task或--room指定")
+        exit(1)
+
+    credentials = ddmajor.credential.init_credential(config["bili_credential"], args.config)
+    credentials.start()
+    credentials.checked.wait(timeout=30)
+
+    dd = ddmajor.DDMajor(task_config(config, tasks[0]), ddmajor.credential.get_credential())
+
+    asyncio.run(_backfill(
+        dd,
+        since=parse_date(args.since) if args.since else None,
+        until=parse_date(args.until) if args.until else None,
+        parallel=args.parallel,
+        dry_run=args.dry_run,
+        retry_failed=args.retry_failed,
+    ))
+
+
+def search(args: argparse.Namespace, config: dict) -> None:
+    from ddmajor.search import transcript_index
+
+    index = transcript_index(Path(config.get("data_dir", ".ddmajor")).expanduser().joinpath("transcripts.db"))
+
+    if args.reindex:
+        folders = set()
+        for task in config.get("tasks", []):
+            for component in task.get("components", []):
+                for key in ["output_dir", "search_dir"]:
+                    if component.get(key): folders.add(component[key])
+
+        for folder in sorted(folders):
+            files, cues = index.ingest_dir(folder)
+            print(f"indexed {cues} cues from {files} files in {folder}")
+
+    begin = time.perf_counter()
+    hits = index.search(args.query, room=args.room or None, limit=args.limit)
+    elapsed = time.perf_counter() - begin
+
+    for hit in hits:
+        start = datetime.fromtimestamp(hit.start, tz=ZoneInfo("Asia/Shanghai"))
+        seconds = hit.offset_ms // 1000
+        print(f"{hit.room}\t{start:%Y-%m-%d %H:%M}\t{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}\t{hit.text}")
+
+    print(f"{len(hits)} hits in {elapsed * 1000:.1f} ms")
+
+
+def export(args: argparse.Namespace, config: dict) -> None:
+
+    from ddmajor.segments import SUFFIX as SEGMENTS_SUFFIX, SegmentReader
+    from ddmajor.srt import compress_cues, iter_srt_file, write_srt
+
+    start_ms = int(args.start * 1000)
+    end_ms = int(args.end * 1000) if args.end else None
+
+    if args.path.endswith(SEGMENTS_SUFFIX):
+        cues = SegmentReader(args.path).slice(start_ms, end_ms)
+    else:
+        cues = (
+            cue for cue in iter_srt_file(args.path)
+            if start_ms <= cue.start_ms and (end_ms is None or cue.start_ms < end_ms)
+        )
+
+    match args.format:
+        case "llm":
+            for line in compress_cues(cues):
+                print(line)
+        case _:
+            write_srt(cues, sys.stdout)
+
+
+def dump(args: argparse.Namespace, config: dict) -> None:
+    from ddmajor.resources import format_report, request_dump
+
+    report, fresh = request_dump(Path(config.get("data_dir", ".ddmajor")).expanduser())
+
+    if not report:
+        print("no resource report yet, is ddmajor running with this config?")
+        exit(1)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report))
+
+    if not fresh:
+        print(f"(no running process answered, report from {datetime.fromtimestamp(report.get('time', 0)):%Y-%m-%d %H:%M:%S})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # parser.add_argument("--room", "-r", type=int, help="live room id", required=True)
+    parser.add_argument("--config", "-c", type=str, help="config json file", required=True)
+    parser.add_argument("--level", "-l", type=str.lower, choices=ddmajor.logging.choices, default="info", help="log level")
+    parser.add_argument("--log-format", type=str, choices=["text", "json"], default="text", help="json lines carry task, room, component and stream time")
+
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="run all tasks (default)")
+
+    backfill_parser = subparsers.add_parser("backfill", help="process older replays of a room")
+    backfill_parser.add_argument("--task", "-t", type=str, default="", help="task name in config")
+    backfill_parser.add_argument("--room", "-r", type=int, default=0, help="live room id in config")
+    backfill_parser.add_argument("--since", type=str, default="", help="e.g. 2025-01-01")
+    backfill_parser.add_argument("--until", type=str, default="", help="exclusive, e.g. 2025-02-01")
+    backfill_parser.add_argument("--parallel", "-p", type=int, default=1, help="replays processed at the same time")
+    backfill_parser.add_argument("--retry-failed", action="store_true", help="retry replays that failed before")
+    backfill_parser.add_argument("--dry-run", action="store_true", help="only list replays to process")
+
+    search_parser = subparsers.add_parser("search", help="full-text search over transcripts")
+    search_parser.add_argument("query", type=str)
+    search_parser.add_argument("--room", "-r", type=int, default=0, help="only this live room")
+    search_parser.add_argument("--limit", "-n", type=int, default=50)
+    search_parser.add_argument("--reindex", action="store_true", help="index new or changed srt files first")
+
+    export_parser = subparsers.add_parser("export", help="export a transcript as srt or compressed text")
+    export_parser.add_argument("path", type=str, help=".segments.jsonl or .srt file")
+    export_parser.add_argument("--format", "-f", type=str, choices=["srt", "llm"], default="srt")
+    export_parser.add_argument("--start", type=float, default=0, help="seconds from stream start")
+    export_parser.add_argument("--end", type=float, default=0, help="seconds from stream start, exclusive")
+
+    dump_parser = subparsers.add_parser("dump", help="per-room cpu, memory and network usage of the running process")
+    dump_parser.add_argument("--json", action="store_true", help="print the raw report")
+
+    args: argparse.Namespace = parser.parse_args()
+
+    # a deploy sends SIGTERM, unwind like ctrl+c so every task drains its outputs
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    ddmajor.logging.set_level(args.level)
+    ddmajor.logging.set_format(args.log_format)
+    logger = ddmajor.logging.logger
+
+    config = load_config(args.config)
+
+    try:
+        match args.command:
+            case "backfill":
+                backfill(args, config)
+            case "search":
+                search(args, config)
+            case "export":
+                export(args, config)
+            case "dump":
+                dump(args, config)
+            case _:
+                run(args, config)
 
     except KeyboardInterrupt:
         logger.info("退出程序")
     except Exception:
         logger.exception("运行时发生错误")
+    finally:
+        ddmajor.credential.stop()
+        ddmajor.http.close()
+        ddmajor.logging.stop()
 
 
 if __name__ == "__main__":
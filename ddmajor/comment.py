@@ -0,0 +1,256 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+from pathlib import Path
+
+from ddmajor.cache import atomic_write_json
+from ddmajor.logging import logger
+
+
+class CommentedIndex:
+
+    # append-only record of (mid, aid, rpid) we posted, shared by all tasks of the process
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._commented: dict[tuple[str, int], list[int]] = {}
+        self._scanned: set[tuple[str, int]] = set() # cold-start remote checks that found nothing
+
+        self._load()
+
+
+    def _load(self) -> None:
+        if not self.path.exists(): return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = (str(record["mid"]), int(record["aid"]))
+                    self._commented.setdefault(key, []).append(int(record["rpid"]))
+                except Exception:
+                    logger.warning(f"skip broken line in {self.path}: {line.strip()}")
+
+
+    def add(self, mid: str | int, aid: int, rpid: int) -> None:
+        key = (str(mid), int(aid))
+
+        with self._lock:
+            self._commented.setdefault(key, []).append(int(rpid))
+            self._scanned.discard(key)
+
+            with open(self.path, "a", encoding="utf-8") as f:
+                print(json.dumps({"mid": key[0], "aid": key[1], "rpid": int(rpid), "time": int(time.time())}), file=f, flush=True)
+
+
+    def rpids(self, mid: str | int, aid: int) -> list[int]:
+        with self._lock:
+            return list(self._commented.get((str(mid), int(aid)), []))
+
+
+    def is_commented(self, mid: str | int, aid: int) -> bool:
+        with self._lock:
+            return (str(mid), int(aid)) in self._commented
+
+
+    def is_scanned(self, mid: str | int, aid: int) -> bool:
+        with self._lock:
+            return (str(mid), int(aid)) in self._scanned
+
+
+    def mark_scanned(self, mid: str | int, aid: int) -> None:
+        with self._lock:
+            self._scanned.add((str(mid), int(aid)))
+
+
+_indexes: dict[Path, CommentedIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def commented_index(path: str | Path) -> CommentedIndex:
+    path = Path(path).resolve()
+
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = CommentedIndex(path)
+        return _indexes[path]
+
+
+class TokenBucket:
+
+    # thread-safe, so tasks running on different loops can share one bucket per account
+
+    def __init__(self, interval: float, burst: int = 1) -> None:
+        self.interval = max(interval, 0.001) # seconds per token
+        self.capacity = max(burst, 1)
+
+        self._lock   = threading.Lock()
+        self._tokens = float(self.capacity)
+        self._last   = time.monotonic()
+
+
+    def _try_take(self) -> float:
+        # take a token, or return how long to wait for the next one
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) / self.interval)
+            self._last = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+
+            return (1 - self._tokens) * self.interval
+
+
+    async def acquire(self) -> float:
+        waited = 0.0
+
+        while (wait := self._try_take()) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+
+        return waited
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def rate_limiter(key: str, interval: float, burst: int = 1) -> TokenBucket:
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(interval, burst)
+        else:
+            bucket.interval, bucket.capacity = max(interval, 0.001), max(burst, 1)
+
+        return bucket
+
+
+class CommentOutbox:
+
+    # one json file per comment, chunks are delivered in order and the sent rpids are
+    # persisted after each chunk, so an interrupted thread resumes where it stopped.
+    # a job stays until every chunk is out: one that keeps failing cools down and is
+    # tried again later with the chunks summarized the first time. the files are read
+    # once, lookups are served from memory.
+
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._claimed: set[str] = set()
+        self._jobs: dict[str, dict] = {}
+
+        self._load()
+
+
+    def _load(self) -> None:
+        for path in sorted(self.root.glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except Exception as e:
+                logger.warning(f"skip broken outbox entry {path}: {e}")
+                continue
+
+            if job.get("status") == "failed":
+                # given up for good by earlier versions, retried like any other
+                job.update(status="pending", attempts=0, next_try=0)
+
+            if job.get("status") == "pending":
+                self._jobs[job["id"]] = job
+
+
+    def save(self, job: dict) -> None:
+        atomic_write_json(self.root.joinpath(f"{job['id']}.json"), job, indent=2)
+
+        with self._lock:
+            if job["status"] == "pending": self._jobs[job["id"]] = job
+            else: self._jobs.pop(job["id"], None)
+
+
+    def remove(self, job: dict) -> None:
+        self.root.joinpath(f"{job['id']}.json").unlink(missing_ok=True)
+
+        with self._lock:
+            self._jobs.pop(job["id"], None)
+
+
+    def enqueue(self, owner: str, mid: str | int, oid: int, chunks: list[str], content: str = "") -> dict:
+        job = {
+            "id": f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}",
+            "owner": owner,
+            "mid": str(mid),
+            "oid": int(oid),
+            "content": content,
+            "chunks": chunks,
+            "rpids": [],
+            "attempts": 0,
+            "next_try": 0,
+            "status": "pending",
+            "error": "",
+        }
+
+        self.save(job)
+        return job
+
+
+    def pending(self, owner: str) -> list[dict]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.get("owner") == owner]
+
+
+    def unfinished(self, owner: str, oid: int) -> dict | None:
+        # the job still delivering a comment to oid, chunks sent so far included
+        with self._lock:
+            return next((job for job in self._jobs.values() if job.get("owner") == owner and job["oid"] == int(oid)), None)
+
+
+    def claim(self, job: dict) -> bool:
+        with self._lock:
+            if job["id"] in self._claimed: return False
+            self._claimed.add(job["id"])
+            return True
+
+
+    def release(self, job: dict) -> None:
+        with self._lock:
+            self._claimed.discard(job["id"])
+
+
+_outboxes: dict[Path, CommentOutbox] = {}
+
+
+def comment_outbox(root: str | Path) -> CommentOutbox:
+    root = Path(root).resolve()
+
+    with _indexes_lock:
+        if root not in _outboxes:
+            _outboxes[root] = CommentOutbox(root)
+        return _outboxes[root]
+
+
+def split_comment(content: str, limit: int = 1000, continuation: str = "接上条\n") -> list[str]:
+    chunks = []
+    text = ""
+
+    for line in content.strip().splitlines(keepends=True):
+        if text and len(text + line) >= limit:
+            chunks.append(text)
+            text = continuation + line
+        else:
+            text = text + line
+
+    if text: chunks.append(text)
+
+    return chunks
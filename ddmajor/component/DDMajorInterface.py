@@ -3,6 +3,9 @@ import logging
 import threading
 import typing
 
+from datetime import datetime
+from pathlib import Path
+
 import bilibili_api as biliapi
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -12,6 +15,7 @@ class DDMajorInterface(typing.Protocol):
 
     config: dict
     dd_name: str
+    data_dir: Path
     logger: logging.Logger
 
     bili_cred: biliapi.Credential
@@ -22,4 +26,19 @@ class DDMajorInterface(typing.Protocol):
     _event_loop: asyncio.AbstractEventLoop
 
     async def _init_async(self, **kwargs) -> None:
-        pass
\ No newline at end of file
+        pass
+
+    async def _reconfigure_async(self, config: dict) -> None:
+        pass
+
+    async def _on_live_status_change(self, online: bool, live_time: datetime) -> None:
+        pass
+
+    async def _stop_async(self, report: dict) -> None:
+        pass
+
+    def _collect_resources(self, report: dict) -> None:
+        pass
+
+    def startup_phase(self, name: str) -> typing.AsyncContextManager[None]:
+        ...
\ No newline at end of file
@@ -0,0 +1,34 @@
+import importlib
+import threading
+import time
+
+
+# component type in config -> (module, mixin), in MRO order, imported on first use so
+# a task without live_asr or keynote never loads dashscope
+
+COMPONENTS = {
+    "live_asr": ("ddmajor.component.live_asr", "ComponentASR"),
+    "danmaku":  ("ddmajor.component.danmaku", "ComponentDanmaku"),
+    "keynote":  ("ddmajor.component.keynote", "ComponentKeynote"),
+}
+
+import_times: dict[str, float] = {} # type -> seconds spent importing it
+
+_loaded: dict[str, type] = {}
+_lock = threading.Lock()
+
+
+def load_component(kind: str) -> type:
+    with _lock:
+        if kind not in _loaded:
+            module, name = COMPONENTS[kind]
+
+            begin = time.perf_counter()
+            _loaded[kind] = getattr(importlib.import_module(module), name)
+            import_times[kind] = time.perf_counter() - begin
+
+        return _loaded[kind]
+
+
+def load_components(kinds: set[str]) -> tuple[type, ...]:
+    return tuple(load_component(kind) for kind in COMPONENTS if kind in kinds)
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import time
+
+from datetime import datetime
+from pathlib import Path
+
+import bilibili_api as biliapi
+
+from .DDMajorInterface import DDMajorInterface
+
+
+# {room}_{ts}.danmaku.jsonl, one record per line, "o" is milliseconds from the stream
+# start on the same timeline as the srt/segments written by live_asr
+#   {"o": 61234, "k": "dm",   "u": uid, "n": uname, "t": text}
+#   {"o": 61234, "k": "gift", "u": uid, "n": uname, "t": gift name, "c": count, "v": gold coins}
+#   {"o": 61234, "k": "sc",   "u": uid, "n": uname, "t": message, "v": gold coins (1 CNY = 1000)}
+
+SUFFIX = ".danmaku.jsonl"
+
+
+def parse_event(event: dict, live_ms: int) -> dict | None:
+    # LiveDanmaku callback info -> record, None for events that are not kept
+    now_ms = int(time.time() * 1000)
+    data = event.get("data") or {}
+
+    try:
+        match event.get("type"):
+            case "DANMU_MSG":
+                info = data["info"]
+                return {
+                    "o": (info[0][4] or now_ms) - live_ms, "k": "dm",
+                    "u": info[2][0], "n": info[2][1], "t": info[1],
+                }
+
+            case "SEND_GIFT":
+                gift = data["data"]
+                return {
+                    "o": int(gift.get("timestamp", 0) * 1000 or now_ms) - live_ms, "k": "gift",
+                    "u": gift.get("uid", 0), "n": gift.get("uname", ""), "t": gift.get("giftName", ""),
+                    "c": gift.get("num", 1), "v": gift.get("total_coin", 0) if gift.get("coin_type") == "gold" else 0,
+                }
+
+            case "SUPER_CHAT_MESSAGE":
+                sc = data["data"]
+                return {
+                    "o": int(sc.get("start_time", 0) * 1000 or now_ms) - live_ms, "k": "sc",
+                    "u": sc.get("uid", 0), "n": sc.get("user_info", {}).get("uname", ""), "t": sc.get("message", ""),
+                    "v": int(sc.get("price", 0)) * 1000,
+                }
+
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+    return None
+
+
+class DanmakuWriter:
+
+    # records are only appended to a list on the event loop, encoding and file io
+    # run in the default executor one batch at a time
+
+    def __init__(self, path: str | Path, batch: int = 512, max_pending: int = 100000) -> None:
+        self.path = Path(path)
+        self.batch = batch
+        self.max_pending = max_pending
+
+        self.written = 0
+        self.dropped = 0
+
+        self._fp = open(self.path, "ab")
+        self._pending: list[dict] = []
+        self._flushing: asyncio.Future | None = None
+
+
+    def append(self, record: dict) -> None:
+        self._pending.append(record)
+
+        if len(self._pending) >= self.batch and not self._flushing:
+            self.flush()
+        elif len(self._pending) > self.max_pending:
+            # disk cannot keep up, keep the newest records
+            drop = len(self._pending) - self.max_pending
+            del self._pending[:drop]
+            self.dropped += drop
+
+
+    def _write(self, records: list[dict]) -> None:
+        self._fp.write(b"".join(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+            for record in records
+        ))
+        self._fp.flush()
+
+
+    def flush(self) -> asyncio.Future | None:
+        if self._flushing or not self._pending: return self._flushing
+
+        records, self._pending = self._pending, []
+
+        def _done(future: asyncio.Future) -> None:
+            self._flushing = None
+            if not future.cancelled() and future.exception() is None:
+                self.written += len(records)
+                if len(self._pending) >= self.batch: self.flush()
+            else:
+                self.dropped += len(records)
+
+        self._flushing = asyncio.get_running_loop().run_in_executor(None, self._write, records)
+        self._flushing.add_done_callback(_done)
+
+        return self._flushing
+
+
+    async def close(self) -> None:
+        while self._flushing or self._pending:
+            if (future := self.flush()):
+                await asyncio.wait([future])
+
+        self._fp.close()
+
+
+class ComponentDanmaku(DDMajorInterface):
+
+    def _on_danmaku(self, event: dict) -> None:
+        # plain function on purpose, AsyncEvent wraps every coroutine handler in a task
+        if not self._danmaku_writer: return
+
+        record = parse_event(event, self._danmaku_live_ms)
+        if record: self._danmaku_writer.append(record)
+
+
+    async def _on_danmaku_live(self, event: dict) -> None:
+        # LIVE / PREPARING from the danmaku connection itself, for tasks without live_asr
+        info = await self._danmaku_room.get_room_play_info()
+
+        if info.get("live_status", -1) == 1:
+            live_time = info.get("live_time")
+            await self._danmaku_open(datetime.fromtimestamp(live_time) if live_time else datetime.now())
+        else:
+            await self._danmaku_close()
+
+
+    async def _on_live_status_change(self, online: bool, live_time: datetime) -> None:
+
+        await super()._on_live_status_change(online, live_time)
+
+        if not getattr(self, "_danmaku_conf", None): return
+
+        if online:
+            await self._danmaku_open(live_time)
+        else:
+            await self._danmaku_close()
+
+
+    async def _danmaku_open(self, live_time: datetime) -> None:
+        live_ms = int(live_time.timestamp() * 1000)
+        if self._danmaku_writer and self._danmaku_live_ms == live_ms: return
+
+        await self._danmaku_close()
+
+        path = Path(self._danmaku_conf["output_dir"]).joinpath(f"{self._danmaku_room_id}_{int(live_time.timestamp())}{SUFFIX}")
+
+        self._danmaku_live_ms = live_ms
+        self._danmaku_writer = DanmakuWriter(
+            path,
+            batch=int(self._danmaku_conf.get("batch", 512)),
+            max_pending=int(self._danmaku_conf.get("max_pending", 100000)),
+        )
+
+        self.logger.info(f"开始记录弹幕：{path.name}")
+
+
+    async def _danmaku_close(self) -> None:
+        writer, self._danmaku_writer = self._danmaku_writer, None
+        if not writer: return
+
+        await writer.close()
+
+        self.logger.info(f"弹幕记录结束：写入{writer.written}条，丢弃{writer.dropped}条")
+
+
+    async def _danmaku_flush(self) -> None:
+        if self._danmaku_writer: self._danmaku_writer.flush()
+
+
+    async def _danmaku_connect(self) -> None:
+        while True:
+            try:
+                await self._danmaku_conn.connect()
+            except Exception as e:
+                self.logger.warning(f"danmaku connection: {e}")
+
+            await asyncio.sleep(30) # connect() returns once its own retries are used up
+
+
+    async def _stop_async(self, report: dict) -> None:
+
+        try:
+            if getattr(self, "_danmaku_conf", None):
+                try:
+                    await self._danmaku_conn.disconnect()
+                except Exception:
+                    pass # not connected
+
+                if (writer := self._danmaku_writer):
+                    written = writer.written
+                    await self._danmaku_close()
+                    report["danmaku_drained"] = writer.written - written
+        finally:
+            await super()._stop_async(report)
+
+
+    def _collect_resources(self, report: dict) -> None:
+
+        super()._collect_resources(report)
+
+        if not getattr(self, "_danmaku_conf", None): return
+
+        writer = self._danmaku_writer
+        report["danmaku"] = {
+            "recording": writer is not None,
+            "written": writer.written if writer else 0,
+            "dropped": writer.dropped if writer else 0,
+            "pending": len(writer._pending) if writer else 0,
+        }
+
+
+    async def _reconfigure_async(self, config: dict) -> None:
+
+        await super()._reconfigure_async(config)
+
+        component = next((c for c in config.get("task", {}).get("components", []) if c.get("type", "") == "danmaku"), None)
+        if not component or component == self._danmaku_conf: return
+
+        # output_dir and batch sizes apply from the next stream
+        previous, self._danmaku_conf = self._danmaku_conf, component
+
+        if component.get("flush_interval", 2) != previous.get("flush_interval", 2): # type: ignore
+            self.scheduler.reschedule_job(f"danmaku_flush({self.dd_name})", trigger="interval", seconds=float(component.get("flush_interval", 2)))
+
+        self.logger.info("danmaku config reloaded")
+
+
+    async def _init_async(self, **kwargs) -> None:
+
+        await super()._init_async(**kwargs)
+
+        task: dict = self.config.get("task", {})
+        cmpt: list = task.get("components", [])
+
+        component = next((c for c in cmpt if c.get("type", "") == "danmaku"), None)
+
+        self._danmaku_conf = component
+        self._danmaku_writer = None
+        self._danmaku_live_ms = 0
+
+        if component:
+            self.logger.info("enable danmaku component")
+
+            self._danmaku_room_id = task.get("room_id")
+            self._danmaku_room = biliapi.live.LiveRoom(room_display_id=self._danmaku_room_id, credential=self.bili_cred) # type: ignore
+
+            self._danmaku_conn = biliapi.live.LiveDanmaku(self._danmaku_room_id, credential=self.bili_cred) # type: ignore
+            for name in ["DANMU_MSG", "SEND_GIFT", "SUPER_CHAT_MESSAGE"]:
+                self._danmaku_conn.add_event_listener(name, self._on_danmaku)
+
+            if not any(c.get("type", "") == "live_asr" for c in cmpt):
+                for name in ["LIVE", "PREPARING"]:
+                    self._danmaku_conn.add_event_listener(name, self._on_danmaku_live)
+
+                try:
+                    async with self.startup_phase("danmaku"):
+                        await self._on_danmaku_live({})
+                except Exception:
+                    self.logger.exception("initial check online failed")
+
+            self.scheduler.add_job(
+                self._danmaku_flush,
+                "interval",
+                seconds=float(component.get("flush_interval", 2)),
+                id=f"danmaku_flush({self.dd_name})",
+                replace_existing=True,
+            )
+
+            connect_task = self._event_loop.create_task(self._danmaku_connect())
+            self._background_tasks.append(connect_task)
+            connect_task.add_done_callback(self._background_tasks.remove)
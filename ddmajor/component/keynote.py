@@ -1,27 +1,43 @@
 import asyncio
+import contextlib
+import itertools
 import json
 import logging
+import random
 import re
+import time
 
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator
 from zoneinfo import ZoneInfo
 
-import aiohttp
 import bilibili_api as biliapi
 import dashscope
 
-from .live_asr import timedelta_to_srt
+from ddmajor import llm, vod
+from ddmajor.cache import SubtitleCache, api_cache
+from ddmajor.comment import comment_outbox, commented_index, rate_limiter, split_comment
+from ddmajor.credential import is_auth_error, request_refresh
+from ddmajor.highlight import DANMAKU_SUFFIX, LOUDNESS_SUFFIX, Window, chat_density, detect, find_sidecar, in_windows, load_loudness
+from ddmajor.segments import iter_transcript_file
+from ddmajor.transcript import denoise_transcript, estimate_tokens
+from ddmajor.srt import Cue, PageOffsets, bili_subtitle_cue, compress_cues, format_cue, format_srt, iter_srt, iter_srt_file, srt_to_ms
 from .DDMajorInterface import DDMajorInterface
 
 
+DEFAULT_HIGHLIGHT_PROMPT = "输入只包含本地检测出的高能片段，片段之间的内容已省略，不受跳转点间隔的限制，只需为这些片段记录时间点。片段："
+
+
 class ComponentKeynote(DDMajorInterface):
 
     async def get_latest_replay(self) -> biliapi.video.Video | None:
         replay = None
         replay_series = None
 
-        channels = await self._keynote_user.get_channel_list()
+        channels = await api_cache("channel_list").get(
+            self._keynote_user.get_uid(), self._keynote_user.get_channel_list, owner=self.dd_name,
+        )
         series_list = channels.get("items_lists", {}).get("series_list", [])
 
         for series in series_list:
@@ -41,184 +57,454 @@ class ComponentKeynote(DDMajorInterface):
         return replay
 
 
-    async def ai_subtitle_to_srt(self, video: biliapi.video.Video, view: dict | None) -> str: # type: ignore
-        srt = ""
+    async def get_view(self, video: biliapi.video.Video) -> dict:
+        detail = await api_cache("video_detail").get(video.get_aid(), video.get_detail, owner=self.dd_name)
+        return detail.get("View", {})
 
-        sid   = 0
-        count = 0
-        delta = timedelta(seconds=0)
 
-        if not view: view: dict = (await video.get_detail()).get("View", {})
+    def _report_api_cache(self) -> None:
+        for name in ["channel_list", "video_detail"]:
+            hits, misses, coalesced = api_cache(name).pop_stats(self.dd_name)
+            if hits or misses or coalesced:
+                self.logger.info(f"api cache {name}: {misses} calls, {hits} hits, {coalesced} coalesced in the last hour")
 
-        for page in view.get("pages", []):
-            cid = page["cid"]
-            sub = await video.get_subtitle(cid=int(cid))
 
-            subtitle = None
+    async def get_page_subtitle(self, video: biliapi.video.Video, cid: int) -> list[dict]:
+        body = self._keynote_subtitle_cache.lookup(cid)
+        if body is not None:
+            self.logger.debug(f"use cached subtitle for cid {cid}")
+            return body
 
-            for subtitle in sub.get("subtitles"): # type: ignore
-                if subtitle.get("lan", "").startswith("ai"):
-                    break
+        body = []
+
+        sub = await video.get_subtitle(cid=int(cid))
+
+        subtitle = None
 
-            if subtitle:
-                sub_url = "https:" + subtitle.get("subtitle_url", "")
-                if sub_url:
-                    self.logger.info(f"get subtitle url for cid {cid}: {sub_url}")
+        for subtitle in sub.get("subtitles"): # type: ignore
+            if subtitle.get("lan", "").startswith("ai"):
+                break
+
+        if subtitle:
+            sub_url = "https:" + subtitle.get("subtitle_url", "")
+            if sub_url:
+                self.logger.info(f"get subtitle url for cid {cid}: {sub_url}")
 
-                    async with aiohttp.ClientSession() as session:
-                        resp = await session.get(f"{sub_url}")
-                        sub_json = await resp.json()
+                body = await self._keynote_subtitle_cache.fetch(cid, sub_url)
 
-                    for body in sub_json.get("body", []):
-                        try:
-                            sid = int(body["sid"])
-                            tfrom = float(body["from"])
-                            tto = float(body["to"])
-                            content = body["content"]
+        return body
 
-                            t_from = delta + timedelta(seconds=tfrom)
-                            t_to   = delta + timedelta(seconds=tto)
 
-                            srt += (
-                                f"{count + sid}\n"
-                                f"{timedelta_to_srt(t_from)} --> {timedelta_to_srt(t_to)}\n"
-                                f"{content}\n\n"
-                            )
-                        except Exception:
-                            self.logger.exception("failed to get subtitle body")
+    async def ai_subtitle_cues(self, video: biliapi.video.Video, view: dict | None) -> AsyncIterator[Cue]: # type: ignore
+
+        count = 0
 
-            count = sid
-            delta = timedelta(seconds=page.get("duration", 7200))
+        if not view: view: dict = await self.get_view(video)
 
-        return srt
+        pages = view.get("pages", [])
+        offsets = PageOffsets.from_pages(pages)
+        semaphore = asyncio.Semaphore(max(1, int(self._keynote_conf.get("fetch_concurrency", 4))))
 
+        async def _fetch(cid: int) -> list[dict]:
+            async with semaphore:
+                return await self.get_page_subtitle(video, cid)
 
-    async def _cron_check_replay(self) -> None:
+        # fetch concurrently, but consume in page order to keep indexes continuous
+        fetches = [asyncio.ensure_future(_fetch(page["cid"])) for page in pages]
 
         try:
+            for k, fetch in enumerate(fetches):
+                offset = round(offsets.start(k) * 1000)
+                base   = count
+
+                for body in await fetch:
+                    try:
+                        cue = bili_subtitle_cue(body, offset, base)
+                        count = cue.index
+                        yield cue
+                    except Exception:
+                        self.logger.exception("failed to get subtitle body")
+        finally:
+            for fetch in fetches: fetch.cancel()
+
+
+    async def vod_subtitle_cues(self, video: biliapi.video.Video, view: dict | None, name: str) -> list[Cue]:
+        # transcribes the replay audio itself, pages one after another share the pool of segments
+        if not view: view = await self.get_view(video)
+
+        conf = self._keynote_conf.get("vod_asr", {})
+        asr_config = self.config.get("dashscope", {}).get("asr", {})
+
+        pages = view.get("pages", [])
+        offsets = PageOffsets.from_pages(pages)
+        workdir = self.data_dir.joinpath("vod")
+
+        cues: list[Cue] = []
+
+        for k, page in enumerate(pages):
+            url = vod.audio_url(await video.get_download_url(cid=page["cid"]))
+            if not url: raise RuntimeError(f"no audio stream for page {k + 1}")
+
+            page_cues = await vod.transcribe(
+                url, page.get("duration"), workdir,
+                api_key=asr_config["api_key"],
+                base_url=asr_config.get("base_websocket_api_url", "wss://dashscope.aliyuncs.com/api-ws/v1/inference"),
+                segment=float(conf.get("segment", vod.SEGMENT)),
+                overlap=float(conf.get("overlap", vod.OVERLAP)),
+                max_attempts=int(conf.get("max_attempts", 3)),
+                params=conf.get("asr_params", {}),
+                name=f"{name}_p{k + 1}",
+            )
 
-            replay = await self.get_latest_replay()
-            detail = (await replay.get_detail()).get("View", {}) # title, ctime, owner # type: ignore
+            offset = round(offsets.start(k) * 1000)
+            cues.extend(
+                Cue(len(cues) + n + 1, cue.start_ms + offset, cue.end_ms + offset, cue.text)
+                for n, cue in enumerate(page_cues)
+            )
 
-            title = detail.get("title", "")
-            match = re.search(r"(\d+)年(\d+)月(\d+)日(\d+)点", title)
+        return cues
 
-            if match:
-                year, month, day, hour = match.groups()
-                live_date = datetime(
-                    int(year), int(month), int(day), int(hour),
-                    tzinfo=ZoneInfo("Asia/Shanghai")
-                )
-                # self.logger.info(f"最新回放：{live_date}")
 
-                srt_file = find_transcription(
-                    self._keynote_conf["search_dir"],
-                    self._keynote_room,
-                    live_date
-                )
+    def _keynote_vod_due(self, detail: dict) -> bool:
+        # ai subtitles usually show up within a while after the replay is published
+        conf = self._keynote_conf.get("vod_asr", {})
+        if not conf.get("enabled", False): return False
 
-                ai_subtitle = ""
+        published = detail.get("pubdate") or detail.get("ctime") or 0
+        return time.time() - published >= float(conf.get("wait", 1800))
 
-                if srt_file:
-                    if ".finish" in srt_file:
-                        self.logger.debug(f"find finished {srt_file}, skip")
-                        return
 
-                    self.logger.info(f"find {srt_file} to match {title}")
+    def _keynote_start_vod(self, replay: biliapi.video.Video, detail: dict, srt_path: Path) -> None:
+        if (task := self._keynote_vod_task) and not task.done():
+            self.logger.debug("replay audio is still being transcribed")
+            return
 
-                    with open(srt_file, "r", encoding="utf-8") as f:
-                        ai_subtitle = f.read()
+        name, failed_at = self._keynote_vod_failed
+        if name == srt_path.name and time.time() - failed_at < float(self._keynote_conf.get("vod_asr", {}).get("retry", 3600)):
+            return
 
-                    srt_path = Path(srt_file)
-                    with open(str(srt_path.with_suffix("").resolve()) + ".finish" + srt_path.suffix, "w") as _:
-                        pass
+        self.logger.info("find no ai subtitle, transcribe the replay audio in the background")
 
-                if not ai_subtitle:
-                    self.logger.debug("find no transcription, try to use ai subtitle from bilibili")
-                    ai_subtitle = await self.ai_subtitle_to_srt(replay, detail) # type: ignore
+        task = self._keynote_vod_task = self._event_loop.create_task(self._keynote_transcribe_replay(replay, detail, srt_path))
+        self._background_tasks.append(task)
+        task.add_done_callback(self._background_tasks.remove)
+        task.add_done_callback(self._keynote_poll_now)
 
-                    if ai_subtitle:
 
-                        # save to .srt file
-                        with open(
-                            Path(self._keynote_conf["search_dir"]).joinpath(
-                                f"{self._keynote_room}_{int(live_date.timestamp())}.srt"
-                            ), "w", encoding="utf-8",
-                        ) as f: print(ai_subtitle, file=f, end="")
+    async def _keynote_transcribe_replay(
+        self, replay: biliapi.video.Video, detail: dict, srt_path: Path, stats: dict | None = None,
+    ) -> int:
+        # writes {room}_{ts}.srt, a part name of its own so the ai subtitle download never touches it
+        part_path = srt_path.with_name(srt_path.name + ".vod.part")
 
-                    else:
-                        self.logger.debug("failed to get ai subtitle")
-                        return
+        try:
+            with stage_timer(stats, "vod_asr"):
+                cues = await self.vod_subtitle_cues(replay, detail, srt_path.stem)
 
-                ai_subtitle = compress_srt(ai_subtitle) # srt format consumes too many tokens and causes dilution
-                self.logger.debug("compress subtitle to:\n" + ai_subtitle)
+            if not cues: raise RuntimeError("no sentence recognized")
 
-                if (comment := await self.prepare_comment(ai_subtitle, replay)): # type: ignore
-                    self.logger.info(f"prepare to send comment:\n{comment}")
-                    await self.send_comment(comment, replay.get_aid()) # type: ignore
+            with open(part_path, "w", encoding="utf-8") as f:
+                f.write(format_srt(cues))
+            part_path.replace(srt_path)
 
-                    # save a finish file
-                    with open(
-                        Path(self._keynote_conf["search_dir"]).joinpath(
-                            f"{self._keynote_room}_{int(live_date.timestamp())}.finish.txt"
-                        ), "w", encoding="utf-8",
-                    ) as f: print(comment, file=f)
+        except Exception as e:
+            if is_auth_error(e): request_refresh(f"{self.dd_name} got code {e.code}") # type: ignore
+            self.logger.error(f"failed to transcribe the replay: {e!r}")
+            self._keynote_vod_failed = (srt_path.name, time.time())
+            return 0
 
-            else:
-                self.logger.warning(f"time not find in title '{title}'")
+        finally:
+            part_path.unlink(missing_ok=True)
+
+        self.logger.info(f"transcribed the replay into {srt_path.name}")
+
+        return len(cues)
+
+
+    def _keynote_poll_now(self, task: asyncio.Task) -> None:
+        # the next scheduled poll may be a long way off once a background transcription is done
+        if task.cancelled() or not task.result(): return
+
+        try:
+            self.scheduler.modify_job(f"cron_check_replay({self.dd_name})", next_run_time=datetime.now())
+        except Exception as e:
+            self.logger.debug(f"failed to bring the next replay check forward: {e}")
+
+
+    async def _cron_check_replay(self, startup: bool = False) -> None:
+
+        try:
+
+            # at startup only the lookup holds a startup slot, summarizing and commenting
+            # may take minutes and would keep other tasks from starting
+            async with (self.startup_phase("check_replay") if startup else contextlib.nullcontext()):
+                replay = await self.get_latest_replay()
+                detail = await self.get_view(replay) # title, ctime, owner # type: ignore
+
+            await self.process_replay(replay, detail) # type: ignore
 
         except Exception as e:
+            if is_auth_error(e): request_refresh(f"{self.dd_name} got code {e.code}") # type: ignore
             self.logger.error(e)
 
+        finally:
+            self._keynote_adapt_polling()
 
-    async def prepare_comment(self, subtitle: str, video: biliapi.video.Video, view: dict | None = None) -> str:
-        comment = ""
 
-        if await self.video_is_commented(video):
-            self.logger.debug("this video is already commented")
+    async def process_replay(self, replay: biliapi.video.Video, detail: dict, stats: dict | None = None, wait_vod: bool = False) -> bool:
+        # returns True once the replay needs no more work (commented or finished before),
+        # wait_vod transcribes the replay audio inline instead of in the background
+
+        title = detail.get("title", "")
+        live_date = parse_live_date(title)
+
+        if not live_date:
+            self.logger.warning(f"time not find in title '{title}'")
+            return False
+
+        # self.logger.info(f"最新回放：{live_date}")
+
+        with stage_timer(stats, "match"):
+            srt_file = find_transcription(
+                self._keynote_conf["search_dir"],
+                self._keynote_room,
+                live_date
+            )
+
+        cues = iter([])
+
+        if srt_file:
+            if ".finish" in srt_file:
+                self.logger.debug(f"find finished {srt_file}, skip")
+                self._keynote_mark_handled(live_date)
+                return True
+
+            self.logger.info(f"find {srt_file} to match {title}")
+
+            cues = iter_transcript_file(srt_file)
+            srt_path = Path(srt_file)
+
+        first_cue = next(cues, None)
+
+        if first_cue:
+            cues = itertools.chain([first_cue], cues)
         else:
+            self.logger.debug("find no transcription, try to use ai subtitle from bilibili")
 
-            if not view: view = (await video.get_detail()).get("View", {})
-            pages = view.get("pages", []) # type: ignore
+            # save to .srt file while streaming, so the transcript is never held as a whole
+            srt_path = Path(self._keynote_conf["search_dir"]).joinpath(
+                f"{self._keynote_room}_{int(live_date.timestamp())}.srt"
+            )
+            part_path = srt_path.with_suffix(".srt.part")
 
-            role = self._keynote_conf.get("role", "你是一个专业且幽默的直播切片区骨灰级观众，拒绝任何AI感十足的陈词滥调，擅长从长篇语音识别文本中精准提取核心话题，并整理成高质量的、能抓住直播中精彩瞬间的评论。")
-            prompt = self._keynote_conf["prompt"]
+            count = 0
+            with stage_timer(stats, "subtitle"), open(part_path, "w", encoding="utf-8") as f:
+                async for cue in self.ai_subtitle_cues(replay, detail):
+                    f.write(format_cue(cue) + "\n")
+                    count += 1
 
-            if (extra_info := self._keynote_conf.get("extra_info", "")):
-                prompt = prompt + "\n\n# Extra Information\n" + extra_info
+            if count:
+                part_path.replace(srt_path)
+                cues = iter_srt_file(srt_path)
+
+                if (task := self._keynote_vod_task) and not task.done():
+                    task.cancel() # the ai subtitle showed up after all
+            else:
+                part_path.unlink(missing_ok=True)
+                self.logger.debug("failed to get ai subtitle")
+
+                if self._keynote_vod_due(detail):
+                    if wait_vod:
+                        if await self._keynote_transcribe_replay(replay, detail, srt_path, stats):
+                            return await self.process_replay(replay, detail, stats)
+                        return False
+
+                    # may take a while, the poll that runs after it picks up the srt
+                    self._keynote_start_vod(replay, detail, srt_path)
 
-            llm_resp = await self.summarize(subtitle, prompt, role)
+                return False
 
-            page = {}
-            p_number = 0
-            p_seconds = timedelta(microseconds=-1)
-            total_shift = timedelta(0)
+        highlights = ""
+        highlight_conf = self._keynote_conf.get("highlight", {})
 
-            for line in llm_resp.splitlines(keepends=True):
-                if re.match(r"^\d+:\d+.*? ", line):
-                    # start with time
-                    tstr, content = line.lstrip().split(" ", maxsplit=1)
+        if highlight_conf.get("enabled", False):
+            cues = list(cues)
 
-                    delta = srt_like_str_to_delta(tstr) - total_shift
+            with stage_timer(stats, "highlight"):
+                windows = self.highlight_windows(cues, int(srt_path.name.split("_")[1].split(".")[0]))
 
-                    if delta > p_seconds:
-                        p_number += 1
+            if windows:
+                spans = "、".join(f"{w.start // 60:02d}:00-{w.end // 60:02d}:00" for w in windows)
+                self.logger.info(f"focus on {len(windows)} highlight windows: {spans}")
 
-                        page = {} if p_number > len(pages) else pages[p_number-1]
-                        total_shift += p_seconds # sum of previous ps
-                        p_seconds += timedelta(seconds=page.get("duration", 7200)) # current p time
+                cues = in_windows(cues, windows)
+                highlights = highlight_conf.get("prompt", DEFAULT_HIGHLIGHT_PROMPT) + "\n" + spans
 
-                        comment += f"\nP{p_number}\n"
-                        delta = srt_like_str_to_delta(tstr) - total_shift
+        ai_subtitle = compress_srt(cues) # srt format consumes too many tokens and causes dilution
+        ai_subtitle = self.denoise_subtitle(ai_subtitle)
+        self.logger.debug("compress subtitle to:\n" + ai_subtitle)
 
-                    seconds = delta.total_seconds()
-                    minutes = seconds // 60
-                    seconds -= minutes * 60
+        with stage_timer(stats, "summarize"):
+            comment = await self.prepare_comment(ai_subtitle, replay, detail, highlights)
 
-                    comment += f"{int(minutes):02d}:{int(seconds):02d} {content}"
+        if comment:
+            self.logger.info(f"prepare to send comment:\n{comment}")
 
-                else:
-                    comment += line
+            with stage_timer(stats, "comment"):
+                rpids = await self.send_comment(comment, replay.get_aid())
+
+            if self._keynote_outbox.unfinished(self.dd_name, replay.get_aid()):
+                # given up by the outbox, left unfinished so the next poll or backfill tries again
+                self.logger.error("comment not delivered, replay left unfinished")
+                return False
+
+            # save a finish file
+            with open(
+                Path(self._keynote_conf["search_dir"]).joinpath(
+                    f"{self._keynote_room}_{int(live_date.timestamp())}.finish.txt"
+                ), "w", encoding="utf-8",
+            ) as f: print(comment, file=f)
+
+        if srt_file:
+            # only now that the comment is out (or was before), find_transcription skips it from here on
+            with open(str(srt_path.with_suffix("").resolve()) + ".finish" + srt_path.suffix, "w") as _:
+                pass
+
+        self._keynote_mark_handled(live_date)
+
+        return True
+
+
+    def _keynote_mark_handled(self, live_date: datetime) -> None:
+        stream = self._keynote_stream
+        if not stream["live_time"] or abs(live_date.timestamp() - stream["live_time"]) <= 3600:
+            stream["handled"] = True
+
+
+    def _keynote_next_interval(self) -> int:
+        poll   = self._keynote_conf.get("poll", {})
+        stream = self._keynote_stream
+
+        fast   = int(poll.get("fast", 30))
+        window = int(poll.get("fast_window", 900))
+        cap    = int(poll.get("max", 1800))
+        idle   = int(poll.get("idle", 3600))
+        expire = int(poll.get("give_up", 86400))
+
+        # a replay only shows up after the stream ends
+        if stream["online"] or stream["handled"]:
+            return idle
+
+        if not stream["ended"]: # no stream seen since startup, the latest replay is still pending
+            return int(self._keynote_conf.get("interval", 60))
+
+        elapsed = time.time() - stream["ended"]
+
+        if elapsed < window:
+            return fast
+        if elapsed > expire:
+            return idle
+
+        stream["backoff"] = min(cap, stream["backoff"] * 2 if stream["backoff"] else fast * 2)
+        return stream["backoff"]
+
+
+    def _keynote_adapt_polling(self) -> None:
+        if not self._keynote_adaptive: return
+
+        seconds = self._keynote_next_interval()
+
+        if seconds != self._keynote_stream["interval"]:
+            self.logger.debug(f"check replay every {seconds}s")
+            self._keynote_stream["interval"] = seconds
+            self.scheduler.reschedule_job(f"cron_check_replay({self.dd_name})", trigger="interval", seconds=seconds)
+
+
+    async def _on_live_status_change(self, online: bool, live_time: datetime) -> None:
+
+        await super()._on_live_status_change(online, live_time)
+
+        if not getattr(self, "_keynote_adaptive", False): return
+
+        self._keynote_stream.update({
+            "online": online,
+            "live_time": live_time.timestamp(),
+            "ended": None if online else time.time(),
+            "handled": False,
+            "backoff": 0,
+        })
+
+        self._keynote_adapt_polling()
+
+
+    def denoise_subtitle(self, subtitle: str) -> str:
+
+        conf = self._keynote_conf.get("denoise", {})
+        if conf is True: conf = {}
+
+        if not isinstance(conf, dict) or not conf.get("enabled", True):
+            return subtitle
+
+        before = estimate_tokens(subtitle)
+        denoised = denoise_transcript(subtitle, {k: v for k, v in conf.items() if k != "enabled"})
+        after = estimate_tokens(denoised)
+
+        if before:
+            self.logger.info(f"字幕去噪：约{before} → {after} tokens（-{(before - after) / before:.1%}）")
+
+        return denoised
+
+
+    def highlight_windows(self, cues: list[Cue], ts: int) -> list[Window]:
+        # ts is the stream start the cue offsets are relative to, sidecars may start a little apart
+        conf = self._keynote_conf.get("highlight", {})
+
+        folders = {self._keynote_conf["search_dir"]}
+        for component in self.config.get("task", {}).get("components", []):
+            if component.get("output_dir"): folders.add(component["output_dir"])
+
+        loudness = chat = None
+
+        if (found := find_sidecar(folders, self._keynote_room, ts, LOUDNESS_SUFFIX)):
+            loudness = load_loudness(found[0], shift=(found[1] - ts) // 60)
+        if (found := find_sidecar(folders, self._keynote_room, ts, DANMAKU_SUFFIX)):
+            chat = chat_density(found[0], shift=(found[1] - ts) // 60)
+
+        return detect(
+            cues, loudness, chat,
+            window=int(conf.get("window", 5)),
+            top=int(conf.get("top", 8)),
+            weights=conf.get("weights"),
+        )
+
+
+    async def prepare_comment(self, subtitle: str, video: biliapi.video.Video, view: dict | None = None, highlights: str = "") -> str:
+        comment = ""
+
+        if (job := self._keynote_outbox.unfinished(self.dd_name, video.get_aid())):
+            # summarized before and not fully delivered, send_comment picks the job up again
+            self.logger.info(f"resume comment {job['id']} ({len(job['rpids'])}/{len(job['chunks'])} sent)")
+            comment = job.get("content") or "".join(job["chunks"])
+
+        elif await self.video_is_commented(video):
+            self.logger.debug("this video is already commented")
+        else:
+
+            if not view: view = await self.get_view(video)
+            pages = view.get("pages", []) # type: ignore
+
+            role = self._keynote_conf.get("role", "你是一个专业且幽默的直播切片区骨灰级观众，拒绝任何AI感十足的陈词滥调，擅长从长篇语音识别文本中精准提取核心话题，并整理成高质量的、能抓住直播中精彩瞬间的评论。")
+            prompt = self._keynote_conf["prompt"]
+
+            if (extra_info := self._keynote_conf.get("extra_info", "")):
+                prompt = prompt + "\n\n# Extra Information\n" + extra_info
+
+            if highlights:
+                prompt = prompt + "\n\n# Highlights\n" + highlights
+
+            llm_resp = await self.summarize(subtitle, prompt, role, priority=view.get("pubdate") or view.get("ctime") or time.time()) # type: ignore
+
+            comment = remap_page_timestamps(llm_resp, PageOffsets.from_pages(pages))
 
         return comment
 
@@ -228,8 +514,18 @@ class ComponentKeynote(DDMajorInterface):
         offset = ""
         result = False
 
+        aid  = video.get_aid()
         myid = str(self.bili_cred.dedeuserid)
 
+        if self._keynote_commented.is_commented(myid, aid):
+            return True
+
+        if self._keynote_outbox.unfinished(self.dd_name, aid):
+            return False # some chunks may be out already, the rest is still to be sent
+
+        if self._keynote_commented.is_scanned(myid, aid):
+            return False # nothing found by the cold-start scan, and we did not comment since
+
         while page <= 3:
 
             comments = await biliapi.comment.get_comments_lazy(
@@ -245,10 +541,14 @@ class ComponentKeynote(DDMajorInterface):
                 rmid = str(reply.get("member", {}).get("mid", "-1"))
                 if rmid == myid:
                     result = True
+                    self._keynote_commented.add(myid, aid, int(reply.get("rpid", -1)))
                     break
 
             page += 1
-            if not offset or not replies: break
+            if result or not offset or not replies: break
+
+        if not result:
+            self._keynote_commented.mark_scanned(myid, aid)
 
         return result
 
@@ -262,37 +562,103 @@ class ComponentKeynote(DDMajorInterface):
             except Exception as e:
                 pass
 
-        rpids = [] # reply id list
+        job = self._keynote_outbox.unfinished(self.dd_name, int(id)) or self._keynote_outbox.enqueue(
+            self.dd_name, self.bili_cred.dedeuserid, int(id), split_comment(content), content, # type: ignore
+        )
+
+        return await self.deliver_comment(job, block=False)
+
 
-        lines = content.strip().splitlines(keepends=True)
-        line  = ""
-        text  = ""
-        rpid  = None
+    async def deliver_comment(self, job: dict, block: bool = True) -> list[int]:
+        # block=False returns right away for a job that is cooling down after failed attempts
+
+        if not block and job["next_try"] > time.time():
+            self.logger.info(f"comment {job['id']} is cooling down, retry at {datetime.fromtimestamp(job['next_try']):%H:%M:%S}")
+            return job["rpids"]
+
+        if not self._keynote_outbox.claim(job):
+            self.logger.debug(f"outbox job {job['id']} is being delivered elsewhere")
+            return job["rpids"]
+
+        conf = self.config.get("comment", {})
+        limiter = rate_limiter(
+            job["mid"],
+            interval=float(conf.get("interval", 15)),
+            burst=int(conf.get("burst", 1)),
+        )
+        max_attempts = int(conf.get("max_attempts", 6))
+        backoff = float(conf.get("backoff", 30))
+        cooldown = float(conf.get("cooldown", 3600))
 
         try:
-            while lines:
-                line = lines.pop(0)
-                if len(text+line) >= 1000:
-                    rpid = await self._send_comment(content=text, oid=int(id), root=rpid)
-                    await asyncio.sleep(15)
-                    self.logger.debug(f"sleep 15s after sending: {text}")
-
-                    text = "接上条\n" + line
-                    rpids.append(rpid)
-                else:
-                    text = text + line
-
-            if text:
-                rpids.append(await self._send_comment(content=text, oid=int(id), root=rpid))
+            while len(job["rpids"]) < len(job["chunks"]):
+
+                if (wait := job["next_try"] - time.time()) > 0:
+                    await asyncio.sleep(wait)
+
+                text = job["chunks"][len(job["rpids"])]
+                root = job["rpids"][0] if job["rpids"] else None
+
+                if (waited := await limiter.acquire()):
+                    self.logger.debug(f"rate limited for {waited:.1f}s before sending")
+
+                try:
+                    rpid = await self._send_comment(content=text, oid=job["oid"], root=root)
+                except Exception as e:
+                    job["attempts"] += 1
+                    job["error"] = str(e)
+
+                    if is_auth_error(e):
+                        # the retry below goes out with whatever the refresh produced
+                        request_refresh(f"{self.dd_name} got code {e.code}") # type: ignore
+
+                    if job["attempts"] >= max_attempts:
+                        # kept with the chunks summarized so far, tried again by a later poll or drain
+                        job["attempts"] = 0
+                        job["next_try"] = time.time() + cooldown
+                        self._keynote_outbox.save(job)
+                        self.logger.error(f"failed to send comment {max_attempts} times ({e}), retry in {cooldown:.0f}s")
+                        break
+                    else:
+                        delay = backoff * 2 ** (job["attempts"] - 1) * random.uniform(0.8, 1.2)
+                        job["next_try"] = time.time() + delay
+                        self.logger.warning(f"failed to send comment ({e}), retry in {delay:.0f}s")
+
+                    self._keynote_outbox.save(job)
+                    continue
+
                 self.logger.debug(f"sent: {text}")
+                self._keynote_commented.add(job["mid"], job["oid"], rpid)
 
-            self.logger.info(f"finish sending comment: {rpids}")
+                job["rpids"].append(rpid)
+                job["attempts"] = 0
+                job["next_try"] = 0
 
-        except Exception:
-            self.logger.exception("failed to send comment")
+                if len(job["rpids"]) == len(job["chunks"]):
+                    job["status"] = "done"
+
+                self._keynote_outbox.save(job)
+
+            if job["status"] == "done":
+                self._keynote_outbox.remove(job) # rpids are kept by the commented index
+                self.logger.info(f"finish sending comment: {job['rpids']}")
 
+        finally:
+            self._keynote_outbox.release(job)
 
-        return rpids
+        return job["rpids"]
+
+
+    async def _drain_outbox(self) -> None:
+        # at startup and then periodically, jobs still cooling down are left for the next round
+        for job in self._keynote_outbox.pending(self.dd_name):
+            if job["next_try"] > time.time(): continue
+
+            self.logger.info(f"resume sending comment {job['id']} ({len(job['rpids'])}/{len(job['chunks'])})")
+            try:
+                await self.deliver_comment(job, block=False)
+            except Exception:
+                self.logger.exception("failed to resume comment")
 
 
     async def _send_comment(
@@ -300,27 +666,22 @@ class ComponentKeynote(DDMajorInterface):
         type_: biliapi.comment.CommentResourceType = biliapi.comment.CommentResourceType.VIDEO
     ) -> int:
 
-        rpid = -1 # if failed
+        resp = await biliapi.comment.send_comment(
+            text=content, oid=oid, type_=type_,
+            root=root, parent=parent, pic=None,
+            credential=self.bili_cred,
+        )
 
-        try:
-            resp = await biliapi.comment.send_comment(
-                text=content, oid=oid, type_=type_,
-                root=root, parent=parent, pic=None,
-                credential=self.bili_cred,
-            )
-            rpid = resp.get("rpid", -1)
-        except Exception as e:
-            self.logger.error(e)
-        else:
-            pass
+        rpid = int(resp.get("rpid", -1))
+        if rpid <= 0:
+            raise RuntimeError(f"no rpid in response: {resp}")
 
         return rpid
 
 
-    async def summarize(self, content: str, prompt: str, role: str = "") -> str:
-
-        summation = ""
-        messages  = []
+    async def summarize(self, content: str, prompt: str, role: str = "", priority: float = 0) -> str:
+        # queued with every other room's requests, priority is the replay publish time
+        messages = []
 
         if role: messages.append({"role": "system", "content": role})
 
@@ -331,44 +692,99 @@ class ComponentKeynote(DDMajorInterface):
         messages.append({"role": "user", "content": content})
         messages.append({"role": "user", "content": prompt}) # repeat in case the context is too long
 
-
-        responses = await dashscope.AioGeneration.call(
+        summation, usage = await llm.scheduler.submit(
+            self.dd_name,
+            priority=priority,
             api_key=self._keynote_llm["api_key"],
             model=self._keynote_llm.get("model", "qwen-plus"),
             enable_thinking=True,
             messages=messages,
-            stream=True,
-            result_format="message",
-            incremental_output=True,
             **self._keynote_conf.get("llm_params", {}),
         )
 
-        response = {}
+        self.logger.debug("got llm response:\n" + summation)
+        self.logger.debug("token usage:\n" + json.dumps(usage, indent=2))
 
-        async for response in responses: # type: ignore
+        return summation
 
-            status_code = response.get("status_code", 200)
 
-            if status_code != 200:
-                self.logger.warning(f"[{status_code}] {response.get('message', 'no message')}")
-                continue
+    def setup_keynote(self, task: dict, component: dict) -> None:
 
-            choices = response.get("output", {}).get("choices", []) # type: ignore
-            if choices:
-                choice = choices[0]
-                message = choice.get("message", {})
-                content_chunk = message.get("content", "")
+        self._keynote_llm  = self.config.get("dashscope", {}).get("llm", {})
+        self._keynote_conf = component
+        self._keynote_user = biliapi.user.User(int(task.get("user_id")), self.bili_cred) # type: ignore
+        self._keynote_room = task.get("room_id")
 
-                if content_chunk: summation += content_chunk
+        cache_conf = self._keynote_conf.get("subtitle_cache", {})
+        self._keynote_subtitle_cache = SubtitleCache(
+            self.data_dir.joinpath("cache", "subtitle"),
+            ttl=float(cache_conf.get("ttl", 7 * 86400)),
+            expire=float(cache_conf.get("expire", 30 * 86400)),
+        )
 
-                # # debug only
-                # reasoning_content = message.get("reasoning_content", "")
-                # if reasoning_content: print(reasoning_content, end="")
+        if (pruned := self._keynote_subtitle_cache.prune()):
+            self.logger.debug(f"pruned {pruned} expired subtitle cache entries")
 
-        self.logger.debug("got llm response:\n" + summation)
-        self.logger.debug("token usage:\n" + json.dumps(response.get("usage", {}), indent=2))
+        self._keynote_commented = commented_index(self.data_dir.joinpath("commented.jsonl"))
+        self._keynote_outbox = comment_outbox(self.data_dir.joinpath("outbox"))
 
-        return summation
+        cache_ttl = self.config.get("api_cache", {})
+        api_cache("channel_list", float(cache_ttl.get("channel_list", 60)))
+        api_cache("video_detail", float(cache_ttl.get("video_detail", 600)))
+
+        self._keynote_vod_task: asyncio.Task | None = None
+        self._keynote_vod_failed: tuple[str, float] = ("", 0.0)
+
+        self._keynote_adaptive = False
+        self._keynote_stream = {
+            "online": False, "live_time": None, "ended": None,
+            "handled": False, "backoff": 0,
+            "interval": int(self._keynote_conf.get("interval", 60)),
+        }
+
+
+        if "api_key" not in self._keynote_llm:
+            raise ValueError("api_key not configured in dashscope -> llm -> api_key")
+
+        self._keynote_configure_shared()
+
+
+    def _keynote_configure_shared(self) -> None:
+        # the llm queue and the vod pool are shared by all tasks, the last one configured wins
+        llm.scheduler.configure(
+            concurrency=self._keynote_llm.get("concurrency", 2),
+            max_attempts=self._keynote_llm.get("max_attempts", 4),
+            backoff=self._keynote_llm.get("backoff", 10),
+        )
+        vod.configure(self._keynote_conf.get("vod_asr", {}).get("concurrency"))
+
+
+    async def _reconfigure_async(self, config: dict) -> None:
+
+        await super()._reconfigure_async(config)
+
+        component = next((c for c in config.get("task", {}).get("components", []) if c.get("type", "") == "keynote"), None)
+        if not component: return
+
+        llm_conf = config.get("dashscope", {}).get("llm", {})
+        if component == self._keynote_conf and llm_conf == self._keynote_llm: return
+
+        # prompts and llm settings are read per replay, only the polling interval needs a push
+        self._keynote_conf = component
+        self._keynote_llm = llm_conf
+        self._keynote_configure_shared()
+
+        cache_ttl = config.get("api_cache", {})
+        api_cache("channel_list", float(cache_ttl.get("channel_list", 60)))
+        api_cache("video_detail", float(cache_ttl.get("video_detail", 600)))
+
+        if self._keynote_adaptive:
+            self._keynote_adapt_polling()
+        elif (interval := int(component.get("interval", 60))) != self._keynote_stream["interval"]:
+            self._keynote_stream["interval"] = interval
+            self.scheduler.reschedule_job(f"cron_check_replay({self.dd_name})", trigger="interval", seconds=interval)
+
+        self.logger.info("keynote config reloaded")
 
 
     async def _init_async(self, **kwargs) -> None:
@@ -390,32 +806,56 @@ class ComponentKeynote(DDMajorInterface):
 
         if flag_enable_keynote:
 
-            self._keynote_llm  = self.config.get("dashscope", {}).get("llm", {})
-            self._keynote_conf = component # type: ignore
-            self._keynote_user = biliapi.user.User(int(task.get("user_id")), self.bili_cred) # type: ignore
-            self._keynote_room = task.get("room_id") # type: ignore
-
-
-            if "api_key" not in self._keynote_llm:
-                raise ValueError("api_key not configured in dashscope -> llm -> api_key")
-
+            self.setup_keynote(task, component) # type: ignore
 
             self.logger.info("enable keynote component")
 
 
+            # with live_asr in the same task, polling follows the stream status
+            self._keynote_adaptive = any(c.get("type", "") == "live_asr" for c in cmpt)
+
             self.scheduler.add_job(
                 self._cron_check_replay,
                 "interval",
-                seconds=int(self._keynote_conf.get("interval", 60)),
+                seconds=self._keynote_stream["interval"],
                 id=f"cron_check_replay({self.dd_name})",
                 replace_existing=True,
             )
 
+            self.scheduler.add_job(
+                self._report_api_cache,
+                "interval",
+                seconds=3600,
+                id=f"report_api_cache({self.dd_name})",
+                replace_existing=True,
+            )
+
+            # jobs given up for now come back here once their cooldown is over
+            self.scheduler.add_job(
+                self._drain_outbox,
+                "interval",
+                seconds=600,
+                id=f"drain_outbox({self.dd_name})",
+                replace_existing=True,
+            )
 
-            try:
-                await self._cron_check_replay()
-            except Exception:
-                self.logger.exception(f"initial cron check replay failed")
+
+            # resume threads interrupted by a restart before looking for new replays
+            outbox_task = self._event_loop.create_task(self._drain_outbox())
+            self._background_tasks.append(outbox_task)
+            outbox_task.add_done_callback(self._background_tasks.remove)
+
+            # may run into summarizing and commenting, so it does not hold up the other components
+            check_task = self._event_loop.create_task(self._initial_check_replay())
+            self._background_tasks.append(check_task)
+            check_task.add_done_callback(self._background_tasks.remove)
+
+
+    async def _initial_check_replay(self) -> None:
+        try:
+            await self._cron_check_replay(startup=True)
+        except Exception:
+            self.logger.exception(f"initial cron check replay failed")
 
 
     async def send_note(self) -> None:
@@ -442,108 +882,96 @@ class ComponentKeynote(DDMajorInterface):
         raise RuntimeError("not implemented")
 
 
-def find_transcription(path: str, room_id: int | str, start_date: datetime) -> str:
-    transcription = ""
+def parse_live_date(title: str) -> datetime | None:
+    match = re.search(r"(\d+)年(\d+)月(\d+)日(\d+)点", title)
 
-    room_id = str(room_id)
-    files = [f for f in Path(path).iterdir() if f.is_file()]
+    if not match: return None
 
-    for file in files:
-        if room_id in file.stem:
-            _, ts_str = file.stem.split("_")
+    year, month, day, hour = match.groups()
+    return datetime(
+        int(year), int(month), int(day), int(hour),
+        tzinfo=ZoneInfo("Asia/Shanghai")
+    )
 
-            try:
-
-                ts_str  = ts_str.removesuffix(".finish") # ensure not .finish
-                ts_time = datetime.fromtimestamp(int(ts_str), tz=ZoneInfo("Asia/Shanghai"))
 
-                delta = abs(ts_time - start_date)
-                if delta <= timedelta(hours=1):
-                    finish_ts = file.parent.resolve().joinpath(Path(f"{file.stem}.finish{file.suffix}"))
+@contextlib.contextmanager
+def stage_timer(stats: dict | None, name: str) -> Iterator[None]:
+    # stats: name -> [count, seconds]
+    begin = time.perf_counter()
 
-                    if finish_ts.exists():
-                        # file is not .finish, but file.finish exists
-                        file = finish_ts
+    try:
+        yield
+    finally:
+        if stats is not None:
+            item = stats.setdefault(name, [0, 0.0])
+            item[0] += 1
+            item[1] += time.perf_counter() - begin
 
-                    transcription = file.resolve()
-                    break
 
-            except Exception:
-                pass
+_TIMESTAMP_LINE = re.compile(r"^\d+:\d+.*? ")
 
-    return str(transcription)
 
+def remap_page_timestamps(text: str, offsets: PageOffsets) -> str:
+    # "HH:MM:SS content" of the concatenated transcript -> "P2\nMM:SS content" per part
+    comment = []
+    current = -1
 
-def srt_like_str_to_delta(tstr: str) -> timedelta:
-    ts = tstr.split(",", maxsplit=1)
+    for line in text.splitlines(keepends=True):
+        if _TIMESTAMP_LINE.match(line):
+            # start with time
+            tstr, content = line.lstrip().split(" ", maxsplit=1)
 
-    delta = timedelta(0)
+            p_number, seconds = offsets.locate(srt_to_ms(tstr) / 1000)
 
-    if len(ts) >= 2:
-        try:
-            ms = timedelta(milliseconds=float(ts[1]))
-            delta += ms
-        except Exception:
-            pass
+            if p_number != current: # also when the llm goes back to an earlier part
+                current = p_number
+                comment.append(f"\nP{p_number + 1}\n")
 
-    tstr = ts[0]
-    tstr = tstr.replace("：", ":") # use english :
-    ts = tstr.split(":")
+            minutes, seconds = divmod(int(seconds), 60)
+            comment.append(f"{minutes:02d}:{seconds:02d} {content}")
 
-    count = 0
-    for t in ts:
-        it = 0
-        try:
-            it = int(t)
-        except Exception:
-            pass
+        else:
+            comment.append(line)
 
-        count = count * 60 + it
+    return "".join(comment)
 
-    delta += timedelta(seconds=count)
 
-    return delta
+def find_transcription(path: str, room_id: int | str, start_date: datetime) -> str:
+    # {room}_{ts}[.finish].srt / .txt / .segments.jsonl within an hour of start_date,
+    # a .finish marker wins over the transcript itself, then segments over srt
+    candidates = []
 
+    room_id = str(room_id)
+    files = [f for f in Path(path).iterdir() if f.is_file()]
 
-def compress_srt(srt: str) -> str:
-    lines = srt.strip().splitlines()
-    output = []
+    for file in files:
+        name = file.name
+        if not name.startswith(room_id + "_"): continue
 
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
+        if name.removesuffix(".jsonl").removesuffix(".finish").endswith(".segments") and name.endswith(".jsonl"):
+            stem, rank = name.removesuffix(".jsonl"), 1
+        elif file.suffix in (".srt", ".txt"):
+            stem, rank = file.stem, 0
+        else:
+            continue # .part downloads, segment indexes, danmaku and so on
 
-        if line.isdigit():
-            if i + 1 < len(lines) and "-->" in lines[i+1]:
+        finished = stem.endswith(".finish")
+        stem = stem.removesuffix(".finish").removesuffix(".segments")
 
-                time_line = lines[i+1].strip()
-                start_time_str = time_line.split("-->")[0].strip()
+        try:
+            _, ts_str = stem.split("_")
+            ts_time = datetime.fromtimestamp(int(ts_str), tz=ZoneInfo("Asia/Shanghai"))
+        except Exception:
+            continue
 
-                try:
-                    delta = srt_like_str_to_delta(start_time_str)
-                    total_seconds = int(delta.total_seconds())
-                    minutes = total_seconds // 60
-                    seconds = total_seconds % 60
-                    timestamp = f"{minutes:02d}:{seconds:02d}"
-                except Exception:
-                    timestamp = "00:00"
-
-                content_lines = []
-                j = i + 2
-                while j < len(lines):
-                    content_line = lines[j].strip()
-                    if not content_line:
-                        break
-                    content_lines.append(content_line)
-                    j += 1
+        if abs(ts_time - start_date) <= timedelta(hours=1):
+            candidates.append((finished, rank, name, file.resolve()))
 
-                content = " ".join(content_lines)
-                if content:
-                    output.append(f"{timestamp} {content}")
+    if not candidates: return ""
 
-                i = j
-                continue
+    return str(max(candidates)[3])
 
-        i += 1
 
-    return "\n".join(output)
+def compress_srt(srt: str | Iterable[Cue]) -> str:
+    cues = iter_srt(srt.splitlines()) if isinstance(srt, str) else srt
+    return "\n".join(compress_cues(cues))
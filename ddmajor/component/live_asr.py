@@ -1,5 +1,6 @@
-import logging
 import asyncio
+import copy
+import functools
 import logging
 import os
 import json
@@ -12,6 +13,14 @@ import bilibili_api as biliapi
 
 from dashscope.audio import asr
 
+from ddmajor import live_api
+from ddmajor.highlight import LOUDNESS_SUFFIX, LoudnessMeter
+from ddmajor.logging import RateLimit
+from ddmajor.resources import ProcMeter
+from ddmajor.search import transcript_index
+from ddmajor.segments import SUFFIX as SEGMENTS_SUFFIX, SegmentWriter
+from ddmajor.srt import Cue, delta_to_ms, format_cue, ms_to_srt
+from ddmajor.vocabulary import vocabulary_cache
 from .DDMajorInterface import DDMajorInterface
 
 
@@ -32,30 +41,61 @@ class ComponentASR(DDMajorInterface):
             self.logger.info(f"于{live_time.strftime('%H:%M:%S')}开始直播了")
 
             self._asr_sentence_id = 0
-            self._asr_srt_content = ""
             self._asr_live_time   = live_time
             self._asr_time_delta  = datetime.now() - self._asr_live_time
 
-            if self._asr_fp: self._asr_fp.close()
-            self._asr_fp = open(
-                os.path.join(
-                    self._asr_output_dir,
-                    f"{self.live_room.room_display_id}_{int(self._asr_live_time.timestamp())}.srt"
-                ),
-                "a", encoding="utf-8"
+            basename = os.path.join(
+                self._asr_output_dir,
+                f"{self.live_room.room_display_id}_{int(self._asr_live_time.timestamp())}"
             )
+            srt_path = basename + ".srt"
+
+            self._asr_close_outputs()
+            if "srt" in self._asr_formats:
+                self._asr_fp = open(srt_path, "a", encoding="utf-8")
+            if "segments" in self._asr_formats:
+                self._asr_segments = SegmentWriter(basename + SEGMENTS_SUFFIX)
+                if not self._asr_fp: srt_path = basename + SEGMENTS_SUFFIX
+            if self._asr_config.get("loudness", True):
+                self._asr_loudness = LoudnessMeter(basename + LOUDNESS_SUFFIX, __SAMPLE_RATE__)
+
+            if self._asr_index:
+                self._asr_stream_id = self._asr_index.open_stream(
+                    self.live_room.room_display_id, int(self._asr_live_time.timestamp()), srt_path,
+                )
 
             transcribe_task = self._event_loop.create_task(self.transcribe())
             self._background_tasks.append(transcribe_task)
             transcribe_task.add_done_callback(self._background_tasks.remove)
+            self._asr_transcribe_task = transcribe_task
 
         if self._asr_is_online and not is_online:
             self.logger.info("下播了")
-            if self._asr_fp: self._asr_fp.close()
-            self._asr_fp = None
+            self._asr_close_outputs()
+
+            if self._asr_index and self._asr_stream_id is not None:
+                self._asr_index.close_stream(self._asr_stream_id)
+                self._asr_stream_id = None
 
+        if self._asr_index: self._asr_index.flush() # make recent sentences searchable from other processes
+
+        changed = (self._asr_is_online != is_online)
         self._asr_is_online = is_online
 
+        if changed:
+            await self._on_live_status_change(is_online, self._asr_live_time)
+
+
+    def _asr_close_outputs(self) -> None:
+        if self._asr_fp: self._asr_fp.close()
+        self._asr_fp = None
+
+        if self._asr_segments: self._asr_segments.close()
+        self._asr_segments = None
+
+        if self._asr_loudness: self._asr_loudness.close()
+        self._asr_loudness = None
+
 
     async def get_stream_url(self) -> str:
         url = ""
@@ -98,38 +138,66 @@ class ComponentASR(DDMajorInterface):
 
                 if asr.RecognitionResult.is_sentence_end(sentence): # type: ignore
                     self._asr_sentence_id += 1
-                    srt_begin = self._asr_time_delta + timedelta(milliseconds=sentence.get("begin_time", 0)) # type: ignore
-                    srt_end = self._asr_time_delta + timedelta(milliseconds=sentence.get("end_time", 1000)) # type: ignore
-                    srt_record = (
-                        f"{self._asr_sentence_id}\n" +
-                        f"{timedelta_to_srt(srt_begin)} --> {timedelta_to_srt(srt_end)}\n" +
-                        f"{content}\n"
-                    )
+                    self._asr_sentences += 1
+                    delta_ms = delta_to_ms(self._asr_time_delta)
+                    begin_ms = delta_ms + int(sentence.get("begin_time", 0)) # type: ignore
+                    end_ms = delta_ms + int(sentence.get("end_time", 1000)) # type: ignore
+                    srt_record = format_cue(Cue(self._asr_sentence_id, begin_ms, end_ms, content))
 
-                    self.logger.debug("write srt:\n" + srt_record)
-                    self._asr_srt_content += srt_record + "\n"
+                    self.logger.debug("write srt:\n" + srt_record, extra={"stream_time": ms_to_srt(begin_ms)})
 
                     try:
-                        print(srt_record, file=self._asr_fp, flush=True)
+                        if self._asr_fp:
+                            print(srt_record, file=self._asr_fp, flush=True)
+                        if self._asr_segments:
+                            self._asr_segments.write(begin_ms, end_ms, content)
                     except Exception as e:
                         self.logger.error(f"failed to write: {e}")
 
+                    if self._asr_index and self._asr_stream_id is not None:
+                        try:
+                            self._asr_index.add_cue(self._asr_stream_id, begin_ms, content)
+                        except Exception as e:
+                            self.logger.error(f"failed to index: {e}")
+
+                    live_api.publish(self._asr_event(self._asr_sentence_id, begin_ms, end_ms, content, True))
+
                 else:
-                    self.logger.debug(content)
+                    if live_api.wants_partial():
+                        delta_ms = delta_to_ms(self._asr_time_delta)
+                        begin_ms = delta_ms + int(sentence.get("begin_time") or 0) # type: ignore
+                        live_api.publish(self._asr_event(self._asr_sentence_id + 1, begin_ms, None, content, False))
+
+                    if self.logger.isEnabledFor(logging.DEBUG) and self._asr_partial_limit():
+                        # partial results arrive several times a second, most of them are noise in the log
+                        skipped = self._asr_partial_limit.pop_skipped()
+                        self.logger.debug(content + (f" (+{skipped} partial)" if skipped else ""))
 
         return _transcribe_callback
 
 
+    def _asr_event(self, id: int, begin_ms: int, end_ms: int | None, text: str, final: bool) -> dict:
+        # partial results carry the id of the sentence they will end up as
+        return {
+            "room": str(self.live_room.room_display_id), "task": self.dd_name,
+            "stream_start": int(self._asr_live_time.timestamp()),
+            "id": id, "start_ms": begin_ms, "end_ms": end_ms, "text": text, "final": final,
+        }
+
+
     async def transcribe(self) -> None:
 
         recognition = None
 
-        while self._asr_is_online:
+        while self._asr_is_online and not self._asr_stopping:
+
+            stream = None
 
             try:
 
                 url = await self.get_stream_url()
                 stream = await ffmpeg_to_audio_bytes(url)
+                self._asr_ffmpeg = stream
 
 
                 update_time_delta_task = self._event_loop.create_task(self._update_time_delta(url))
@@ -138,7 +206,17 @@ class ComponentASR(DDMajorInterface):
 
 
                 asr_config: dict = self.config.get("dashscope", {}).get("asr", {})
-                asr_params: dict = self._asr_config.get("asr_params", {})
+                # a copy per session, the task config stays as loaded
+                asr_params: dict = dict(self._asr_config.get("asr_params", {}))
+                asr_params.pop("vocabulary", None) # provisioned into vocabulary_id
+                asr_params.pop("__comment__", None)
+
+                if self._asr_vocabulary_task and not self._asr_vocabulary_task.done():
+                    # give a fresh vocabulary a moment, never hold the stream for it
+                    await asyncio.wait([self._asr_vocabulary_task], timeout=10)
+
+                if self._asr_vocabulary_id and "vocabulary_id" not in asr_params:
+                    asr_params["vocabulary_id"] = self._asr_vocabulary_id
 
                 callback = ASRCallback(
                     name=self.dd_name,
@@ -150,8 +228,7 @@ class ComponentASR(DDMajorInterface):
                     "api_key", "model", "format",
                     "sample_rate", "callback",
                     "base_websocket_api_url",
-                    "heartbeat", "vocabulary",
-                    "__comment__",
+                    "heartbeat",
                 ]: # remove keys that are already used or not needed
                     if k in asr_params:
                         self.logger.warning(f"remove asr_params[{k}] since it's already used or not needed")
@@ -172,32 +249,38 @@ class ComponentASR(DDMajorInterface):
                 )
 
                 recognition.start()
+                self._asr_sessions += 1
+
+                if self._asr_loudness: self._asr_loudness.rebase(self._asr_time_delta.total_seconds())
 
                 try:
                     while stream.returncode is None:
                         chunk = await stream.stdout.read(4096) # type: ignore
                         if not chunk or stream.returncode:
-                            self.logger.warning("ffmpeg stream closed")
+                            if not self._asr_stopping: self.logger.warning("ffmpeg stream closed")
                             break
                         else:
                             recognition.send_audio_frame(chunk)
+                            self._asr_bytes_sent += len(chunk)
+                            if self._asr_loudness: self._asr_loudness.feed(chunk)
 
                 except Exception as e:
                     self.logger.warning(f"send audio stream: {e}")
 
                 try:
-                    recognition.stop()
+                    # waits for the last sentences, their callbacks keep running on this loop meanwhile
+                    await self._event_loop.run_in_executor(None, recognition.stop)
                 except Exception as _:
                     pass
 
-                if stream.returncode is None:
-                    stream.kill()
-
             except Exception as e:
                 self.logger.error(f"exception during transcription: {e}")
             finally:
-                pass
+                if stream and stream.returncode is None:
+                    stream.kill()
+                self._asr_ffmpeg = None
 
+            if self._asr_stopping: break
             await asyncio.sleep(5)
 
 
@@ -250,7 +333,7 @@ class ComponentASR(DDMajorInterface):
         if flag_enable_asr:
             self.logger.info("enable speech to text component")
 
-            self._asr_config = component
+            self._asr_config = copy.deepcopy(component) # as loaded, what reloads compare against
             self._asr_output_dir = component["output_dir"] # type: ignore
 
             self.live_room = biliapi.live.LiveRoom(
@@ -258,16 +341,36 @@ class ComponentASR(DDMajorInterface):
                 credential=self.bili_cred,
             )
 
-            # self.live_danmaku = biliapi.live.LiveDanmaku(
-            #     room_display_id=task.get("room_id"),
-            #     credential=self.bili_cred,
-            # )
-            # self._danmaku_task = asyncio.create_task(self.live_danmaku.connect())
-
             self._asr_fp = None
+            self._asr_partial_limit = RateLimit(float(self._asr_config.get("partial_log_interval", 1)))
+            self._asr_segments = None
+            self._asr_loudness = None
+            self._asr_formats = set(self._asr_config.get("formats", ["segments", "srt"]))
             self._asr_is_online = False
+            self._asr_stopping = False
+            self._asr_transcribe_task = None
+
+            self._asr_stream_id = None
+            self._asr_index = transcript_index(self.data_dir.joinpath("transcripts.db")) \
+                if self._asr_config.get("search_index", True) else None
             self._asr_live_time = datetime.now()
 
+            self._asr_vocabulary_id = None
+            self._asr_vocabulary_task = None
+
+            # per-room resource accounting, totals since the task started
+            self._asr_ffmpeg = None
+            self._asr_ffmpeg_meter = ProcMeter()
+            self._asr_sessions = 0
+            self._asr_bytes_sent = 0 # audio frames sent over the recognition websocket
+            self._asr_sentences = 0
+
+            vocabulary = self._asr_config.get("asr_params", {}).get("vocabulary")
+            if vocabulary and not self._asr_config.get("asr_params", {}).get("vocabulary_id"):
+                self._asr_vocabulary_task = self._event_loop.create_task(self._provision_vocabulary(vocabulary))
+                self._background_tasks.append(self._asr_vocabulary_task)
+                self._asr_vocabulary_task.add_done_callback(self._background_tasks.remove)
+
             self.scheduler.add_job(
                 self._check_online,
                 "interval",
@@ -277,13 +380,110 @@ class ComponentASR(DDMajorInterface):
             )
 
             try:
-                await self._check_online()
+                async with self.startup_phase("check_online"):
+                    await self._check_online()
             except Exception:
                 self.logger.exception(f"initial check online failed")
 
 
-    def stop(self) -> None:
-        if self._asr_fp: self._asr_fp.close()
+    async def _reconfigure_async(self, config: dict) -> None:
+
+        await super()._reconfigure_async(config)
+
+        component = next((c for c in config.get("task", {}).get("components", []) if c.get("type", "") == "live_asr"), None)
+        if not component or component == self._asr_config: return
+
+        # asr_params, formats and output_dir apply from the next recognition session or
+        # stream, the running one is left alone
+        previous, self._asr_config = self._asr_config, copy.deepcopy(component)
+        self._asr_formats = set(component.get("formats", ["segments", "srt"]))
+        self._asr_partial_limit.interval = float(component.get("partial_log_interval", 1))
+        self._asr_output_dir = component["output_dir"]
+
+        if component.get("interval", 60) != previous.get("interval", 60):
+            self.scheduler.reschedule_job(f"check_online({self.dd_name})", trigger="interval", seconds=int(component.get("interval", 60)))
+
+        vocabulary = component.get("asr_params", {}).get("vocabulary")
+        if vocabulary != previous.get("asr_params", {}).get("vocabulary"):
+            self._asr_vocabulary_id = None
+            if vocabulary and not component.get("asr_params", {}).get("vocabulary_id"):
+                self._asr_vocabulary_task = self._event_loop.create_task(self._provision_vocabulary(vocabulary))
+                self._background_tasks.append(self._asr_vocabulary_task)
+                self._asr_vocabulary_task.add_done_callback(self._background_tasks.remove)
+
+        self.logger.info("live_asr config reloaded")
+
+
+    async def _provision_vocabulary(self, vocabulary: list[dict]) -> None:
+        asr_config: dict = self.config.get("dashscope", {}).get("asr", {})
+        cache = vocabulary_cache(self.data_dir.joinpath("vocabulary.json"))
+
+        try:
+            self._asr_vocabulary_id = await self._event_loop.run_in_executor(
+                None,
+                functools.partial(
+                    cache.provision,
+                    asr_config["api_key"], vocabulary, __ASR_MODEL__,
+                    owner=self.dd_name,
+                    prefix=self._asr_config.get("vocabulary_prefix", "ddmajor"),
+                    base_websocket_api_url=asr_config.get(
+                        "base_websocket_api_url",
+                        "wss://dashscope.aliyuncs.com/api-ws/v1/inference"
+                    ),
+                ),
+            )
+            self.logger.info(f"use vocabulary {self._asr_vocabulary_id}")
+        except Exception as e:
+            self.logger.error(f"failed to provision vocabulary, transcribe without it: {e}")
+
+
+    def _collect_resources(self, report: dict) -> None:
+
+        super()._collect_resources(report)
+
+        if not hasattr(self, "_asr_ffmpeg_meter"): return
+
+        ffmpeg = self._asr_ffmpeg
+        report["ffmpeg"] = self._asr_ffmpeg_meter.sample(ffmpeg.pid if ffmpeg and ffmpeg.returncode is None else None)
+        report["asr"] = {
+            "online": self._asr_is_online,
+            "sessions": self._asr_sessions,
+            "bytes_sent": self._asr_bytes_sent,
+            "sentences": self._asr_sentences,
+        }
+
+
+    async def _stop_async(self, report: dict) -> None:
+        # kill ffmpeg so the audio loop sees eof, let recognition deliver its final
+        # sentences, then close what they were written to
+
+        if not hasattr(self, "_asr_stopping"): return await super()._stop_async(report)
+
+        self._asr_stopping = True
+        sentences = self._asr_sentences
+
+        try:
+            if (ffmpeg := self._asr_ffmpeg) and ffmpeg.returncode is None:
+                ffmpeg.kill()
+                report["ffmpeg_killed"] = ffmpeg.pid
+
+            if (task := self._asr_transcribe_task) and not task.done():
+                await asyncio.wait([task])
+
+            await asyncio.sleep(0.1) # callbacks scheduled by the last stop()
+
+        finally:
+            report["sentences_drained"] = self._asr_sentences - sentences
+            report["transcripts_closed"] = sum(1 for f in [self._asr_fp, self._asr_segments] if f)
+            self._asr_close_outputs()
+
+            if self._asr_index:
+                if self._asr_stream_id is not None:
+                    self._asr_index.close_stream(self._asr_stream_id)
+                    self._asr_stream_id = None
+                self._asr_index.flush()
+
+            await super()._stop_async(report)
 
 
 def sort_durl(durl: list[dict]) -> list[dict]:
@@ -352,22 +552,3 @@ class ASRCallback(asr.RecognitionCallback):
             self.callback(result),
             self.event_loop,
         )
-
-
-def timedelta_to_srt(td: timedelta):
-    # Get total seconds as a float
-    total_seconds = td.total_seconds()
-
-    # Calculate components
-    hours = int(total_seconds // 3600)
-    minutes = int((total_seconds % 3600) // 60)
-    seconds = int(total_seconds % 60)
-    milliseconds = int(round((total_seconds - int(total_seconds)) * 1000))
-
-    # Handle overflow from rounding (e.g., 999.5ms becoming 1000ms)
-    if milliseconds == 1000:
-        seconds += 1
-        milliseconds = 0
-        # You could continue this logic for minutes/hours if needed
-
-    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
\ No newline at end of file
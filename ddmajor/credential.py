@@ -1,51 +1,192 @@
+import asyncio
 import json
+import threading
+import time
+
+from pathlib import Path
 
 import bilibili_api as biliapi
 
+from ddmajor.cache import atomic_write_json
 from ddmajor.logging import logger
-from ddmajor import DDMajor
 
 
-bili_cred = biliapi.Credential()
+CHECK_INTERVAL = 1800 # ask the server whether the cookies are due for a refresh
+RETRY_INTERVAL = 300  # after a failed check or refresh
+MIN_INTERVAL   = 60   # between checks requested by auth errors
 
+AUTH_CODES = {-101, -111} # not logged in, csrf mismatch
 
-def init_credential(credential: dict) -> None:
-    global bili_cred
-    bili_cred = biliapi.Credential(**credential)
 
+def is_auth_error(e: BaseException) -> bool:
+    return isinstance(e, biliapi.exceptions.ResponseCodeException) and e.code in AUTH_CODES
+
+
+def _persisted_cookies(cred: biliapi.Credential) -> dict:
+    # same keys as "bili_credential" in the config, i.e. Credential(**cookies)
+    cookies = cred.get_cookies()
+
+    for key in ["SESSDATA", "DedeUserID"]:
+        if key in cookies: cookies.pop(key)
+
+    return {k: v for k, v in cookies.items() if v}
+
+
+class CredentialManager:
+
+    # every task holds the same Credential object, refreshes mutate it in place so a
+    # new cookie is seen by the next api call of any task without handing it around.
+    # checks run on a loop thread of their own and never block a task.
+
+    def __init__(self, credential: dict, fn: str | None = None) -> None:
+        self.credential = biliapi.Credential(**credential)
+        self.fn = fn
+
+        self.checked = threading.Event() # first check finished, successful or not
+        self.refreshed = 0
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._wake: asyncio.Event | None = None
+        self._main: asyncio.Task | None = None
+        self._last_check = 0.0
+
+
+    def start(self) -> None:
+        if self._thread: return
+
+        self._loop = asyncio.new_event_loop()
+
+        def _run() -> None:
+            asyncio.set_event_loop(self._loop)
+            self._main = self._loop.create_task(self._run()) # type: ignore
+            try:
+                self._loop.run_until_complete(self._main) # type: ignore
+            except asyncio.CancelledError:
+                pass
+
+        self._thread = threading.Thread(target=_run, name="ddmajor-credential", daemon=True)
+        self._thread.start()
+
+
+    def stop(self, timeout: float = 5) -> None:
+        if not self._thread or not self._loop: return
+
+        def _cancel() -> None:
+            if self._main: self._main.cancel()
+
+        self._loop.call_soon_threadsafe(_cancel)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+    def request_refresh(self, reason: str = "") -> None:
+        # from any thread, e.g. right after an api call failed with an auth error
+        if not self._loop or self._loop.is_closed(): return
+
+        logger.info(f"credential check requested: {reason}" if reason else "credential check requested")
+        self._loop.call_soon_threadsafe(lambda: self._wake and self._wake.set())
 
-def get_credential() -> biliapi.Credential:
-    return bili_cred
 
+    def update(self, credential: dict) -> bool:
+        # cookies edited in the config file by hand, applied in place as well
+        fresh = biliapi.Credential(**credential)
+        if _persisted_cookies(fresh) == _persisted_cookies(self.credential): return False
 
-def check_and_rotate_credential(config: dict, fn: str, dd_list: list[DDMajor]=[]) -> None:
+        vars(self.credential).update(vars(fresh))
+        logger.info("credential updated from config file")
 
-    global bili_cred
+        return True
 
-    try:
-        if biliapi.sync(bili_cred.check_refresh()):
-            logger.info("crendential expired, refreshing...")
-            biliapi.sync(bili_cred.refresh())
 
-            cookies = bili_cred.get_cookies()
+    async def _run(self) -> None:
+        self._wake = asyncio.Event()
+        biliapi.select_client("aiohttp")
 
-            for key in ["SESSDATA", "DedeUserID"]:
-                if key in cookies: cookies.pop(key)
+        interval = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+                forced = True
+            except asyncio.TimeoutError:
+                forced = False
+
+            self._wake.clear()
+
+            if forced and (wait := self._last_check + MIN_INTERVAL - time.monotonic()) > 0:
+                # a burst of failing calls only causes one check
+                await asyncio.sleep(wait)
+                self._wake.clear()
+
+            try:
+                await self._check(forced)
+                interval = CHECK_INTERVAL
+            except Exception:
+                logger.exception("failed to refresh credential")
+                interval = RETRY_INTERVAL
+            finally:
+                self._last_check = time.monotonic()
+                self.checked.set()
+
+
+    async def _check(self, forced: bool) -> None:
+        due = await self.credential.check_refresh()
+
+        if not due and forced:
+            # the server may consider the cookies fresh and still reject them
+            due = not await self.credential.check_valid()
+
+        if not due:
+            logger.debug("credential is fresh")
+            return
+
+        logger.info("crendential expired, refreshing...")
+        await self.credential.refresh()
+
+        self.refreshed += 1
+        logger.info("credential refreshed")
+
+        if self.fn:
+            await asyncio.get_running_loop().run_in_executor(None, self._persist)
+
+
+    def _persist(self) -> None:
+        path = Path(self.fn) # type: ignore
+
+        # in case the config file is edited after the program is launched
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        config["bili_credential"] = _persisted_cookies(self.credential)
+
+        atomic_write_json(path, config, indent=4)
+
+
+_manager: CredentialManager | None = None
+
+
+def init_credential(credential: dict, fn: str | None = None) -> CredentialManager:
+    # fn: config file the refreshed cookies are written back to
+    global _manager
+
+    if _manager: _manager.stop()
+    _manager = CredentialManager(credential, fn)
+
+    return _manager
+
+
+def get_credential() -> biliapi.Credential:
+    if not _manager: init_credential({})
+    return _manager.credential # type: ignore
 
-            for k, v in list(cookies.items()):
-                if not v: cookies.pop(k)
 
-            # in case the config file is edited after the program is launched
-            with open(fn, "r", encoding="utf-8") as f:
-                new_config = json.load(f)
+def request_refresh(reason: str = "") -> None:
+    if _manager: _manager.request_refresh(reason)
 
-            new_config.update({"bili_credential": cookies})
 
-            with open(fn, "w", encoding="utf-8") as f:
-                json.dump(new_config, f, indent=4, sort_keys=False)
+def update_credential(credential: dict) -> bool:
+    return _manager.update(credential) if _manager else False
 
-            for dd in dd_list:
-                dd._event_loop.call_soon_threadsafe(dd.update_cred, bili_cred)
 
-    except Exception:
-        logger.exception("failed to refresh credential")
\ No newline at end of file
+def stop() -> None:
+    if _manager: _manager.stop()
@@ -0,0 +1,239 @@
+import bisect
+import json
+import typing
+
+from pathlib import Path
+
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ddmajor.srt import Cue
+
+
+# per-minute signals, all indexed by minutes from the stream start
+#   speech    characters recognized per minute
+#   loudness  loudest second of the minute in dBFS, {room}_{ts}.loudness.jsonl from live_asr
+#   chat      danmaku messages per minute, {room}_{ts}.danmaku.jsonl from the danmaku component
+
+LOUDNESS_SUFFIX = ".loudness.jsonl"
+DANMAKU_SUFFIX = ".danmaku.jsonl"
+
+DEFAULT_WEIGHTS = {"speech": 1.0, "loudness": 1.0, "chat": 1.5}
+
+
+class Window(typing.NamedTuple):
+    start: int   # seconds from stream start
+    end: int
+    score: float
+
+
+class LoudnessMeter:
+
+    # fed with the s16le pcm going to asr, writes {"m": minute, "rms": dB, "peak": dB} per minute
+
+    def __init__(self, path: str | Path, sample_rate: int = 16000) -> None:
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+
+        self._fp = open(self.path, "a", encoding="utf-8")
+        self._carry = b""
+        self._base = 0.0
+        self._samples = 0
+
+        self._minute = -1
+        self._seconds: list[float] = [] # mean square of each second in the current minute
+        self._acc = 0.0
+        self._acc_n = 0
+        self._acc_start = 0
+
+
+    def rebase(self, seconds: float) -> None:
+        # a new ffmpeg process starts at `seconds` on the stream timeline
+        self._close_second()
+        self._carry = b""
+        self._base = seconds
+        self._samples = 0
+
+
+    def feed(self, chunk: bytes) -> None:
+        buf = self._carry + chunk
+        even = len(buf) - len(buf) % 2
+        self._carry = buf[even:]
+
+        pcm = np.frombuffer(buf[:even], dtype="<i2").astype(np.float32)
+        if not pcm.size: return
+
+        if not self._acc_n: self._acc_start = self._samples
+
+        self._acc += float(np.dot(pcm, pcm))
+        self._acc_n += pcm.size
+        self._samples += pcm.size
+
+        if self._acc_n >= self.sample_rate:
+            self._close_second()
+
+
+    def _close_second(self) -> None:
+        if not self._acc_n: return
+
+        minute = int((self._base + self._acc_start / self.sample_rate) // 60)
+        if minute != self._minute:
+            self._write_minute()
+            self._minute = minute
+
+        self._seconds.append(self._acc / self._acc_n)
+        self._acc, self._acc_n = 0.0, 0
+
+
+    def _write_minute(self) -> None:
+        if self._minute < 0 or not self._seconds: return
+
+        db = 10 * np.log10(np.asarray(self._seconds) / 32768.0 ** 2 + 1e-12)
+        print(json.dumps({"m": self._minute, "rms": round(float(db.mean()), 1), "peak": round(float(db.max()), 1)}), file=self._fp, flush=True)
+
+        self._seconds = []
+
+
+    def close(self) -> None:
+        self._close_second()
+        self._write_minute()
+        self._fp.close()
+
+
+def find_sidecar(folders: typing.Iterable[str | Path], room: int | str, ts: int, suffix: str) -> tuple[Path, int] | None:
+    # {room}_{ts}{suffix} closest to ts within an hour, and its own ts
+    best = None
+
+    for folder in folders:
+        for path in Path(folder).glob(f"{room}_*{suffix}"):
+            try:
+                other = int(path.name.removesuffix(suffix).split("_")[1])
+            except (IndexError, ValueError):
+                continue
+
+            if abs(other - ts) <= 3600 and (best is None or abs(other - ts) < abs(best[1] - ts)):
+                best = (path, other)
+
+    return best
+
+
+def speech_rate(cues: typing.Iterable[Cue]) -> np.ndarray:
+    minutes, chars = [], []
+
+    for cue in cues:
+        minutes.append(cue.start_ms // 60_000)
+        chars.append(len(cue.text))
+
+    m, c = np.asarray(minutes, dtype=int), np.asarray(chars, dtype=float)
+    keep = m >= 0
+
+    return np.bincount(m[keep], weights=c[keep]) if keep.any() else np.zeros(0)
+
+
+def load_loudness(path: str | Path, shift: int = 0) -> np.ndarray:
+    # a minute written twice around an asr reconnect keeps its louder half
+    minutes, peaks = [], []
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+                minutes.append(int(item["m"]) + shift)
+                peaks.append(float(item["peak"]))
+            except (ValueError, KeyError):
+                continue
+
+    m = np.asarray(minutes, dtype=int)
+    keep = m >= 0
+    if not keep.any(): return np.zeros(0)
+
+    out = np.full(m[keep].max() + 1, np.nan)
+    np.fmax.at(out, m[keep], np.asarray(peaks)[keep])
+
+    # silence and missing minutes both count as the quietest minute seen
+    return np.nan_to_num(out, nan=np.nanmin(out))
+
+
+def chat_density(path: str | Path, shift: int = 0) -> np.ndarray:
+    minutes = []
+
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                minutes.append(int(json.loads(line)["o"]) // 60000 + shift)
+            except (ValueError, KeyError):
+                continue
+
+    m = np.asarray(minutes, dtype=int)
+    m = m[m >= 0]
+    return np.bincount(m).astype(float) if m.size else np.zeros(0)
+
+
+def robust_z(x: np.ndarray) -> np.ndarray:
+    median = np.median(x)
+    mad = np.median(np.abs(x - median)) * 1.4826
+    if mad < 1e-9: mad = x.std() or 1.0
+    return np.clip((x - median) / mad, -3, 5)
+
+
+def score_minutes(signals: dict[str, np.ndarray], weights: dict[str, float] | None = None) -> np.ndarray:
+    weights = weights or DEFAULT_WEIGHTS
+    signals = {k: v for k, v in signals.items() if v.size and weights.get(k, 0) > 0}
+    if not signals: return np.zeros(0)
+
+    n = max(v.size for v in signals.values())
+    total = sum(weights[k] for k in signals)
+
+    score = np.zeros(n)
+    for k, v in signals.items():
+        score += weights[k] / total * robust_z(np.pad(v, (0, n - v.size), constant_values=np.median(v)))
+
+    return score
+
+
+def rank_windows(score: np.ndarray, window: int = 5, top: int = 8) -> list[Window]:
+    # best non-overlapping windows of `window` minutes, returned in stream order
+    if score.size < window: return []
+
+    means = sliding_window_view(score, window).mean(axis=1)
+    taken = np.zeros(score.size, dtype=bool)
+    picked = []
+
+    for i in np.argsort(means)[::-1]:
+        if means[i] <= 0: break # no better than an ordinary stretch of the stream
+        if taken[i:i + window].any(): continue
+
+        taken[i:i + window] = True
+        picked.append(Window(int(i) * 60, int(i + window) * 60, float(means[i])))
+
+        if len(picked) >= top: break
+
+    return sorted(picked)
+
+
+def detect(
+    cues: typing.Iterable[Cue], loudness: np.ndarray | None = None, chat: np.ndarray | None = None,
+    window: int = 5, top: int = 8, weights: dict[str, float] | None = None,
+) -> list[Window]:
+    signals = {"speech": speech_rate(cues)}
+    if loudness is not None: signals["loudness"] = loudness
+    if chat is not None: signals["chat"] = chat
+
+    score = score_minutes(signals, weights)
+
+    # nothing to focus on when the windows would cover the whole stream anyway
+    if score.size <= window * top: return []
+
+    return rank_windows(score, window, top)
+
+
+def in_windows(cues: typing.Iterable[Cue], windows: list[Window]) -> typing.Iterator[Cue]:
+    starts = [w.start for w in windows]
+    ends = [w.end for w in windows]
+
+    for cue in cues:
+        seconds = cue.start_ms / 1000
+        k = bisect.bisect_right(starts, seconds) - 1
+        if k >= 0 and seconds < ends[k]:
+            yield cue
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import threading
+import typing
+
+import aiohttp
+
+from ddmajor.logging import logger
+
+
+# every DDMajor task runs its own event loop, while an aiohttp session is bound to
+# the loop it was created on. To share one connection pool by the whole process,
+# requests are executed on a dedicated loop thread and only the results travel back.
+
+_lock = threading.Lock()
+_loop: asyncio.AbstractEventLoop | None = None
+_thread: threading.Thread | None = None
+_session: aiohttp.ClientSession | None = None
+
+POOL_LIMIT = 32
+POOL_LIMIT_PER_HOST = 8
+TIMEOUT = aiohttp.ClientTimeout(total=60, connect=10)
+
+
+class Response(typing.NamedTuple):
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+    def json(self) -> typing.Any:
+        return json.loads(self.body)
+
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread
+
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="ddmajor-http", daemon=True)
+            _thread.start()
+
+    return _loop
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    global _session
+
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_LIMIT, limit_per_host=POOL_LIMIT_PER_HOST, ttl_dns_cache=300),
+            timeout=TIMEOUT,
+        )
+
+    return _session
+
+
+async def _request(method: str, url: str, **kwargs) -> Response:
+    session = await _get_session()
+
+    async with session.request(method, url, **kwargs) as resp:
+        body = await resp.read()
+        return Response(resp.status, dict(resp.headers), body)
+
+
+async def request(method: str, url: str, **kwargs) -> Response:
+    future = asyncio.run_coroutine_threadsafe(_request(method, url, **kwargs), _ensure_loop())
+    return await asyncio.wrap_future(future)
+
+
+async def get(url: str, **kwargs) -> Response:
+    return await request("GET", url, **kwargs)
+
+
+def close(timeout: float = 5) -> None:
+    global _loop, _session
+
+    with _lock:
+        loop, _loop = _loop, None
+
+    if loop is None: return
+
+    try:
+        if _session is not None:
+            asyncio.run_coroutine_threadsafe(_session.close(), loop).result(timeout=timeout)
+    except Exception as e:
+        logger.warning(f"failed to close http session: {e}")
+    finally:
+        _session = None
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,258 @@
+import asyncio
+import collections
+import json
+import threading
+import time
+
+from aiohttp import web
+
+from ddmajor.logging import logger
+
+
+# server-sent events with the sentences of every live_asr task, served from a loop thread
+# of its own. a task thread only hands an event over with call_soon_threadsafe, each
+# subscriber has a bounded buffer that drops its oldest events when the client is slow,
+# so nothing a client does can hold up transcription.
+#
+#   GET /events?room=123&partial=1   stream, room may be repeated, all rooms by default
+#   GET /rooms                       rooms seen so far and subscriber counts
+#
+#   event: sentence
+#   data: {"room": "123", "task": "dd", "stream_start": 1735689600, "id": 42, "start_ms": 61234, "end_ms": 63000, "text": "...", "final": true}
+#
+#   event: partial (same fields, end_ms null, final false) / dropped (data: number of events lost)
+
+HEARTBEAT = 15
+
+
+class Subscriber:
+
+    def __init__(self, rooms: set[str], partial: bool, size: int) -> None:
+        self.rooms = rooms # empty for all rooms
+        self.partial = partial
+
+        self.buffer: collections.deque[dict] = collections.deque(maxlen=max(1, size))
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+
+
+    def wants(self, room: str, final: bool) -> bool:
+        return (final or self.partial) and (not self.rooms or room in self.rooms)
+
+
+    def put(self, event: dict) -> None:
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1 # the deque drops the oldest one
+        self.buffer.append(event)
+        self.wakeup.set()
+
+
+class LiveAPI:
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, buffer: int = 256, partial: bool = True) -> None:
+        self.host = host
+        self.port = port
+        self.buffer = buffer
+        self.partial = partial # whether partial results are published at all
+
+        self.subscribers: set[Subscriber] = set()
+        self.rooms: dict[str, dict] = {}
+        self.published = 0
+
+        self._partial_wanted = 0 # subscribers asking for partial results, read from task threads
+        self._closing = False
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._runner: web.AppRunner | None = None
+
+
+    def start(self, timeout: float = 5) -> bool:
+        # False when the server could not be started, e.g. the port is in use
+        started = threading.Event()
+        serving = False
+        loop = self._loop = asyncio.new_event_loop()
+
+        def _run() -> None:
+            nonlocal serving
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self._serve())
+                serving = True
+            except Exception:
+                logger.exception("live api failed to start")
+                loop.close() # publish() checks is_closed, nothing piles up on it
+            finally:
+                started.set()
+
+            if serving: loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, name="ddmajor-live-api", daemon=True)
+        self._thread.start()
+
+        if not started.wait(timeout):
+            self.stop(timeout)
+            return False
+
+        if not serving:
+            self._thread.join(timeout)
+            self._thread = None
+            return False
+
+        return True
+
+
+    async def _serve(self) -> None:
+        app = web.Application()
+        app.router.add_get("/events", self._events)
+        app.router.add_get("/rooms", self._rooms)
+
+        self._runner = web.AppRunner(app, handle_signals=False, shutdown_timeout=1)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        logger.info(f"live api listening on http://{self.host}:{self.port}/events")
+
+
+    def stop(self, timeout: float = 5) -> None:
+        if not self._loop or not self._thread: return
+
+        async def _cleanup() -> None:
+            # open streams end right away instead of at their next heartbeat
+            self._closing = True
+            for sub in self.subscribers: sub.wakeup.set()
+
+            if self._runner: await self._runner.cleanup()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_cleanup(), self._loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"failed to stop live api: {e!r}")
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+    def wants_partial(self) -> bool:
+        return self.partial and self._partial_wanted > 0
+
+
+    def publish(self, event: dict) -> None:
+        # from any thread, never blocks
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._fanout, event)
+
+
+    def _fanout(self, event: dict) -> None:
+        room, final = event["room"], event["final"]
+
+        info = self.rooms.setdefault(room, {"task": event.get("task"), "sentences": 0, "last": 0})
+        if final: info["sentences"] += 1
+        info["last"] = int(time.time())
+
+        self.published += 1
+
+        for sub in self.subscribers:
+            if sub.wants(room, final): sub.put(event)
+
+
+    async def _rooms(self, request: web.Request) -> web.Response:
+        counts = collections.Counter(room for sub in self.subscribers for room in (sub.rooms or self.rooms))
+        return web.json_response({
+            room: {**info, "subscribers": counts.get(room, 0)} for room, info in self.rooms.items()
+        })
+
+
+    async def _events(self, request: web.Request) -> web.StreamResponse:
+        rooms = set(request.query.getall("room", []))
+        partial = self.partial and request.query.get("partial", "") in ("1", "true")
+
+        try:
+            # a client may ask for less buffering, never for more than configured
+            size = min(int(request.query.get("buffer", self.buffer)), self.buffer)
+        except ValueError:
+            size = self.buffer
+
+        sub = Subscriber(rooms, partial, size)
+
+        resp = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        await resp.prepare(request)
+
+        self.subscribers.add(sub)
+        self._partial_wanted += partial
+        logger.info(f"live api subscriber {request.remote} joined, rooms {sorted(rooms) or 'all'}")
+
+        dropped = 0
+
+        try:
+            while not self._closing:
+                try:
+                    await asyncio.wait_for(sub.wakeup.wait(), timeout=HEARTBEAT)
+                except asyncio.TimeoutError:
+                    await resp.write(b": ping\n\n") # also notices a client that went away
+                    continue
+
+                sub.wakeup.clear()
+
+                if sub.dropped != dropped:
+                    await resp.write(f"event: dropped\ndata: {sub.dropped - dropped}\n\n".encode())
+                    dropped = sub.dropped
+
+                chunks = []
+                while sub.buffer:
+                    event = sub.buffer.popleft()
+                    data = json.dumps(event, ensure_ascii=False)
+                    chunks.append(f"event: {'sentence' if event['final'] else 'partial'}\ndata: {data}\n\n")
+
+                if chunks: await resp.write("".join(chunks).encode())
+
+        except ConnectionResetError:
+            pass
+
+        finally:
+            self.subscribers.discard(sub)
+            self._partial_wanted -= partial
+            logger.info(f"live api subscriber {request.remote} left, {sub.dropped} events dropped")
+
+        return resp
+
+
+_api: LiveAPI | None = None
+
+
+def start(conf: dict) -> LiveAPI | None:
+    # conf is the "live_api" section, nothing is started unless enabled
+    global _api
+
+    if not conf.get("enabled", False): return None
+
+    _api = LiveAPI(
+        host=conf.get("host", "127.0.0.1"),
+        port=int(conf.get("port", 8765)),
+        buffer=int(conf.get("buffer", 256)),
+        partial=bool(conf.get("partial", True)),
+    )
+    if not _api.start():
+        logger.error(f"live api disabled, failed to listen on {_api.host}:{_api.port}")
+        _api = None
+
+    return _api
+
+
+def stop() -> None:
+    global _api
+
+    if _api: _api.stop()
+    _api = None
+
+
+def publish(event: dict) -> None:
+    if _api: _api.publish(event)
+
+
+def wants_partial() -> bool:
+    return _api is not None and _api.wants_partial()
@@ -0,0 +1,225 @@
+import asyncio
+import concurrent.futures
+import dataclasses
+import functools
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import dashscope
+
+from ddmajor.logging import logger
+
+
+# every summarize call of every task goes through one queue on a loop thread of its own,
+# so rooms ending at the same time take turns instead of all hitting the provider at once.
+# jobs with a higher priority (the publish time of their replay) run first.
+
+RETRY_STATUS = {429} # and every 5xx
+
+
+class LLMError(RuntimeError):
+
+    def __init__(self, status: int, code: str, message: str) -> None:
+        super().__init__(f"[{status}] {code}: {message}")
+        self.status = status
+        self.code = code
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in RETRY_STATUS or self.status >= 500
+
+
+@dataclasses.dataclass(order=True)
+class Job:
+    sort_key: tuple
+    name: str = dataclasses.field(compare=False)
+    kwargs: dict = dataclasses.field(compare=False)
+    future: concurrent.futures.Future = dataclasses.field(compare=False)
+    enqueued: float = dataclasses.field(compare=False, default_factory=time.monotonic)
+    attempts: int = dataclasses.field(compare=False, default=0)
+    task: asyncio.Task | None = dataclasses.field(compare=False, default=None)
+
+
+class Scheduler:
+
+    def __init__(self, concurrency: int = 2, max_attempts: int = 4, backoff: float = 10) -> None:
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+        self.metrics = {
+            "submitted": 0, "done": 0, "failed": 0, "cancelled": 0, "retries": 0,
+            "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0,
+        }
+
+        self._heap: list[Job] = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._cooldown = 0.0 # monotonic time before which no attempt starts, set by 429
+
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="ddmajor-llm", daemon=True).start()
+
+        return self._loop
+
+
+    def configure(self, concurrency: int | None = None, max_attempts: int | None = None, backoff: float | None = None) -> None:
+        # from any thread, a higher concurrency takes effect right away
+        if concurrency is not None: self.concurrency = max(1, int(concurrency))
+        if max_attempts is not None: self.max_attempts = max(1, int(max_attempts))
+        if backoff is not None: self.backoff = float(backoff)
+
+        if self._loop: self._loop.call_soon_threadsafe(self._dispatch)
+
+
+    async def submit(self, name: str, priority: float = 0, **kwargs) -> tuple[str, dict]:
+        # (text, usage), kwargs go to dashscope.AioGeneration.call
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        job = Job((-priority, next(self._seq)), name, kwargs, future)
+
+        loop = self._ensure_loop()
+        loop.call_soon_threadsafe(self._push, job)
+
+        return await asyncio.wrap_future(future)
+
+
+    def stats(self) -> dict:
+        m = dict(self.metrics)
+        finished = m["done"] + m["failed"] + m["cancelled"]
+
+        m.update(
+            queued=len(self._heap), running=self._running, concurrency=self.concurrency,
+            wait_avg=round(m["wait_total"] / finished, 2) if finished else 0,
+            wait_max=round(m["wait_max"], 2),
+        )
+        return m
+
+
+    def _push(self, job: Job) -> None:
+        self.metrics["submitted"] += 1
+        heapq.heappush(self._heap, job)
+        job.future.add_done_callback(functools.partial(self._on_done, job))
+
+        if self._running >= self.concurrency:
+            logger.info(f"llm job {job.name} queued behind {len(self._heap) - 1} others, {self._running} running")
+
+        self._dispatch()
+
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency and self._heap:
+            job = heapq.heappop(self._heap)
+
+            if job.future.cancelled(): # before _drop got to it
+                self._count_dropped(job)
+                continue
+
+            self._running += 1
+            job.task = self._loop.create_task(self._run(job)) # type: ignore
+
+
+    def _on_done(self, job: Job, future: concurrent.futures.Future) -> None:
+        # from the caller's thread, the caller was cancelled while its job was queued or running
+        if future.cancelled(): self._loop.call_soon_threadsafe(self._drop, job) # type: ignore
+
+
+    def _drop(self, job: Job) -> None:
+        if job.task:
+            job.task.cancel()
+        elif job in self._heap:
+            # out of the queue right away, so queued and wait metrics only count live jobs
+            self._heap.remove(job)
+            heapq.heapify(self._heap)
+            self._count_dropped(job)
+
+
+    def _count_dropped(self, job: Job) -> None:
+        # a job cancelled while queued, its wait still counts towards wait_avg
+        waited = time.monotonic() - job.enqueued
+        self.metrics["cancelled"] += 1
+        self.metrics["wait_total"] += waited
+        self.metrics["wait_max"] = max(self.metrics["wait_max"], waited)
+
+
+    async def _run(self, job: Job) -> None:
+        waited = time.monotonic() - job.enqueued
+        self.metrics["wait_total"] += waited
+        self.metrics["wait_max"] = max(self.metrics["wait_max"], waited)
+
+        begin = time.monotonic()
+
+        try:
+            while True:
+                if (pause := self._cooldown - time.monotonic()) > 0:
+                    await asyncio.sleep(pause)
+
+                job.attempts += 1
+
+                try:
+                    result = await _generate(**job.kwargs)
+                    break
+                except LLMError as e:
+                    if not e.retryable or job.attempts >= self.max_attempts: raise
+
+                    delay = self.backoff * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+                    if e.status == 429:
+                        # rate limited, the other jobs back off as well
+                        self._cooldown = max(self._cooldown, time.monotonic() + delay)
+
+                    self.metrics["retries"] += 1
+                    logger.warning(f"llm job {job.name} attempt {job.attempts} failed ({e}), retry in {delay:.0f}s")
+                    await asyncio.sleep(delay)
+
+            elapsed = time.monotonic() - begin
+            self.metrics["done"] += 1
+            self.metrics["run_total"] += elapsed
+
+            logger.info(f"llm job {job.name}: waited {waited:.1f}s, ran {elapsed:.1f}s in {job.attempts} attempts")
+            if not job.future.cancelled(): job.future.set_result(result)
+
+        except asyncio.CancelledError:
+            self.metrics["cancelled"] += 1
+            job.future.cancel()
+            raise
+
+        except Exception as e:
+            self.metrics["failed"] += 1
+            if not job.future.cancelled(): job.future.set_exception(e)
+
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+
+async def _generate(**kwargs) -> tuple[str, dict]:
+    # one streaming request, any non-200 chunk fails the whole attempt
+    # instead of leaving a summary with a hole in it
+    text = ""
+    response = {}
+
+    responses = await dashscope.AioGeneration.call(
+        stream=True, result_format="message", incremental_output=True, **kwargs,
+    )
+
+    async for response in responses: # type: ignore
+        if (status := response.get("status_code", 200)) != 200:
+            raise LLMError(status, response.get("code", ""), response.get("message", "no message"))
+
+        choices = response.get("output", {}).get("choices", []) # type: ignore
+        if choices:
+            text += choices[0].get("message", {}).get("content", "") or ""
+
+    return text, response.get("usage", {}) # type: ignore
+
+
+scheduler = Scheduler()
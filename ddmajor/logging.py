@@ -1,21 +1,142 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+import threading
+import time
+
+from logging.handlers import QueueHandler, QueueListener
 
 
 choices = ["info", "warning", "debug"]
 logger = logging.getLogger("ddmajor")
 
-handler = logging.StreamHandler()
-handler.setFormatter(
-    logging.Formatter(
-        fmt="[%(levelname)s][%(asctime)s] %(name)s - %(module)s - %(funcName)s L%(lineno)d: %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
+
+# task threads only put records on a queue, one listener thread formats and writes
+# them, so a slow terminal or pipe never stalls transcription
+
+class JsonFormatter(logging.Formatter):
+
+    # one json object per line with the per-room fields added by ContextFilter
+
+    def format(self, record: logging.LogRecord) -> str:
+        item = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "name": record.name,
+            "task": getattr(record, "task", None),
+            "room": getattr(record, "room", None),
+            "component": getattr(record, "component", None),
+            "stream_time": getattr(record, "stream_time", None),
+            "message": record.getMessage(),
+        }
+
+        if record.exc_text or record.exc_info:
+            item["exc"] = record.exc_text or self.formatException(record.exc_info) # type: ignore
+
+        return json.dumps({k: v for k, v in item.items() if v is not None}, ensure_ascii=False)
+
+
+text_formatter = logging.Formatter(
+    fmt="[%(levelname)s][%(asctime)s] %(name)s - %(module)s - %(funcName)s L%(lineno)d: %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
 )
 
-logger.addHandler(handler)
+
+_bound: dict[str, dict] = {} # logger name -> fields
+
+
+def bind(child: logging.Logger, **fields) -> None:
+    # e.g. bind(self.logger, task=name, room=room_id), added to every record of that logger
+    _bound[child.name] = fields
+
+
+class ContextFilter(logging.Filter):
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for k, v in _bound.get(record.name, {}).items():
+            if not hasattr(record, k): setattr(record, k, v)
+
+        if not hasattr(record, "component"):
+            record.component = record.module
+
+        return True
+
+
+class _QueueHandler(QueueHandler):
+
+    # only resolve what cannot be deferred: args may be mutated after the call returns,
+    # and a traceback is gone once the except block is left
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = text_formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+handler = logging.StreamHandler()
+handler.setFormatter(text_formatter)
+
+queue_handler = _QueueHandler(_queue)
+queue_handler.addFilter(ContextFilter())
+
+listener = QueueListener(_queue, handler, respect_handler_level=True)
+listener.start()
+
+logger.addHandler(queue_handler)
+
+
+def stop() -> None:
+    # flush what is queued, safe to call more than once
+    if listener._thread: listener.stop()
+
+atexit.register(stop)
 
 
 def set_level(level: str) -> None:
     logger.setLevel(logging.getLevelNamesMapping()[level.upper()] if isinstance(level, str) else level)
 
 logger.set_level = set_level # type: ignore
+
+
+def set_format(fmt: str) -> None:
+    handler.setFormatter(JsonFormatter() if fmt == "json" else text_formatter)
+
+
+class RateLimit:
+
+    # if limit(): logger.debug(...), at most one message per interval, counting the rest
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.skipped = 0
+
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+
+    def __call__(self) -> bool:
+        now = time.monotonic()
+
+        with self._lock:
+            if now - self._last < self.interval:
+                self.skipped += 1
+                return False
+
+            self._last = now
+            return True
+
+
+    def pop_skipped(self) -> int:
+        with self._lock:
+            skipped, self.skipped = self.skipped, 0
+            return skipped
@@ -0,0 +1,277 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import typing
+
+from pathlib import Path
+
+from ddmajor.cache import atomic_write_json
+from ddmajor.logging import logger
+
+
+# linux only, every reader returns None where /proc is missing or the process is gone
+
+FILENAME = "resources.json"
+PID_FILE = "ddmajor.pid"
+
+_CLK_TCK   = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class ProcSample(typing.NamedTuple):
+    pid: int
+    cpu: float       # user + system seconds
+    rss: int         # bytes
+    read: int        # bytes read by syscalls, sockets and pipes included
+    written: int
+    started: float   # seconds since boot
+    threads: int
+
+
+def read_proc(pid: int) -> ProcSample | None:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # the command name may contain spaces, fields are counted after its closing paren
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm", "r") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    io = {}
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                io[key] = int(value)
+    except (OSError, ValueError):
+        pass # not readable for processes of other users
+
+    return ProcSample(
+        pid=pid,
+        cpu=(int(fields[11]) + int(fields[12])) / _CLK_TCK,
+        rss=rss_pages * _PAGE_SIZE,
+        read=io.get("rchar", 0),
+        written=io.get("wchar", 0),
+        started=int(fields[19]) / _CLK_TCK,
+        threads=int(fields[17]),
+    )
+
+
+def _uptime() -> float:
+    try:
+        with open("/proc/uptime", "r") as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ProcMeter:
+
+    # cpu usage of one process between two samples, the first one averages over its lifetime
+
+    def __init__(self) -> None:
+        self._last: tuple[int, float, float] | None = None # pid, cpu, monotonic
+
+
+    def sample(self, pid: int | None) -> dict | None:
+        if not pid or not (s := read_proc(pid)): return None
+
+        now = time.monotonic()
+        if self._last and self._last[0] == pid and now > self._last[2]:
+            percent = (s.cpu - self._last[1]) / (now - self._last[2]) * 100
+        else:
+            alive = _uptime() - s.started
+            percent = s.cpu / alive * 100 if alive > 0 else 0
+        self._last = (pid, s.cpu, now)
+
+        return {
+            "pid": s.pid, "cpu_seconds": round(s.cpu, 2), "cpu_percent": round(percent, 1),
+            "rss": s.rss, "read": s.read, "written": s.written, "threads": s.threads,
+        }
+
+
+_self_meter = ProcMeter()
+
+
+def collect(tasks: typing.Iterable) -> dict:
+    # tasks are DDMajor instances, each reports its own components
+    rooms = {}
+    for dd in tasks:
+        try:
+            rooms[dd.dd_name] = dd.resources()
+        except Exception as e:
+            rooms[dd.dd_name] = {"error": str(e)}
+
+    report = {
+        "time": int(time.time()),
+        "pid": os.getpid(),
+        "process": _self_meter.sample(os.getpid()),
+        "threads": threading.active_count(),
+        "rooms": rooms,
+    }
+
+    if (llm := sys.modules.get("ddmajor.llm")): # only once a keynote task loaded it
+        report["llm"] = llm.scheduler.stats()
+
+    if (vod := sys.modules.get("ddmajor.vod")):
+        report["vod"] = vod.stats()
+
+    return report
+
+
+def write(data_dir: Path, report: dict) -> Path:
+    path = Path(data_dir).joinpath(FILENAME)
+    atomic_write_json(path, report, indent=2)
+    return path
+
+
+def fmt_bytes(n: int | float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(n) < 1024: return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def format_room(name: str, room: dict) -> str:
+    parts = []
+
+    if (ffmpeg := room.get("ffmpeg")):
+        parts.append(
+            f"ffmpeg[{ffmpeg['pid']}] cpu {ffmpeg['cpu_percent']:.1f}% rss {fmt_bytes(ffmpeg['rss'])} "
+            f"read {fmt_bytes(ffmpeg['read'])}"
+        )
+    if (asr := room.get("asr")):
+        parts.append(f"asr sent {fmt_bytes(asr['bytes_sent'])} in {asr['sessions']} sessions, {asr['sentences']} sentences")
+    if (danmaku := room.get("danmaku")):
+        parts.append(f"danmaku {danmaku['written']} written {danmaku['dropped']} dropped {danmaku['pending']} pending")
+    if "error" in room:
+        parts.append(f"error {room['error']}")
+
+    return f"{name}: " + ("; ".join(parts) if parts else "idle")
+
+
+def format_report(report: dict) -> str:
+    lines = [format_room(name, room) for name, room in report.get("rooms", {}).items()]
+
+    if (llm := report.get("llm")):
+        lines.append(
+            f"llm: {llm['running']}/{llm['concurrency']} running, {llm['queued']} queued, {llm['done']} done, "
+            f"{llm['failed']} failed, {llm['retries']} retries, wait avg {llm['wait_avg']:.1f}s max {llm['wait_max']:.1f}s"
+        )
+
+    if (vod := report.get("vod")):
+        lines.append(
+            f"vod: {vod['running']}/{vod['concurrency']} running, {vod['segments']} segments done, "
+            f"{vod['failed']} failed, {vod['retries']} retries, {vod['audio_seconds'] / 3600:.1f}h of audio"
+        )
+
+    if (proc := report.get("process")):
+        lines.append(
+            f"ddmajor[{proc['pid']}]: cpu {proc['cpu_percent']:.1f}% rss {fmt_bytes(proc['rss'])} "
+            f"threads {report.get('threads', proc['threads'])}"
+        )
+
+    return "\n".join(lines)
+
+
+def _pid_tag(pid: int) -> str:
+    sample = read_proc(pid)
+    return f"{pid} {sample.started if sample else 0}"
+
+
+def _is_ddmajor(tag: str) -> int | None:
+    # the pid of the pid file when it still names the ddmajor process that wrote it
+    try:
+        pid = int(tag.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+    if _pid_tag(pid) != tag.strip(): return None # gone, or the pid belongs to a newer process
+
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read()
+    except OSError:
+        return None
+
+    return pid if b"ddmajor" in cmdline.lower() else None
+
+
+class Monitor:
+
+    # samples every task of the cli, logs and writes data_dir/resources.json, and does
+    # the same on SIGUSR1 so `ddmajor dump` can ask a running process for a fresh report
+
+    def __init__(self, data_dir: Path, get_tasks: typing.Callable[[], typing.Iterable]) -> None:
+        self.data_dir = Path(data_dir)
+        self.get_tasks = get_tasks
+        self.pid_file = self.data_dir.joinpath(PID_FILE)
+
+
+    def start(self) -> None:
+        # "pid start_time", so a pid reused by another process after a crash is never signalled
+        self.pid_file.write_text(_pid_tag(os.getpid()))
+
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: self.dump(log=False))
+
+
+    def close(self) -> None:
+        try:
+            if self.pid_file.read_text().strip() == _pid_tag(os.getpid()):
+                self.pid_file.unlink()
+        except OSError:
+            pass
+
+
+    def dump(self, log: bool = True) -> dict:
+        report = collect(list(self.get_tasks()))
+
+        try:
+            write(self.data_dir, report)
+        except Exception as e:
+            logger.warning(f"failed to write resource report: {e}")
+
+        if log: logger.info("resources:\n" + format_report(report))
+
+        return report
+
+
+def request_dump(data_dir: Path, timeout: float = 5) -> tuple[dict, bool]:
+    # (report, fresh), fresh is False when no running process answered
+    data_dir = Path(data_dir)
+    path = data_dir.joinpath(FILENAME)
+
+    def _mtime() -> float:
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return 0
+
+    before = _mtime()
+    fresh = False
+
+    try:
+        # SIGUSR1 terminates a process without a handler, only the one that wrote the file gets it
+        if (pid := _is_ddmajor(data_dir.joinpath(PID_FILE).read_text())) is None:
+            raise ValueError("stale pid file")
+        os.kill(pid, signal.SIGUSR1)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if _mtime() != before:
+                fresh = True
+                break
+            time.sleep(0.05)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f), fresh
+    except (OSError, ValueError):
+        return {}, False
@@ -0,0 +1,230 @@
+import sqlite3
+import threading
+import time
+import typing
+
+from pathlib import Path
+
+from ddmajor.logging import logger
+from ddmajor.segments import SUFFIX as SEGMENTS_SUFFIX, iter_transcript_file
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    id      INTEGER PRIMARY KEY,
+    room    TEXT NOT NULL,
+    start   INTEGER NOT NULL,
+    path    TEXT NOT NULL UNIQUE,
+    size    INTEGER NOT NULL DEFAULT 0,
+    mtime   REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS streams_room ON streams (room, start);
+CREATE VIRTUAL TABLE IF NOT EXISTS cues USING fts5(
+    text, stream_id UNINDEXED, offset_ms UNINDEXED,
+    tokenize = 'trigram'
+);
+"""
+
+
+class Hit(typing.NamedTuple):
+    room: str
+    start: int      # stream start, unix timestamp
+    offset_ms: int  # from stream start
+    text: str
+    path: str
+
+
+def parse_transcript_name(path: Path) -> tuple[str, int] | None:
+    # {room}_{timestamp}.srt or .segments.jsonl, markers like .finish.srt and partial downloads are skipped
+    if path.name.endswith(SEGMENTS_SUFFIX):
+        stem = path.name.removesuffix(SEGMENTS_SUFFIX)
+    elif path.suffix == ".srt":
+        stem = path.stem
+    else:
+        return None
+
+    if "." in stem: return None
+
+    try:
+        room, ts = stem.split("_")
+        return room, int(ts)
+    except ValueError:
+        return None
+
+
+class TranscriptIndex:
+
+    # one sqlite connection shared by every task thread, writes are batched
+
+    def __init__(self, path: str | Path, batch: int = 64, flush_interval: float = 5) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.batch = batch
+        self.flush_interval = flush_interval
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        self._pending: list[tuple[str, int, int]] = []
+        self._live: dict[int, Path] = {} # stream id -> srt written alongside
+        self._last_flush = time.monotonic()
+
+
+    def stream_id(self, room: str | int, start: int, path: str | Path) -> int:
+        path = str(Path(path).resolve())
+
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM streams WHERE path = ?", (path,)).fetchone()
+            if row: return row[0]
+
+            cur = self._conn.execute("INSERT INTO streams (room, start, path) VALUES (?, ?, ?)", (str(room), int(start), path))
+            self._conn.commit()
+            return cur.lastrowid # type: ignore
+
+
+    def open_stream(self, room: str | int, start: int, path: str | Path) -> int:
+        # for transcripts indexed sentence by sentence while being written
+        stream_id = self.stream_id(room, start, path)
+
+        with self._lock:
+            self._live[stream_id] = Path(path).resolve()
+
+        return stream_id
+
+
+    def close_stream(self, stream_id: int) -> None:
+        with self._lock:
+            self.flush()
+            self._live.pop(stream_id, None)
+
+
+    def add_cue(self, stream_id: int, offset_ms: int, text: str) -> None:
+        with self._lock:
+            self._pending.append((text, stream_id, int(offset_ms)))
+
+            if len(self._pending) >= self.batch or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._pending:
+                self._conn.executemany("INSERT INTO cues (text, stream_id, offset_ms) VALUES (?, ?, ?)", self._pending)
+                self._pending = []
+
+                # cues written live are already indexed, keep the file from being ingested again
+                for stream_id, path in self._live.items():
+                    try:
+                        stat = path.stat()
+                        self._conn.execute("UPDATE streams SET size = ?, mtime = ? WHERE id = ?", (stat.st_size, stat.st_mtime, stream_id))
+                    except FileNotFoundError:
+                        pass
+
+            self._conn.commit()
+            self._last_flush = time.monotonic()
+
+
+    def ingest_file(self, path: str | Path) -> int:
+        path = Path(path).resolve()
+        parsed = parse_transcript_name(path)
+        if not parsed: return 0
+
+        room, start = parsed
+        stat = path.stat()
+
+        with self._lock:
+            row = self._conn.execute("SELECT id, size, mtime FROM streams WHERE path = ?", (str(path),)).fetchone()
+
+            if row and row[1] == stat.st_size and row[2] == stat.st_mtime:
+                return 0
+
+            stream_id = row[0] if row else self.stream_id(room, start, path)
+
+            self._conn.execute("DELETE FROM cues WHERE stream_id = ?", (stream_id,))
+            count = 0
+
+            rows = []
+            for cue in iter_transcript_file(path):
+                rows.append((cue.text, stream_id, cue.start_ms))
+                count += 1
+
+                if len(rows) >= 1024:
+                    self._conn.executemany("INSERT INTO cues (text, stream_id, offset_ms) VALUES (?, ?, ?)", rows)
+                    rows = []
+
+            if rows:
+                self._conn.executemany("INSERT INTO cues (text, stream_id, offset_ms) VALUES (?, ?, ?)", rows)
+
+            self._conn.execute("UPDATE streams SET size = ?, mtime = ? WHERE id = ?", (stat.st_size, stat.st_mtime, stream_id))
+            self._conn.commit()
+
+        return count
+
+
+    def ingest_dir(self, folder: str | Path) -> tuple[int, int]:
+        files = cues = 0
+
+        for path in sorted(Path(folder).glob("*.srt")) + sorted(Path(folder).glob("*" + SEGMENTS_SUFFIX)):
+            # the same stream written in both formats is indexed once, through its srt
+            if path.name.endswith(SEGMENTS_SUFFIX) and path.with_name(path.name.removesuffix(SEGMENTS_SUFFIX) + ".srt").exists():
+                continue
+
+            try:
+                if (count := self.ingest_file(path)):
+                    files += 1
+                    cues += count
+            except Exception as e:
+                logger.warning(f"failed to index {path}: {e}")
+
+        return files, cues
+
+
+    def search(self, query: str, room: str | int | None = None, limit: int = 50) -> list[Hit]:
+        query = query.strip()
+        if not query: return []
+
+        if len(query) >= 3: # trigram tokenizer needs at least 3 characters
+            where, arg = "cues MATCH ?", '"' + query.replace('"', '""') + '"'
+        else: # shorter patterns do not go through the index, LIKE misses them on older sqlite
+            where, arg = "instr(cues.text, ?) > 0", query
+
+        sql = (
+            "SELECT streams.room, streams.start, cues.offset_ms, cues.text, streams.path "
+            "FROM cues JOIN streams ON streams.id = cues.stream_id "
+            f"WHERE {where}"
+        )
+        args: list = [arg]
+
+        if room is not None:
+            sql += " AND streams.room = ?"
+            args.append(str(room))
+
+        sql += " ORDER BY streams.start DESC, cues.offset_ms LIMIT ?"
+        args.append(limit)
+
+        with self._lock:
+            self.flush()
+            return [Hit(*row) for row in self._conn.execute(sql, args)]
+
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+_indexes: dict[Path, TranscriptIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def transcript_index(path: str | Path) -> TranscriptIndex:
+    path = Path(path).resolve()
+
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = TranscriptIndex(path)
+        return _indexes[path]
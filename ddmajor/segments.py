@@ -0,0 +1,160 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+
+from pathlib import Path
+from typing import Iterator
+
+from ddmajor.srt import Cue, iter_srt_file
+
+
+# {room}_{ts}.segments.jsonl  one {"b": begin_ms, "e": end_ms, "t": text} per line, append-only
+# {room}_{ts}.segments.idx    (begin_ms, byte offset) pairs as little-endian uint64, one per STRIDE lines
+
+SUFFIX = ".segments.jsonl"
+INDEX_SUFFIX = ".segments.idx"
+STRIDE = 32
+
+_ENTRY = struct.Struct("<QQ")
+
+
+def index_path(path: str | Path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name.removesuffix(SUFFIX) + INDEX_SUFFIX)
+
+
+def encode_segment(begin_ms: int, end_ms: int, text: str) -> bytes:
+    return json.dumps({"b": int(begin_ms), "e": int(end_ms), "t": text}, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+class SegmentWriter:
+
+    def __init__(self, path: str | Path, stride: int = STRIDE) -> None:
+        self.path = Path(path)
+        self.stride = stride
+
+        self._fp = open(self.path, "ab")
+        self._offset = self._fp.tell()
+
+        if self._offset and not index_path(self.path).exists():
+            build_index(self.path, stride) # appended to a file without a usable index
+
+        self._idx = open(index_path(self.path), "ab")
+        self._count = self._count_lines() if self._offset else 0
+
+
+    def _count_lines(self) -> int:
+        with open(self.path, "rb") as f:
+            return sum(1 for _ in f)
+
+
+    def write(self, begin_ms: int, end_ms: int, text: str) -> None:
+        if self._count % self.stride == 0:
+            self._idx.write(_ENTRY.pack(max(int(begin_ms), 0), self._offset))
+            self._idx.flush()
+
+        line = encode_segment(begin_ms, end_ms, text)
+        self._fp.write(line)
+        self._fp.flush()
+
+        self._offset += len(line)
+        self._count += 1
+
+
+    def close(self) -> None:
+        self._fp.close()
+        self._idx.close()
+
+
+def build_index(path: str | Path, stride: int = STRIDE) -> int:
+    count = offset = 0
+
+    with open(path, "rb") as f, open(index_path(path), "wb") as idx:
+        for line in f:
+            if count % stride == 0:
+                try:
+                    begin = int(json.loads(line)["b"])
+                except Exception:
+                    begin = 0
+                idx.write(_ENTRY.pack(max(begin, 0), offset))
+
+            offset += len(line)
+            count += 1
+
+    return count
+
+
+class SegmentReader:
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+
+
+    def _index(self) -> tuple[list[int], list[int]]:
+        try:
+            raw = index_path(self.path).read_bytes()
+        except FileNotFoundError:
+            return [], []
+
+        raw = raw[:len(raw) - len(raw) % _ENTRY.size]
+        entries = list(_ENTRY.iter_unpack(raw))
+
+        return [e[0] for e in entries], [e[1] for e in entries]
+
+
+    def _iter_from(self, offset: int) -> Iterator[Cue]:
+        if os.path.getsize(self.path) == 0: return
+
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            mm.seek(offset)
+            index = 0
+
+            while (line := mm.readline()):
+                index += 1
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue # torn last line of an interrupted write
+
+                yield Cue(
+                    index=index,
+                    start_ms=item["b"],
+                    end_ms=item["e"],
+                    text=item["t"],
+                )
+
+
+    def __iter__(self) -> Iterator[Cue]:
+        return self._iter_from(0)
+
+
+    def slice(self, start_ms: int = 0, end_ms: int | None = None) -> Iterator[Cue]:
+        # cues beginning in [start_ms, end_ms), seeking through the sidecar index
+        begins, offsets = self._index()
+
+        offset = 0
+        if begins:
+            k = bisect.bisect_right(begins, start_ms) - 1
+            # begin times are not strictly ordered around reconnects, step back one block
+            offset = offsets[max(k - 1, 0)]
+
+        index = 0
+
+        for cue in self._iter_from(offset):
+            ms = cue.start_ms
+
+            if end_ms is not None and ms >= end_ms and ms - end_ms > 60_000:
+                break
+            if ms < start_ms or (end_ms is not None and ms >= end_ms):
+                continue
+
+            index += 1
+            yield cue._replace(index=index)
+
+
+def iter_transcript_file(path: str | Path) -> Iterator[Cue]:
+    if str(path).endswith(SUFFIX):
+        return iter(SegmentReader(path))
+    return iter_srt_file(path)
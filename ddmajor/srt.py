@@ -0,0 +1,198 @@
+import bisect
+import itertools
+import typing
+
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO
+
+
+class Cue(typing.NamedTuple):
+    index: int
+    start_ms: int # from the stream or video start
+    end_ms: int
+    text: str
+
+
+def iter_srt(lines: Iterable[str]) -> Iterator[Cue]:
+    # same tolerance as the former compress_srt: index line, time line, content until a blank line
+    index = None
+    start = end = None
+    content: list[str] = []
+
+    for line in lines:
+        line = line.strip()
+
+        if start is None:
+            if index is None:
+                if line.isdigit(): index = int(line)
+            elif "-->" in line:
+                tfrom, tto = line.split("-->", maxsplit=1)
+                start, end = srt_to_ms(tfrom.strip()), srt_to_ms(tto.strip())
+            else:
+                index = int(line) if line.isdigit() else None
+            continue
+
+        if line:
+            content.append(line)
+            continue
+
+        if content: yield Cue(index, start, end, " ".join(content)) # type: ignore
+
+        index = None
+        start = end = None
+        content = []
+
+    if start is not None and content:
+        yield Cue(index, start, end, " ".join(content)) # type: ignore
+
+
+def iter_srt_file(path: str | Path) -> Iterator[Cue]:
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_srt(f)
+
+
+def bili_subtitle_cue(item: dict, offset_ms: int = 0, base_index: int = 0) -> Cue:
+    # bilibili subtitle json: {"body": [{"sid": 1, "from": 0.1, "to": 1.2, "content": "..."}]}
+    return Cue(
+        index=base_index + int(item["sid"]),
+        start_ms=offset_ms + round(float(item["from"]) * 1000),
+        end_ms=offset_ms + round(float(item["to"]) * 1000),
+        text=item["content"],
+    )
+
+
+def iter_bili_subtitle(body: Iterable[dict], offset_ms: int = 0, base_index: int = 0) -> Iterator[Cue]:
+    for item in body:
+        yield bili_subtitle_cue(item, offset_ms, base_index)
+
+
+class PageOffsets:
+
+    # cumulative start of each part of a multi-part video, timestamps of the
+    # concatenated transcript are mapped back to (part, offset in part) by bisect
+
+    def __init__(self, durations: Iterable[float | None], default: float = 7200) -> None:
+        self.durations = [float(d) if d else float(default) for d in durations] or [float(default)]
+        self.starts = [0.0] + list(itertools.accumulate(self.durations))[:-1]
+
+
+    @classmethod
+    def from_pages(cls, pages: list[dict], default: float = 7200) -> "PageOffsets":
+        return cls([page.get("duration") for page in pages], default)
+
+
+    def __len__(self) -> int:
+        return len(self.durations)
+
+
+    def start(self, page: int) -> float:
+        return self.starts[page]
+
+
+    def locate(self, seconds: float) -> tuple[int, float]:
+        # before the first part counts as the first part, past the end as the last part
+        page = max(bisect.bisect_right(self.starts, seconds) - 1, 0)
+        return page, seconds - self.starts[page]
+
+
+def format_cue(cue: Cue) -> str:
+    return (
+        f"{cue.index}\n"
+        f"{ms_to_srt(cue.start_ms)} --> {ms_to_srt(cue.end_ms)}\n"
+        f"{cue.text}\n"
+    )
+
+
+def format_srt(cues: Iterable[Cue]) -> str:
+    # a whole transcript at once, cues of the same minute share their "HH:MM:" prefix
+    prefixes: dict[int, str] = {}
+    parts: list[str] = []
+
+    def _ts(ms: int) -> str:
+        minute, rest = divmod(max(ms, 0), 60_000)
+        if (prefix := prefixes.get(minute)) is None:
+            prefix = prefixes[minute] = f"{minute // 60:02d}:{minute % 60:02d}:"
+        return f"{prefix}{rest // 1000:02d},{rest % 1000:03d}"
+
+    for cue in cues:
+        parts.append(f"{cue.index}\n{_ts(cue.start_ms)} --> {_ts(cue.end_ms)}\n{cue.text}\n\n")
+
+    return "".join(parts)
+
+
+def parse_srt(text: str) -> list[Cue]:
+    return list(iter_srt(text.splitlines()))
+
+
+def write_srt(cues: Iterable[Cue], fp: TextIO) -> int:
+    count = 0
+
+    for cue in cues:
+        fp.write(format_cue(cue) + "\n")
+        count += 1
+
+    return count
+
+
+def compress_cues(cues: Iterable[Cue]) -> Iterator[str]:
+    for cue in cues:
+        if cue.text:
+            minutes, seconds = divmod(cue.start_ms // 1000, 60)
+            yield f"{minutes:02d}:{seconds:02d} {cue.text}"
+
+
+def ms_to_srt(ms: int) -> str:
+    # "HH:MM:SS,mmm", negative offsets are clamped to zero
+    seconds, ms = divmod(max(int(ms), 0), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+def srt_to_ms(tstr: str) -> int:
+    # "HH:MM:SS,mmm" exactly as ms_to_srt writes it, anything else takes the tolerant path
+    if len(tstr) == 12 and tstr[2] == ":" and tstr[5] == ":" and tstr[8] == ",":
+        try:
+            return ((int(tstr[0:2]) * 60 + int(tstr[3:5])) * 60 + int(tstr[6:8])) * 1000 + int(tstr[9:12])
+        except ValueError:
+            pass
+
+    return _srt_like_to_ms(tstr)
+
+
+def _srt_like_to_ms(tstr: str) -> int:
+    # "[[H:]M:]S[,ms]", full-width colons and broken fields of llm output count as 0
+    clock, _, frac = tstr.partition(",")
+
+    ms = 0
+    if frac:
+        try:
+            ms = round(float(frac))
+        except ValueError:
+            pass
+
+    count = 0
+    for t in clock.replace("：", ":").split(":"):
+        try:
+            it = int(t)
+        except ValueError:
+            it = 0
+
+        count = count * 60 + it
+
+    return count * 1000 + ms
+
+
+def delta_to_ms(td: timedelta) -> int:
+    # rounded half up on the exact microsecond count, no float involved
+    return (td // timedelta(microseconds=1) + 500) // 1000
+
+
+def timedelta_to_srt(td: timedelta) -> str:
+    return ms_to_srt(delta_to_ms(td))
+
+
+def srt_like_str_to_delta(tstr: str) -> timedelta:
+    return timedelta(milliseconds=srt_to_ms(tstr))
@@ -0,0 +1,154 @@
+import copy
+import json
+import os
+import threading
+import time
+
+from ddmajor.credential import update_credential
+from ddmajor.DDMajor import DDMajor
+from ddmajor.logging import logger
+
+
+IGNORED_KEYS = {"bili_credential"} # applied in place to the shared credential
+RESTART_KEYS = {"data_dir"}         # global keys a running task cannot pick up
+
+
+def task_key(task: dict) -> str:
+    return str(task.get("name") or task.get("room_id"))
+
+
+def task_config(config: dict, task: dict) -> dict:
+    # every task gets its own copy, components keep references into it
+    single_config = {k: copy.deepcopy(v) for k, v in config.items() if k != "tasks"}
+    single_config["task"] = copy.deepcopy(task)
+    return single_config
+
+
+def needs_restart(old: dict, new: dict) -> bool:
+    # a different room, account or set of components means a different DDMajor subclass
+    old_task, new_task = old["task"], new["task"]
+
+    if any(old_task.get(k) != new_task.get(k) for k in ["room_id", "user_id"]):
+        return True
+    if {c.get("type") for c in old_task.get("components", [])} != {c.get("type") for c in new_task.get("components", [])}:
+        return True
+
+    return any(old.get(k) != new.get(k) for k in RESTART_KEYS)
+
+
+def plan_reload(old: dict, new: dict) -> dict[str, list[str]]:
+    old_tasks = {task_key(t): task_config(old, t) for t in old.get("tasks", [])}
+    new_tasks = {task_key(t): task_config(new, t) for t in new.get("tasks", [])}
+
+    def _cmp(config: dict) -> dict:
+        return {k: v for k, v in config.items() if k not in IGNORED_KEYS}
+
+    plan: dict[str, list[str]] = {"start": [], "stop": [], "restart": [], "reconfigure": []}
+
+    for key in old_tasks.keys() - new_tasks.keys():
+        plan["stop"].append(key)
+
+    for key in new_tasks.keys() - old_tasks.keys():
+        plan["start"].append(key)
+
+    for key in old_tasks.keys() & new_tasks.keys():
+        if _cmp(old_tasks[key]) == _cmp(new_tasks[key]): continue
+        plan["restart" if needs_restart(old_tasks[key], new_tasks[key]) else "reconfigure"].append(key)
+
+    return {k: sorted(v) for k, v in plan.items()}
+
+
+class Supervisor:
+
+    # owns the running tasks of the cli and applies config file changes to them
+
+    def __init__(self, fn: str, config: dict, get_credential) -> None:
+        self.fn = fn
+        self.config = copy.deepcopy(config)
+        self.get_credential = get_credential
+
+        self.tasks: dict[str, DDMajor] = {}
+        self._mtime = self._stat()
+
+
+    def _stat(self) -> float:
+        try:
+            return os.stat(self.fn).st_mtime
+        except OSError:
+            return 0
+
+
+    def _start(self, config: dict, task: dict) -> DDMajor:
+        dd = DDMajor(task_config(config, task), self.get_credential())
+        dd.run(block=False)
+        self.tasks[task_key(task)] = dd
+        return dd
+
+
+    def start_all(self) -> list[DDMajor]:
+        return [self._start(self.config, task) for task in self.config.get("tasks", [])]
+
+
+    def stop_many(self, dd_list: list[DDMajor], timeout: float = 10) -> None:
+        # in parallel, so the deadline holds for any number of tasks
+        threads = [threading.Thread(target=dd.stop, args=(timeout,), daemon=True) for dd in dd_list]
+
+        for t in threads: t.start()
+        for t in threads: t.join(timeout + 1)
+
+
+    def stop_all(self, timeout: float = 10) -> None:
+        dd_list, self.tasks = list(self.tasks.values()), {}
+
+        begin = time.monotonic()
+        self.stop_many(dd_list, timeout)
+
+        logger.info(f"stopped {len(dd_list)} tasks in {time.monotonic() - begin:.2f}s")
+
+
+    def check(self) -> bool:
+        # reload when the file changed, True if anything was applied
+        mtime = self._stat()
+        if mtime == self._mtime: return False
+        self._mtime = mtime
+
+        try:
+            with open(self.fn, "r", encoding="utf-8") as f:
+                new_config = json.load(f)
+        except Exception as e:
+            logger.error(f"❌ 配置文件重新加载失败，继续使用当前配置：{e}")
+            return False
+
+        return self.apply(new_config)
+
+
+    def apply(self, new_config: dict) -> bool:
+        if new_config.get("bili_credential") != self.config.get("bili_credential"):
+            update_credential(new_config.get("bili_credential") or {})
+            self.config["bili_credential"] = copy.deepcopy(new_config.get("bili_credential"))
+
+        plan = plan_reload(self.config, new_config)
+        if not any(plan.values()): return False
+
+        logger.info("配置已更新：" + "，".join(f"{k} {', '.join(v)}" for k, v in plan.items() if v))
+
+        begin = time.perf_counter()
+        tasks = {task_key(t): t for t in new_config.get("tasks", [])}
+
+        self.stop_many([self.tasks.pop(key) for key in plan["stop"] + plan["restart"] if key in self.tasks])
+
+        for key in plan["start"] + plan["restart"]:
+            self._start(new_config, tasks[key])
+
+        for key in plan["reconfigure"]:
+            try:
+                self.tasks[key].reconfigure(task_config(new_config, tasks[key]))
+            except Exception:
+                logger.exception(f"failed to reconfigure {key}, restart it")
+                self.tasks.pop(key).stop()
+                self._start(new_config, tasks[key])
+
+        self.config = copy.deepcopy(new_config)
+        logger.info(f"配置重新加载完成，用时{time.perf_counter() - begin:.2f}s")
+
+        return True
@@ -0,0 +1,117 @@
+import re
+
+from typing import Iterable, Iterator
+
+
+DEFAULT_DENOISE = {
+    "max_repeat": 2,       # "哈哈哈哈哈" -> "哈哈"
+    "min_chars": 2,        # drop lines with fewer meaningful chars
+    "dedupe_window": 30,   # seconds, drop repeated cues (e.g. reconnect overlap)
+    "merge_seconds": 60,   # merge adjacent cues into one line per bucket, 0 to disable
+    "max_line_chars": 120, # do not merge beyond this length
+    "fillers": "嗯啊哦呃额诶欸哎唉噢喔哈呀吧呢嘛啦哇嘿哼呵",
+}
+
+_LINE_RE   = re.compile(r"^(\d+):(\d{1,2}) (.*)$")
+_PUNCT_RE  = re.compile(r"[\s\W_]+", flags=re.UNICODE)
+_CJK_RE    = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+_LATIN_RE  = re.compile(r"[A-Za-z0-9]+")
+
+
+def parse_compressed(lines: Iterable[str]) -> Iterator[tuple[int, str]]:
+    # "MM:SS content" -> (seconds, content), minutes may exceed 59
+    for line in lines:
+        match = _LINE_RE.match(line.strip())
+        if match:
+            minutes, seconds, content = match.groups()
+            yield int(minutes) * 60 + int(seconds), content.strip()
+
+
+def format_compressed(seconds: int, content: str) -> str:
+    return f"{seconds // 60:02d}:{seconds % 60:02d} {content}"
+
+
+def collapse_repeats(text: str, max_repeat: int = 2) -> str:
+    if max_repeat < 1: return text
+
+    # a unit of 1-6 chars (optionally followed by a separator) repeated more than max_repeat times,
+    # digits and latin letters never form a unit so "10000" or "123123123" stay as they are
+    pattern = re.compile(r"(([^\dA-Za-z]{1,6}?)([，,、\s]?))(?:\2[，,、\s]?){%d,}" % max_repeat)
+
+    def _collapse(m: re.Match) -> str:
+        unit, sep, whole = m.group(2), m.group(3), m.group(0)
+        tail = whole[-1] if whole[-1] in "，,、 \t" else ""
+        return sep.join([unit] * max_repeat) + tail
+
+    text = pattern.sub(_collapse, text)
+
+    return text.strip(" ，,、")
+
+
+def is_low_information(text: str, fillers: str, min_chars: int) -> bool:
+    meaningful = _PUNCT_RE.sub("", text)
+    meaningful = meaningful.translate({ord(c): None for c in fillers})
+    return len(meaningful) < min_chars
+
+
+def denoise_lines(records: Iterable[tuple[int, str]], conf: dict | None = None) -> Iterator[tuple[int, str]]:
+    conf = {**DEFAULT_DENOISE, **(conf or {})}
+
+    max_repeat     = int(conf["max_repeat"])
+    min_chars      = int(conf["min_chars"])
+    dedupe_window  = int(conf["dedupe_window"])
+    merge_seconds  = int(conf["merge_seconds"])
+    max_line_chars = int(conf["max_line_chars"])
+    fillers        = str(conf["fillers"])
+
+    recent: dict[str, int] = {} # normalized content -> last seen second
+
+    bucket_start = -1
+    bucket_texts: list[str] = []
+    bucket_len = 0
+
+    for seconds, content in records:
+        content = collapse_repeats(content, max_repeat)
+
+        if is_low_information(content, fillers, min_chars):
+            continue
+
+        key = _PUNCT_RE.sub("", content)
+        last_seen = recent.get(key)
+        recent[key] = seconds
+
+        if last_seen is not None and abs(seconds - last_seen) <= dedupe_window:
+            continue
+
+        if len(recent) > 1024: # keep the window small
+            recent = {k: v for k, v in recent.items() if seconds - v <= dedupe_window}
+
+        if merge_seconds > 0 and bucket_texts and \
+                seconds // merge_seconds == bucket_start // merge_seconds and \
+                bucket_len + len(content) <= max_line_chars:
+            bucket_texts.append(content)
+            bucket_len += len(content) + 1
+            continue
+
+        if bucket_texts:
+            yield bucket_start, " ".join(bucket_texts)
+
+        bucket_start = seconds
+        bucket_texts = [content]
+        bucket_len   = len(content)
+
+    if bucket_texts:
+        yield bucket_start, " ".join(bucket_texts)
+
+
+def denoise_transcript(transcript: str, conf: dict | None = None) -> str:
+    records = denoise_lines(parse_compressed(transcript.splitlines()), conf)
+    return "\n".join(format_compressed(s, c) for s, c in records)
+
+
+def estimate_tokens(text: str) -> int:
+    # rough estimate for qwen-like tokenizers: ~1 token per CJK char, ~1 token per 4 latin chars
+    cjk   = len(_CJK_RE.findall(text))
+    latin = sum((len(w) + 3) // 4 for w in _LATIN_RE.findall(text))
+    other = len(_PUNCT_RE.sub("", _LATIN_RE.sub("", _CJK_RE.sub("", text))))
+    return cjk + latin + other + text.count("\n")
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+import time
+
+from pathlib import Path
+
+from dashscope.audio import asr
+
+from ddmajor.cache import atomic_write_json
+from ddmajor.logging import logger
+
+
+def vocabulary_hash(vocabulary: list[dict], model: str) -> str:
+    # order and formatting in the config do not matter, the words and weights do
+    items = sorted((str(v.get("text", "")), int(v.get("weight", 4)), str(v.get("lang", ""))) for v in vocabulary)
+    return hashlib.sha1(json.dumps([model, items], ensure_ascii=False).encode()).hexdigest()
+
+
+class VocabularyCache:
+
+    # data_dir/vocabulary.json
+    #   by_hash:  content hash -> vocabulary_id
+    #   by_owner: task -> {"id", "hash", "prefix"}, the vocabulary the task uses. a task may
+    #             update its vocabulary in place when its list changes, but only while no
+    #             other task uses the same id, otherwise it gets a new one
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()     # file and dict
+        self._provision = threading.Lock() # at most one VocabularyService call at a time per file
+
+        self.data: dict = {"by_hash": {}, "by_owner": {}}
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data.update(json.load(f))
+            except Exception as e:
+                logger.warning(f"ignore broken vocabulary cache {self.path}: {e}")
+
+        self.data.pop("by_prefix", None) # written before vocabularies had owners, nothing to update in place
+        self.data.setdefault("by_owner", {})
+
+
+    def lookup(self, digest: str) -> str | None:
+        with self._lock:
+            return self.data["by_hash"].get(digest)
+
+
+    def owned(self, owner: str) -> str | None:
+        # the id of owner when no other task uses it
+        with self._lock:
+            vocabulary_id = self.data["by_owner"].get(owner, {}).get("id")
+            shared = any(o != owner and v.get("id") == vocabulary_id for o, v in self.data["by_owner"].items())
+            return None if shared else vocabulary_id
+
+
+    def store(self, digest: str, prefix: str, vocabulary_id: str, owner: str) -> None:
+        with self._lock:
+            entry = {"id": vocabulary_id, "hash": digest, "prefix": prefix}
+            if self.data["by_hash"].get(digest) == vocabulary_id and \
+                    {k: v for k, v in self.data["by_owner"].get(owner, {}).items() if k != "time"} == entry:
+                return
+
+            # an id updated in place no longer holds its previous content
+            self.data["by_hash"] = {k: v for k, v in self.data["by_hash"].items() if v != vocabulary_id}
+            self.data["by_hash"][digest] = vocabulary_id
+            self.data["by_owner"][owner] = {**entry, "time": int(time.time())}
+            atomic_write_json(self.path, self.data)
+
+
+    def provision(self, api_key: str, vocabulary: list[dict], model: str, owner: str, prefix: str = "ddmajor", **kwargs) -> str:
+        # blocking, run it in an executor. owner is the task name
+        digest = vocabulary_hash(vocabulary, model)
+
+        with self._provision:
+            if (vocabulary_id := self.lookup(digest)): # also when another task created it
+                self.store(digest, prefix, vocabulary_id, owner)
+                return vocabulary_id
+
+            service = asr.VocabularyService(api_key=api_key, **kwargs)
+
+            if (previous := self.owned(owner)):
+                try:
+                    service.update_vocabulary(vocabulary_id=previous, vocabulary=vocabulary)
+                    logger.info(f"updated vocabulary {previous} ({len(vocabulary)} words)")
+                    self.store(digest, prefix, previous, owner)
+                    return previous
+                except Exception as e:
+                    logger.warning(f"failed to update vocabulary {previous}, create a new one: {e}")
+
+            vocabulary_id = service.create_vocabulary(target_model=model, prefix=prefix, vocabulary=vocabulary)
+            logger.info(f"created vocabulary {vocabulary_id} ({len(vocabulary)} words)")
+
+            self.store(digest, prefix, vocabulary_id, owner)
+            return vocabulary_id
+
+
+_caches: dict[Path, VocabularyCache] = {}
+_caches_lock = threading.Lock()
+
+
+def vocabulary_cache(path: str | Path) -> VocabularyCache:
+    path = Path(path).resolve()
+
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = VocabularyCache(path)
+        return _caches[path]
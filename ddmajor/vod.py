@@ -0,0 +1,327 @@
+import asyncio
+import concurrent.futures
+import random
+import subprocess
+import threading
+import time
+import typing
+
+from pathlib import Path
+
+from dashscope.audio import asr
+
+from ddmajor.logging import logger
+from ddmajor.srt import Cue
+
+
+# transcription of a replay that live_asr missed: the audio track is downloaded once, cut
+# into overlapping wav segments and every segment goes through Recognition.call on a thread
+# pool shared by all tasks, so the number of asr connections stays bounded however many
+# rooms fall back at the same time. the cues are stitched back in order, a sentence cut in
+# two at a boundary is kept from the segment that heard it whole.
+#
+#   segment k   [k * length, (k + 1) * length + overlap)
+#   owns        sentences starting before (k + 1) * length
+
+ASR_MODEL = "fun-asr-realtime"
+SAMPLE_RATE = 16000
+
+SEGMENT = 300 # seconds
+OVERLAP = 15  # longer than most sentences
+
+HEADERS = "Referer: https://www.bilibili.com/\r\nUser-Agent: Mozilla/5.0\r\n" # the cdn rejects requests without them
+
+
+class Segment(typing.NamedTuple):
+    index: int
+    start_ms: int
+    own_end_ms: int # sentences starting from here belong to the next segment
+    end_ms: int
+
+
+def plan_segments(duration_ms: int, length_ms: int, overlap_ms: int) -> list[Segment]:
+    length_ms = max(int(length_ms), 1000)
+    overlap_ms = max(int(overlap_ms), 0)
+
+    segments = []
+    start = 0
+
+    while start < duration_ms or not segments:
+        own_end = min(start + length_ms, duration_ms)
+        segments.append(Segment(len(segments), start, own_end, min(own_end + overlap_ms, duration_ms)))
+        start = own_end
+
+    return segments
+
+
+def stitch(parts: typing.Iterable[tuple[Segment, list[Cue]]]) -> list[Cue]:
+    # parts in segment order, cue times already shifted to the start of the audio
+    out: list[Cue] = []
+
+    for segment, cues in parts:
+        last = segment.own_end_ms == segment.end_ms # nothing comes after it
+
+        for cue in cues:
+            if not last and cue.start_ms >= segment.own_end_ms: break
+
+            if out and cue.start_ms < out[-1].end_ms:
+                # the head of this segment repeating the tail of the previous one
+                overlap = out[-1].end_ms - cue.start_ms
+                if overlap * 2 >= cue.end_ms - cue.start_ms or cue.text in out[-1].text: continue
+
+            out.append(cue._replace(index=len(out) + 1))
+
+    return out
+
+
+def audio_url(download: dict) -> str | None:
+    # Video.get_download_url result, the best dash audio track or the first flv/mp4 part
+    if (tracks := (download.get("dash") or {}).get("audio")):
+        best = max(tracks, key=lambda t: t.get("bandwidth", 0))
+        return best.get("baseUrl") or best.get("base_url")
+
+    if (durl := download.get("durl")):
+        return durl[0].get("url")
+
+    return None
+
+
+async def download_audio(url: str, path: Path) -> None:
+    # audio stream copied as is, matroska takes whatever codec it is
+    command = [
+        "ffmpeg",
+        "-loglevel", "error", "-hide_banner",
+        "-headers", HEADERS,
+        "-i", url,
+        "-vn", "-acodec", "copy",
+        "-f", "matroska", "-y", str(path),
+    ]
+
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+
+    try:
+        _, stderr = await process.communicate()
+    finally:
+        if process.returncode is None: process.kill()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg download exited with {process.returncode}: {stderr.decode(errors='replace').strip()}")
+
+
+async def probe_duration(path: Path) -> float:
+    command = [
+        "ffprobe",
+        "-v", "quiet",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(path),
+    ]
+
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    stdout, _ = await process.communicate()
+
+    try:
+        return float(stdout.decode().strip())
+    except ValueError:
+        raise RuntimeError(f"failed to probe the duration of {path}")
+
+
+def cut_segment(src: Path, segment: Segment, dst: Path) -> None:
+    command = [
+        "ffmpeg",
+        "-loglevel", "error", "-hide_banner",
+        "-ss", f"{segment.start_ms / 1000:.3f}",
+        "-t", f"{(segment.end_ms - segment.start_ms) / 1000:.3f}",
+        "-i", str(src),
+        "-vn",
+        "-ac", "1",
+        "-ar", f"{SAMPLE_RATE}",
+        "-acodec", "pcm_s16le",
+        "-f", "wav", "-y", str(dst),
+    ]
+
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg cut exited with {result.returncode}: {result.stderr.decode(errors='replace').strip()}")
+
+
+def recognize(path: Path, api_key: str, base_url: str, params: dict) -> list[dict]:
+    # blocking, sentences of the whole file with begin_time/end_time in ms
+    recognition = asr.Recognition(
+        api_key=api_key,
+        model=ASR_MODEL,
+        format="wav",
+        sample_rate=SAMPLE_RATE,
+        callback=None, # type: ignore
+        base_websocket_api_url=base_url,
+        **params,
+    )
+
+    result = recognition.call(str(path))
+    if result.status_code != 200:
+        raise RuntimeError(f"[{result.status_code}] {result.code}: {result.message}")
+
+    return result.get_sentence() or [] # type: ignore
+
+
+MAX_WORKERS = 32 # threads of the one executor, concurrency is capped at it
+
+
+class Pool:
+
+    # one per process. segments queue up on a single long-lived executor and a gate lets
+    # at most `concurrency` of them cut and recognize at a time, for all tasks together.
+    # a new concurrency only changes the gate, so a reload never runs old + new at once.
+
+    def __init__(self, concurrency: int = 4) -> None:
+        self.concurrency = concurrency
+        self.metrics = {"segments": 0, "failed": 0, "retries": 0, "running": 0, "audio_seconds": 0.0, "run_total": 0.0}
+
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._gate = threading.Condition()
+        self._active = 0
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+
+
+    def configure(self, concurrency: int | None = None) -> None:
+        if concurrency is None: return
+
+        with self._gate:
+            # a lower limit lets running segments finish and admits no new one until below it
+            self.concurrency = min(max(1, int(concurrency)), MAX_WORKERS)
+            self._gate.notify_all()
+
+
+    def submit(self, fn: typing.Callable, *args) -> concurrent.futures.Future:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix="ddmajor-vod")
+            return self._executor.submit(fn, *args)
+
+
+    def _enter(self, cancelled: threading.Event) -> bool:
+        with self._gate:
+            while self._active >= self.concurrency:
+                if cancelled.is_set(): return False
+                self._gate.wait(1)
+
+            self._active += 1
+            return True
+
+
+    def _leave(self) -> None:
+        with self._gate:
+            self._active -= 1
+            self._gate.notify()
+
+
+    def _count(self, key: str, value: float = 1) -> None:
+        with self._metrics_lock:
+            self.metrics[key] += value
+
+
+    def stats(self) -> dict:
+        return {**self.metrics, "concurrency": self.concurrency, "audio_seconds": round(self.metrics["audio_seconds"], 1)}
+
+
+    def run_segment(
+        self, src: Path, segment: Segment, api_key: str, base_url: str,
+        params: dict, max_attempts: int, cancelled: threading.Event,
+    ) -> list[Cue]:
+        # in a pool thread: cut, recognize, shift to the start of the audio
+        if cancelled.is_set() or not self._enter(cancelled): return []
+
+        dst = src.with_name(f"{src.stem}.{segment.index:04d}.wav")
+        self._count("running")
+        begin = time.monotonic()
+
+        try:
+            if cancelled.is_set(): return []
+
+            cut_segment(src, segment, dst)
+
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    sentences = recognize(dst, api_key, base_url, params)
+                    break
+                except Exception as e:
+                    if attempt >= max_attempts or cancelled.is_set(): raise
+
+                    delay = 5 * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+                    self._count("retries")
+                    logger.warning(f"vod segment {segment.index} attempt {attempt} failed ({e}), retry in {delay:.0f}s")
+                    time.sleep(delay)
+
+            self._count("segments")
+            self._count("audio_seconds", (segment.end_ms - segment.start_ms) / 1000)
+
+            return [
+                Cue(0, segment.start_ms + int(s["begin_time"]), segment.start_ms + int(s["end_time"]), s["text"])
+                for s in sentences if s.get("text")
+            ]
+
+        except Exception:
+            self._count("failed")
+            raise
+
+        finally:
+            self._count("running", -1)
+            self._leave()
+            self._count("run_total", time.monotonic() - begin)
+            dst.unlink(missing_ok=True)
+
+
+pool = Pool()
+
+
+async def transcribe(
+    url: str, duration: float | None, workdir: Path, api_key: str,
+    base_url: str = "wss://dashscope.aliyuncs.com/api-ws/v1/inference",
+    segment: float = SEGMENT, overlap: float = OVERLAP, max_attempts: int = 3,
+    params: dict | None = None, name: str = "vod",
+) -> list[Cue]:
+    # cues of one audio track from its own start, indexes from 1
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    src = workdir.joinpath(f"{name}.mka")
+    cancelled = threading.Event()
+    futures: list[concurrent.futures.Future] = []
+
+    begin = time.monotonic()
+
+    try:
+        await download_audio(url, src)
+        logger.info(f"{name}: downloaded {src.stat().st_size / 1024 / 1024:.1f}MB of audio in {time.monotonic() - begin:.1f}s")
+
+        if not duration: duration = await probe_duration(src)
+
+        segments = plan_segments(round(duration * 1000), round(segment * 1000), round(overlap * 1000))
+        futures = [
+            pool.submit(pool.run_segment, src, seg, api_key, base_url, dict(params or {}), max_attempts, cancelled)
+            for seg in segments
+        ]
+
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        cues = stitch(zip(segments, results))
+
+        logger.info(f"{name}: {len(cues)} sentences from {len(segments)} segments in {time.monotonic() - begin:.1f}s")
+
+        return cues
+
+    finally:
+        # segments not started yet are dropped, running ones end on their own
+        cancelled.set()
+        for f in futures: f.cancel()
+        src.unlink(missing_ok=True)
+
+
+def configure(concurrency: int | None = None) -> None:
+    pool.configure(concurrency)
+
+
+def stats() -> dict:
+    return pool.stats()
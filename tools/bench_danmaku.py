@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from pathlib import Path
+
+from ddmajor.component.danmaku import DanmakuWriter, parse_event
+
+
+WORDS = "哈哈哈草好耶来了晚上好主播加油这波可以啊？！888"
+
+
+def make_events(count: int, live_ms: int, seed: int = 0) -> list[dict]:
+    # LiveDanmaku callback info as dispatched by bilibili_api, mostly chat with some gifts and super chats
+    rnd = random.Random(seed)
+    events = []
+
+    for k in range(count):
+        ts_ms = live_ms + 3600_000 + k
+        uid, uname = rnd.randint(1, 10**9), f"user{rnd.randint(0, 99999)}"
+        roll = rnd.random()
+
+        if roll < 0.9:
+            text = "".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 30)))
+            events.append({"type": "DANMU_MSG", "data": {
+                "cmd": "DANMU_MSG",
+                "info": [[0, 1, 25, 16777215, ts_ms, 0, 0, "", 0, 0, 0, "", 0, "{}", "{}", {}], text, [uid, uname, 0, 0, 0, 10000, 1, ""], [], [], {}],
+            }})
+        elif roll < 0.99:
+            events.append({"type": "SEND_GIFT", "data": {"cmd": "SEND_GIFT", "data": {
+                "uid": uid, "uname": uname, "giftName": "小心心", "num": rnd.randint(1, 10),
+                "timestamp": ts_ms // 1000, "coin_type": "gold", "total_coin": 100,
+            }}})
+        else:
+            events.append({"type": "SUPER_CHAT_MESSAGE", "data": {"cmd": "SUPER_CHAT_MESSAGE", "data": {
+                "uid": uid, "user_info": {"uname": uname}, "message": "主播辛苦了", "price": 30,
+                "start_time": ts_ms // 1000,
+            }}})
+
+    return events
+
+
+async def run(rate: int, seconds: float, batch: int, path: Path) -> dict:
+    live_ms = int(time.time() * 1000) - 3600_000
+    events = make_events(int(rate * seconds), live_ms)
+
+    writer = DanmakuWriter(path, batch=batch)
+    stop = False
+    lags = []
+
+    async def ticker() -> None:
+        # how late a 10ms timer fires is what the asr callback would see
+        while not stop:
+            begin = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - begin - 0.01)
+
+    async def flusher() -> None:
+        while not stop:
+            await asyncio.sleep(2)
+            writer.flush()
+
+    tick_task = asyncio.create_task(ticker())
+    flush_task = asyncio.create_task(flusher())
+
+    # websocket frames carry messages in bursts, deliver them 10ms at a time
+    per_tick = max(1, rate // 100)
+    begin = time.perf_counter()
+
+    for k in range(0, len(events), per_tick):
+        for event in events[k:k + per_tick]:
+            record = parse_event(event, live_ms)
+            if record: writer.append(record)
+
+        target = begin + (k + per_tick) / rate
+        await asyncio.sleep(max(0.0, target - time.perf_counter()))
+
+    stop = True
+    await writer.close()
+    elapsed = time.perf_counter() - begin
+
+    flush_task.cancel()
+    await asyncio.gather(tick_task, flush_task, return_exceptions=True)
+    lags.sort()
+
+    return {
+        "events": len(events),
+        "written": writer.written,
+        "dropped": writer.dropped,
+        "elapsed": elapsed,
+        "lag_p50": lags[len(lags) // 2] if lags else 0,
+        "lag_p99": lags[int(len(lags) * 0.99)] if lags else 0,
+        "lag_max": lags[-1] if lags else 0,
+        "bytes": os.path.getsize(path),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=int, nargs="+", default=[500, 2000, 10000], help="messages per second")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--batch", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'rate/s':>8}{'events':>9}{'written':>9}{'dropped':>9}{'wall(s)':>9}{'lag p50':>10}{'lag p99':>10}{'lag max':>10}{'B/msg':>7}")
+
+        for rate in args.rate:
+            path = Path(tmp).joinpath(f"1_{rate}.danmaku.jsonl")
+            r = asyncio.run(run(rate, args.seconds, args.batch, path))
+
+            with open(path, "rb") as f:
+                assert sum(1 for _ in f) == r["written"]
+                f.seek(0)
+                json.loads(f.readline())
+
+            print(
+                f"{rate:>8}{r['events']:>9}{r['written']:>9}{r['dropped']:>9}{r['elapsed']:>9.2f}"
+                f"{r['lag_p50'] * 1000:>8.2f}ms{r['lag_p99'] * 1000:>8.2f}ms{r['lag_max'] * 1000:>8.2f}ms"
+                f"{r['bytes'] / max(r['written'], 1):>7.0f}"
+            )
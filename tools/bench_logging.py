@@ -0,0 +1,94 @@
+import argparse
+import logging
+import threading
+import time
+
+import ddmajor.logging
+
+from ddmajor.logging import RateLimit, logger
+
+
+class SlowStream:
+
+    # a terminal or pipe that takes `delay` seconds per write
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, s: str) -> None:
+        time.sleep(self.delay)
+        self.lines += 1
+
+    def flush(self) -> None:
+        pass
+
+
+def caller_time(log: logging.Logger, threads: int, count: int, limit: RateLimit | None = None) -> float:
+    # seconds each task thread spends inside logging calls, worst thread
+    spent = [0.0] * threads
+
+    def _work(k: int) -> None:
+        for i in range(count):
+            begin = time.perf_counter()
+            if limit is None or limit():
+                log.debug("partial result %d from thread %d", i, k, extra={"stream_time": "00:00:01,000"})
+            spent[k] += time.perf_counter() - begin
+
+    workers = [threading.Thread(target=_work, args=(k,)) for k in range(threads)]
+    for w in workers: w.start()
+    for w in workers: w.join()
+
+    return max(spent)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=4, help="task threads logging at the same time")
+    parser.add_argument("--count", type=int, default=2000, help="messages per thread")
+    parser.add_argument("--delay", type=float, default=0.0002, help="seconds per write of the slow sink")
+    args = parser.parse_args()
+
+    total = args.threads * args.count
+
+    # baseline: the synchronous StreamHandler the package used before
+    direct = logging.getLogger("bench.direct")
+    direct.propagate = False
+    direct.setLevel(logging.DEBUG)
+    sink = SlowStream(args.delay)
+    sync_handler = logging.StreamHandler(sink) # type: ignore
+    sync_handler.setFormatter(ddmajor.logging.text_formatter)
+    direct.addHandler(sync_handler)
+
+    sync = caller_time(direct, args.threads, args.count)
+
+    # queued: same sink behind the listener thread
+    logger.setLevel(logging.DEBUG)
+    queued_sink = SlowStream(args.delay)
+    ddmajor.logging.handler.setStream(queued_sink) # type: ignore
+    log = logger.getChild("(bench)")
+    ddmajor.logging.bind(log, task="bench", room=1)
+
+    begin = time.perf_counter()
+    queued = caller_time(log, args.threads, args.count)
+    ddmajor.logging.stop()
+    drained = time.perf_counter() - begin
+    assert queued_sink.lines == total
+
+    ddmajor.logging.listener.start()
+
+    ddmajor.logging.set_format("json")
+    queued_json = caller_time(log, args.threads, args.count)
+    ddmajor.logging.stop()
+
+    ddmajor.logging.listener.start()
+
+    # partial results with a 1s rate limit per task
+    limited = caller_time(log, args.threads, args.count, RateLimit(1))
+    ddmajor.logging.stop()
+
+    print(f"{total} debug records from {args.threads} threads, sink {args.delay * 1e6:.0f} us/write")
+    print(f"sync StreamHandler   {sync / args.count * 1e6:>8.1f} us/call in task thread")
+    print(f"queue + text         {queued / args.count * 1e6:>8.1f} us/call in task thread, drained in {drained:.2f}s")
+    print(f"queue + json         {queued_json / args.count * 1e6:>8.1f} us/call in task thread")
+    print(f"queue + rate limit   {limited / args.count * 1e6:>8.1f} us/call in task thread")
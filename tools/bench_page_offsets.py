@@ -0,0 +1,97 @@
+import argparse
+import random
+import re
+import time
+
+from datetime import timedelta
+
+from ddmajor.component.keynote import remap_page_timestamps
+from ddmajor.srt import PageOffsets, srt_like_str_to_delta
+
+
+def make_llm_output(pages: list[dict], lines: int, shuffle: bool = False, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    total = sum(page["duration"] for page in pages)
+
+    stamps = sorted(rnd.uniform(0, total) for _ in range(lines))
+    if shuffle: rnd.shuffle(stamps)
+
+    output = ["本评论由DDMajor自动生成，仅供参考。", "", "一段看点总结。", ""]
+    for t in stamps:
+        t = int(t)
+        output.append(f"{t // 3600:02d}:{t % 3600 // 60:02d}:{t % 60:02d} 话题{rnd.randint(0, 999)}")
+
+    return "\n".join(output) + "\n"
+
+
+# the running-sum loop prepare_comment used before, kept as the baseline
+def legacy_remap(llm_resp: str, pages: list[dict]) -> str:
+    comment = ""
+
+    page = {}
+    p_number = 0
+    p_seconds = timedelta(microseconds=-1)
+    total_shift = timedelta(0)
+
+    for line in llm_resp.splitlines(keepends=True):
+        if re.match(r"^\d+:\d+.*? ", line):
+            tstr, content = line.lstrip().split(" ", maxsplit=1)
+
+            delta = srt_like_str_to_delta(tstr) - total_shift
+
+            if delta > p_seconds:
+                p_number += 1
+
+                page = {} if p_number > len(pages) else pages[p_number-1]
+                total_shift += p_seconds
+                p_seconds += timedelta(seconds=page.get("duration", 7200))
+
+                comment += f"\nP{p_number}\n"
+                delta = srt_like_str_to_delta(tstr) - total_shift
+
+            seconds = delta.total_seconds()
+            minutes = seconds // 60
+            seconds -= minutes * 60
+
+            comment += f"{int(minutes):02d}:{int(seconds):02d} {content}"
+
+        else:
+            comment += line
+
+    return comment
+
+
+def best_of(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - begin)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--lines", type=int, default=20000)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    pages = [{"duration": rnd.randint(1800, 7200)} for _ in range(args.pages)]
+
+    text = make_llm_output(pages, args.lines)
+
+    legacy = best_of(lambda: legacy_remap(text, pages))
+    bisect = best_of(lambda: remap_page_timestamps(text, PageOffsets.from_pages(pages)))
+
+    print(f"{args.lines} timestamps over {args.pages} parts")
+    print(f"legacy running sum  {legacy * 1000:>8.1f} ms")
+    print(f"page offset bisect  {bisect * 1000:>8.1f} ms")
+
+    # the running sum adds cumulative ends to the shift and drifts from the third part
+    # on, so only compare two-part outputs (a timestamp exactly on a part boundary now
+    # belongs to the next part, none in the fixture)
+    two = make_llm_output(pages[:2], 2000)
+    assert legacy_remap(two, pages[:2]) == remap_page_timestamps(two, PageOffsets.from_pages(pages[:2]))
+    print("two-part output matches legacy")
+
@@ -0,0 +1,138 @@
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable
+
+from ddmajor.srt import format_cue, iter_bili_subtitle, iter_srt_file, srt_like_str_to_delta, timedelta_to_srt
+from ddmajor.component.keynote import compress_srt
+
+
+def make_bili_body(hours: float, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    body = []
+
+    t, sid = 0.0, 0
+    while t < hours * 3600:
+        sid += 1
+        length = rnd.uniform(0.8, 6.0)
+        body.append({
+            "sid": sid,
+            "from": round(t, 3),
+            "to": round(t + length, 3),
+            "content": "".join(rnd.choice("今天我们来玩这个游戏好的对哈然后呢弹幕说") for _ in range(rnd.randint(4, 40))),
+        })
+        t += length + rnd.uniform(0.0, 2.0)
+
+    return body
+
+
+# implementations before the streaming rewrite, kept here as the baseline
+
+def legacy_bili_to_srt(body: list[dict]) -> str:
+    srt = ""
+    delta = timedelta(0)
+
+    for item in body:
+        t_from = delta + timedelta(seconds=float(item["from"]))
+        t_to   = delta + timedelta(seconds=float(item["to"]))
+        srt += (
+            f"{item['sid']}\n"
+            f"{timedelta_to_srt(t_from)} --> {timedelta_to_srt(t_to)}\n"
+            f"{item['content']}\n\n"
+        )
+
+    return srt
+
+
+def legacy_compress_srt(srt: str) -> str:
+    lines = srt.strip().splitlines()
+    output = []
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+
+        if line.isdigit():
+            if i + 1 < len(lines) and "-->" in lines[i+1]:
+
+                time_line = lines[i+1].strip()
+                start_time_str = time_line.split("-->")[0].strip()
+
+                delta = srt_like_str_to_delta(start_time_str)
+                total_seconds = int(delta.total_seconds())
+                timestamp = f"{total_seconds // 60:02d}:{total_seconds % 60:02d}"
+
+                content_lines = []
+                j = i + 2
+                while j < len(lines):
+                    content_line = lines[j].strip()
+                    if not content_line:
+                        break
+                    content_lines.append(content_line)
+                    j += 1
+
+                content = " ".join(content_lines)
+                if content:
+                    output.append(f"{timestamp} {content}")
+
+                i = j
+                continue
+
+        i += 1
+
+    return "\n".join(output)
+
+
+def measure(name: str, fn: Callable[[], object]) -> object:
+    tracemalloc.start()
+    begin = time.perf_counter()
+
+    result = fn()
+
+    elapsed = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<28} {elapsed * 1000:>10.1f} ms {peak / 1024 / 1024:>10.2f} MiB peak")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=10, help="length of the synthetic stream")
+    args = parser.parse_args()
+
+    body = make_bili_body(args.hours)
+    print(f"fixture: {args.hours}h, {len(body)} cues")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_fn = Path(tmp, "legacy.srt")
+        stream_fn = Path(tmp, "stream.srt")
+
+        def _legacy_write() -> None:
+            legacy_fn.write_text(legacy_bili_to_srt(body), encoding="utf-8")
+
+        def _stream_write() -> None:
+            with open(stream_fn, "w", encoding="utf-8") as f:
+                for cue in iter_bili_subtitle(body):
+                    f.write(format_cue(cue) + "\n")
+
+        measure("convert (legacy +=)", _legacy_write)
+        measure("convert (streaming)", _stream_write)
+        assert legacy_fn.read_bytes() == stream_fn.read_bytes()
+
+        def _legacy_compress() -> str:
+            with open(legacy_fn, "r", encoding="utf-8") as f:
+                return legacy_compress_srt(f.read())
+
+        old = measure("compress (legacy)", _legacy_compress)
+        new = measure("compress (streaming)", lambda: compress_srt(iter_srt_file(stream_fn)))
+        assert old == new
+
+        # the joined prompt itself is unavoidable, report it for reference
+        print(f"compressed prompt size: {len(new.encode()) / 1024 / 1024:.2f} MiB") # type: ignore
@@ -0,0 +1,171 @@
+import argparse
+import random
+import time
+
+from datetime import timedelta
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from ddmajor.srt import Cue, compress_cues, format_srt, ms_to_srt, parse_srt, srt_to_ms
+
+
+# timedelta based implementations before the integer millisecond rewrite, kept here as the baseline
+
+class LegacyCue(NamedTuple):
+    index: int
+    start: timedelta
+    end: timedelta
+    text: str
+
+
+def legacy_timedelta_to_srt(td: timedelta):
+    total_seconds = td.total_seconds()
+
+    hours = int(total_seconds // 3600)
+    minutes = int((total_seconds % 3600) // 60)
+    seconds = int(total_seconds % 60)
+    milliseconds = int(round((total_seconds - int(total_seconds)) * 1000))
+
+    if milliseconds == 1000:
+        seconds += 1
+        milliseconds = 0
+
+    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
+
+
+def legacy_srt_like_str_to_delta(tstr: str) -> timedelta:
+    ts = tstr.split(",", maxsplit=1)
+
+    delta = timedelta(0)
+
+    if len(ts) >= 2:
+        try:
+            delta += timedelta(milliseconds=float(ts[1]))
+        except Exception:
+            pass
+
+    count = 0
+    for t in ts[0].replace("：", ":").split(":"):
+        it = 0
+        try:
+            it = int(t)
+        except Exception:
+            pass
+
+        count = count * 60 + it
+
+    return delta + timedelta(seconds=count)
+
+
+def legacy_iter_srt(lines: Iterable[str]) -> Iterator[LegacyCue]:
+    index = None
+    start = end = None
+    content: list[str] = []
+
+    for line in lines:
+        line = line.strip()
+
+        if start is None:
+            if index is None:
+                if line.isdigit(): index = int(line)
+            elif "-->" in line:
+                tfrom, tto = line.split("-->", maxsplit=1)
+                start, end = legacy_srt_like_str_to_delta(tfrom.strip()), legacy_srt_like_str_to_delta(tto.strip())
+            else:
+                index = int(line) if line.isdigit() else None
+            continue
+
+        if line:
+            content.append(line)
+            continue
+
+        if content: yield LegacyCue(index, start, end, " ".join(content)) # type: ignore
+
+        index = None
+        start = end = None
+        content = []
+
+    if start is not None and content:
+        yield LegacyCue(index, start, end, " ".join(content)) # type: ignore
+
+
+def legacy_format_srt(cues: Iterable[LegacyCue]) -> str:
+    return "".join(
+        f"{cue.index}\n{legacy_timedelta_to_srt(cue.start)} --> {legacy_timedelta_to_srt(cue.end)}\n{cue.text}\n\n"
+        for cue in cues
+    )
+
+
+def legacy_compress_cues(cues: Iterable[LegacyCue]) -> Iterator[str]:
+    for cue in cues:
+        total_seconds = int(cue.start.total_seconds())
+        if cue.text:
+            yield f"{total_seconds // 60:02d}:{total_seconds % 60:02d} {cue.text}"
+
+
+def make_cues(count: int, seed: int = 0) -> list[Cue]:
+    rnd = random.Random(seed)
+    cues = []
+
+    t = 0
+    for k in range(count):
+        length = rnd.randint(800, 6000)
+        text = "".join(rnd.choice("今天我们来玩这个游戏好的对哈然后呢弹幕说") for _ in range(rnd.randint(4, 40)))
+        cues.append(Cue(k + 1, t, t + length, text))
+        t += length + rnd.randint(0, 2000)
+
+    return cues
+
+
+def best(fn: Callable[[], object], repeat: int) -> tuple[float, object]:
+    elapsed, result = float("inf"), None
+
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = fn()
+        elapsed = min(elapsed, time.perf_counter() - begin)
+
+    return elapsed, result
+
+
+def report(name: str, count: int, legacy: float, current: float) -> None:
+    print(f"{name:<10} {count / legacy / 1000:>10.0f} {count / current / 1000:>10.0f} k cues/s {legacy / current:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 100_000], help="cues per fixture")
+    parser.add_argument("--repeat", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    for count in args.sizes:
+        cues = make_cues(count)
+        text = format_srt(cues)
+        lines = text.splitlines()
+
+        legacy_cues = [LegacyCue(c.index, timedelta(milliseconds=c.start_ms), timedelta(milliseconds=c.end_ms), c.text) for c in cues]
+
+        print(f"fixture: {count} cues, {len(text.encode()) / 1024 / 1024:.1f} MiB srt")
+        print(f"{'':<10} {'legacy':>10} {'current':>10}")
+
+        t_old, parsed_old = best(lambda: list(legacy_iter_srt(lines)), args.repeat)
+        t_new, parsed_new = best(lambda: parse_srt(text), args.repeat)
+        report("parse", count, t_old, t_new)
+        assert parsed_new == cues
+
+        t_old, text_old = best(lambda: legacy_format_srt(legacy_cues), args.repeat)
+        t_new, text_new = best(lambda: format_srt(cues), args.repeat)
+        report("format", count, t_old, t_new)
+        assert text_new == text_old == text
+
+        t_old, compressed_old = best(lambda: "\n".join(legacy_compress_cues(legacy_cues)), args.repeat)
+        t_new, compressed_new = best(lambda: "\n".join(compress_cues(cues)), args.repeat)
+        report("compress", count, t_old, t_new)
+        assert compressed_new == compressed_old
+
+        print()
+
+    # timestamps just below a full second, where the float path used to print ",1000" or ":60"
+    edge = [timedelta(seconds=s, microseconds=999_600) for s in range(0, 7200, 7)]
+    broken = sum(1 for td in edge if ",1000" in legacy_timedelta_to_srt(td) or ":60," in legacy_timedelta_to_srt(td))
+    exact = all(srt_to_ms(ms_to_srt(ms)) == ms for ms in range(0, 100 * 3600 * 1000, 9_973))
+    print(f"rounding: legacy broke {broken}/{len(edge)} timestamps at x.9996s, current round-trips exactly: {exact}")
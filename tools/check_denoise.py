@@ -0,0 +1,26 @@
+from ddmajor.transcript import collapse_repeats, denoise_transcript
+
+
+# numbers are what the summary quotes back, denoising must never change them
+
+CASES = [
+    ("哈哈哈哈哈", "哈哈"),
+    ("好的好的好的好的", "好的好的"),
+    ("对，对，对，对，对", "对，对"),
+    ("奖金10000元，房间号123123123", "奖金10000元，房间号123123123"),
+    ("1111年", "1111年"),
+    ("０００００号", "０００００号"),
+    ("abcabcabc", "abcabcabc"),
+    ("666666", "666666"),
+    ("哈哈哈哈10000", "哈哈10000"),
+]
+
+
+if __name__ == "__main__":
+    for text, expected in CASES:
+        assert (got := collapse_repeats(text)) == expected, f"{text!r} -> {got!r}, expected {expected!r}"
+
+    denoised = denoise_transcript("00:01 奖金10000元\n00:02 哈哈哈哈哈\n00:05 房间号123123123", {"merge_seconds": 0})
+    assert "10000" in denoised and "123123123" in denoised, denoised
+
+    print(f"{len(CASES)} collapse cases passed, numbers survive denoise_transcript")
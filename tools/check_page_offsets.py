@@ -0,0 +1,103 @@
+import argparse
+import random
+
+from ddmajor.component.keynote import remap_page_timestamps
+from ddmajor.srt import PageOffsets
+
+
+# randomized properties of PageOffsets and remap_page_timestamps, no extra dependency:
+#   - locate() inverts start() for any timestamp, in order or not, past the end or not
+#   - the part found is the one whose span holds the timestamp, the last part takes the overflow
+#   - a missing or zero duration counts as the default
+#   - remap keeps one line per timestamp and prints each one relative to its part
+
+
+def random_durations(rnd: random.Random) -> list[float | None]:
+    return [
+        rnd.choice([None, 0, rnd.uniform(1, 600), rnd.randint(600, 14400)])
+        for _ in range(rnd.randint(1, 12))
+    ]
+
+
+def check_locate(rnd: random.Random, durations: list[float | None], default: float) -> None:
+    offsets = PageOffsets(durations, default)
+    spans = [float(d) if d else default for d in durations]
+    total = sum(spans)
+
+    assert len(offsets) == len(durations)
+    assert offsets.start(0) == 0
+    for k in range(1, len(spans)):
+        assert abs(offsets.start(k) - sum(spans[:k])) < 1e-6
+
+    stamps = [rnd.uniform(0, total * 1.5) for _ in range(200)] + [offsets.start(k) for k in range(len(spans))]
+    rnd.shuffle(stamps) # the llm does not always go forward
+
+    for seconds in stamps:
+        page, local = offsets.locate(seconds)
+
+        assert 0 <= page < len(spans)
+        assert abs(offsets.start(page) + local - seconds) < 1e-6
+        assert local >= 0
+
+        if page < len(spans) - 1:
+            assert local < spans[page], (seconds, page, local, spans)
+        else:
+            assert seconds >= offsets.start(page) # past the end stays on the last part
+
+    page, local = offsets.locate(-5)
+    assert page == 0 and local == -5
+
+
+def check_remap(rnd: random.Random, durations: list[float | None], default: float) -> None:
+    offsets = PageOffsets(durations, default)
+    total = sum(float(d) if d else default for d in durations)
+
+    stamps = [int(rnd.uniform(0, total * 1.2)) for _ in range(50)]
+    rnd.shuffle(stamps)
+
+    text = "总结\n\n" + "".join(f"{t // 3600:02d}:{t % 3600 // 60:02d}:{t % 60:02d} 话题{k}\n" for k, t in enumerate(stamps))
+    remapped = remap_page_timestamps(text, offsets).splitlines()
+
+    current = None
+    seen = []
+    for line in remapped:
+        if line.startswith("P") and line[1:].isdigit():
+            current = int(line[1:]) - 1
+            continue
+        if " 话题" not in line: continue
+
+        tstr, topic = line.split(" ", maxsplit=1)
+        minutes, seconds = map(int, tstr.split(":"))
+        k = int(topic.removeprefix("话题"))
+
+        page, local = offsets.locate(stamps[k])
+        assert current == page, (line, page)
+        assert minutes * 60 + seconds == int(local), (line, local)
+        seen.append(k)
+
+    assert sorted(seen) == list(range(len(stamps)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+
+    for run in range(args.runs):
+        durations = random_durations(rnd)
+        default = rnd.choice([7200.0, rnd.uniform(60, 7200)])
+
+        try:
+            check_locate(rnd, durations, default)
+            check_remap(rnd, durations, default)
+        except AssertionError:
+            print(f"failed on run {run}: durations={durations} default={default}")
+            raise
+
+    # no pages at all behaves like one part of the default length
+    assert len(PageOffsets([])) == 1 and PageOffsets([]).locate(9000) == (0, 9000)
+
+    print(f"{args.runs} randomized page layouts passed")